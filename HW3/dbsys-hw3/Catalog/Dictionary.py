@@ -0,0 +1,180 @@
+import ast
+
+class ColumnDictionary:
+  """
+  A dictionary for encoding the values of a low-cardinality column.
+
+  Each distinct value is assigned a small integer code, in order of first
+  appearance. Tuples then store the code in place of the value.
+
+  >>> d = ColumnDictionary()
+  >>> [d.encode(v) for v in ['AIR', 'RAIL', 'AIR', 'SHIP']]
+  [0, 1, 0, 2]
+
+  >>> d.decode(1)
+  'RAIL'
+
+  # Lookups do not add values to the dictionary.
+  >>> d.lookup('SHIP'), d.lookup('TRUCK')
+  (2, None)
+
+  >>> len(d)
+  3
+
+  # Values are normalized as with deserialized character fields.
+  >>> d.encode(b'AIR\\x00\\x00')
+  0
+
+  >>> ColumnDictionary(values=d.values).lookup('RAIL')
+  1
+
+  # Values are truncated to the field size, if given, as with plain character fields.
+  >>> d.encode('RAILWAY', size=4), d.encode('SHIPPING', size=4), len(d)
+  (1, 2, 3)
+  """
+
+  # Codes are stored as unsigned shorts.
+  codeFormat = 'H'
+  maxCodes   = 1 << 16
+
+  def __init__(self, **kwargs):
+    self.values = list(kwargs.get("values", []))
+    self.codes  = dict([(v, i) for (i, v) in enumerate(self.values)])
+    self.dirty  = False
+
+  def __len__(self):
+    return len(self.values)
+
+  @classmethod
+  def normalize(cls, value, size=None):
+    if size is not None:
+      value = (value.encode() if isinstance(value, str) else value)[:size]
+    return (value.decode() if isinstance(value, bytes) else value).rstrip("\x00 \n")
+
+  # Returns the code for a value, adding the value to the dictionary if needed.
+  # Values are first truncated to 'size' bytes, when given.
+  def encode(self, value, size=None):
+    value = ColumnDictionary.normalize(value, size)
+    code  = self.codes.get(value, None)
+    if code is None:
+      if len(self.values) >= ColumnDictionary.maxCodes:
+        raise ValueError("Too many distinct values for a dictionary-encoded column")
+      code = len(self.values)
+      self.values.append(value)
+      self.codes[value] = code
+      self.dirty = True
+    return code
+
+  # Returns the code for a value, or None if the value is not in the dictionary.
+  def lookup(self, value):
+    return self.codes.get(ColumnDictionary.normalize(value), None)
+
+  def decode(self, code):
+    return self.values[code]
+
+
+class EncodedPredicateRewriter(ast.NodeTransformer):
+  """
+  Rewrites a predicate on a schema with dictionary-encoded fields to
+  compare codes rather than values.
+
+  Equality, inequality, and membership tests between an encoded field and
+  string constants are rewritten to use the constants' codes. Constants
+  absent from the dictionary are replaced by an invalid code, since they
+  cannot match any tuple.
+
+  The rewrite only succeeds if every reference to an encoded field occurs
+  in such a comparison. Otherwise, 'rewrite' returns None and the predicate
+  must be evaluated on decoded values.
+
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('lineitem', [('id', 'int'), ('mode', 'char(10)')], \
+                        {'mode': ColumnDictionary(values=['AIR', 'RAIL', 'SHIP'])})
+
+  >>> expr = EncodedPredicateRewriter.rewrite("id < 5 and mode == 'RAIL'", schema)
+  >>> eval(expr, {}, {'id': 1, 'mode': 1}), eval(expr, {}, {'id': 1, 'mode': 2})
+  (True, False)
+
+  >>> expr = EncodedPredicateRewriter.rewrite("mode in ['AIR', 'SHIP', 'TRUCK']", schema)
+  >>> [eval(expr, {}, {'mode': code}) for code in range(3)]
+  [True, False, True]
+
+  >>> expr = EncodedPredicateRewriter.rewrite("'TRUCK' != mode", schema)
+  >>> eval(expr, {}, {'mode': 0})
+  True
+
+  # Other uses of encoded fields cannot be rewritten.
+  >>> EncodedPredicateRewriter.rewrite("mode.startswith('A')", schema) is None
+  True
+
+  >>> EncodedPredicateRewriter.rewrite("mode < 'B'", schema) is None
+  True
+  """
+
+  invalidCode = -1
+
+  def __init__(self, dictionaries):
+    self.dictionaries = dictionaries
+    self.valid        = True
+
+  # Returns a compiled predicate over codes, or None if the predicate
+  # cannot be evaluated on codes alone.
+  @classmethod
+  def rewrite(cls, expr, schema):
+    tree = cls.rewriteTree(expr, schema)
+    if tree is not None:
+      return compile(tree, '<predicate>', 'eval')
+
+  # Returns the syntax tree of the predicate over codes, or None.
+  @classmethod
+  def rewriteTree(cls, expr, schema):
+    if schema.dictionaries:
+      rewriter = cls(schema.dictionaries)
+      tree = ast.fix_missing_locations(rewriter.visit(ast.parse(expr, mode='eval')))
+      if rewriter.valid:
+        return tree
+
+  @classmethod
+  def constantValue(cls, node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+      return node.value
+    raise ValueError("Non-constant operand in an encoded comparison")
+
+  def codeNode(self, field, node):
+    code = self.dictionaries[field].lookup(EncodedPredicateRewriter.constantValue(node))
+    return ast.copy_location(ast.Constant(value=EncodedPredicateRewriter.invalidCode \
+                                                   if code is None else code), node)
+
+  def encodedField(self, node):
+    return node.id if isinstance(node, ast.Name) and node.id in self.dictionaries else None
+
+  def visit_Compare(self, node):
+    if len(node.ops) == 1:
+      (op, lhs, rhs) = (node.ops[0], node.left, node.comparators[0])
+      try:
+        if isinstance(op, (ast.Eq, ast.NotEq)):
+          if self.encodedField(lhs):
+            return ast.copy_location(ast.Compare(left=lhs, ops=[op], \
+                                       comparators=[self.codeNode(lhs.id, rhs)]), node)
+          elif self.encodedField(rhs):
+            return ast.copy_location(ast.Compare(left=self.codeNode(rhs.id, lhs), ops=[op], \
+                                       comparators=[rhs]), node)
+
+        elif isinstance(op, (ast.In, ast.NotIn)) and self.encodedField(lhs) \
+              and isinstance(rhs, (ast.List, ast.Tuple, ast.Set)):
+          codes = ast.Tuple(elts=[self.codeNode(lhs.id, e) for e in rhs.elts], ctx=ast.Load())
+          return ast.copy_location(ast.Compare(left=lhs, ops=[op], comparators=[codes]), node)
+
+      except ValueError:
+        pass
+
+    return self.generic_visit(node)
+
+  def visit_Name(self, node):
+    if node.id in self.dictionaries:
+      self.valid = False
+    return node
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
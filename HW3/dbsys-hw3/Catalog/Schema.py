@@ -1,7 +1,9 @@
-import json, re
+import datetime, decimal, functools, json, re, struct
 from collections import namedtuple, OrderedDict
 from struct import Struct
 
+from Catalog.Dictionary import ColumnDictionary
+
 class Types:
   """
   Utility functions for database types.
@@ -12,6 +14,51 @@ class Types:
 
   The list of supported types in the database is given by the keys
   of the 'types' dictionary.
+
+  Dates and fixed-point decimals have compact binary encodings that compare
+  correctly as raw bytes, so that index keys and range tests over packed
+  tuples need not decode them. A 'date' is stored as its day number in four
+  big-endian bytes, and its values are ISO 'YYYY-MM-DD' strings (dates may
+  also be given as date objects or as yyyymmdd integers). A 'decimal(p,s)'
+  holds up to p digits, s of them after the decimal point, and is stored as
+  its scaled integer value in eight big-endian bytes, offset to be unsigned.
+  Decimal values are presented as floats rounded to their scale, so their
+  precision is limited to the 15 digits that floats represent exactly.
+
+  >>> Types.formatType('date'), Types.formatType('decimal(12,2)')
+  ('4s', '8s')
+  >>> Types.formatType('decimal(19,2)') == Types.formatType('decimal(4,5)') == Types.formatType('char(4,2)') == None
+  True
+  >>> Types.formatType('decimal(16,2)') == None
+  True
+
+  >>> schema = DBSchema('lineitem', [('shipdate', 'date'), ('price', 'decimal(12,2)')])
+  >>> schema.size
+  12
+  >>> t = schema.pack(schema.instantiate('1994-01-01', 1234.565))
+  >>> schema.unpack(t)
+  lineitem(shipdate='1994-01-01', price=1234.56)
+  >>> schema.unpack(schema.pack(schema.instantiate(19931231, '-0.5')))
+  lineitem(shipdate='1993-12-31', price=-0.5)
+
+  # Packed values order as their values.
+  >>> dates  = ['1994-01-01', '1993-12-31', '2001-02-03', '1994-01-02']
+  >>> prices = [1234.56, -0.5, 0, -1234.56, 99999.99]
+  >>> (toDate, _), (toPrice, _) = Types.converters('date'), Types.converters('decimal(12,2)')
+  >>> sorted(dates, key=toDate) == sorted(dates)
+  True
+  >>> sorted(prices, key=toPrice) == sorted(prices)
+  True
+
+  # Values at the maximum precision round-trip exactly.
+  >>> (toWide, fromWide) = Types.converters('decimal(15,2)')
+  >>> [fromWide(toWide(v)) for v in ['9999999999999.99', '-1234567890123.45', '0.07']]
+  [9999999999999.99, -1234567890123.45, 0.07]
+
+  >>> toPrice(10 ** 10)
+  Traceback (most recent call last):
+  ...
+  ValueError: Value out of range for decimal(12,2): 10000000000
   """
   types = {
       # name, pack_letter, needs_len, default_val, from_string
@@ -21,16 +68,75 @@ class Types:
       'float'   : ('f', False, 0.0, lambda x: float(x)),
       'double'  : ('d', False, 0.0, lambda x: float(x)),
       'char'    : ('s', True, chr(0), lambda x: x),
-      'text'    : ('s', True, chr(0), lambda x: x)
+      'text'    : ('s', True, chr(0), lambda x: x),
+      'date'    : ('4s', False, '', lambda x: x),
+      'decimal' : ('8s', True, 0.0, lambda x: x)
     }
 
+  # Types taking a precision and scale, i.e., 'decimal(p,s)', whose struct
+  # format does not depend on their parameters.
+  scaledTypes  = ['decimal']
+  maxPrecision = 15
+  decimalBias  = 1 << 63
+
+  # NumPy type codes for the types whose encodings order as raw bytes.
+  orderedTypes = {'date': '>u4', 'decimal': '>u8'}
+
+  # NumPy type codes by struct format, for viewing packed tuples as arrays.
+  # Character sequences map to fixed-length byte strings of the same size.
+  numpyFormats = {'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'f': 'f4', 'd': 'f8', 's': 'S'}
+
+  @classmethod
+  def numpy(cls):
+    try:
+      import numpy
+    except ImportError:
+      raise ValueError("Array representations of tuples require numpy")
+    return numpy
+
+  @classmethod
+  def numpyFormat(cls, format, typeDesc=None):
+    """
+    Converts a C-struct format into a NumPy type code in native byte order.
+    Fields of types with ordered encodings are viewed as big-endian integers.
+
+    >>> Types.numpyFormat('i'), Types.numpyFormat('100s'), Types.numpyFormat('4s', 'date')
+    ('=i4', 'S100', '>u4')
+    """
+    if typeDesc and Types.isOrdered(typeDesc):
+      return Types.orderedTypes[Types.parseType(typeDesc)["typeStr"]]
+    if format.endswith('s'):
+      return Types.numpyFormats['s'] + format[:-1]
+    return '=' + Types.numpyFormats[format]
+
+  typeMatcher  = re.compile(r"(?P<typeStr>\w+)(\((?P<size>\d+)(,\s*(?P<scale>\d+))?\))?(?P<rest>.*)")
+
+  # Type prefixes of character sequences, which are bytes when serialized.
+  charPrefixes = ('char', 'text')
+
   @classmethod
   def parseType(cls, typeDesc):
-    typeMatcher = re.compile("(?P<typeStr>\w+)(\((?P<size>\d+)\))?(?P<rest>.*)")
-    match = typeMatcher.match(typeDesc)
+    match = Types.typeMatcher.match(typeDesc)
     if match:
       return match.groupdict()
 
+  # Returns the declared size of a character type, or None if unsized.
+  @classmethod
+  def charSize(cls, typeDesc):
+    matches = Types.parseType(typeDesc)
+    return int(matches["size"]) if matches and matches["size"] else None
+
+  # Returns whether a precision and scale are valid for a decimal type.
+  @classmethod
+  def validScale(cls, size, scale):
+    return bool(size) and 0 < int(size) <= Types.maxPrecision and int(scale or 0) <= int(size)
+
+  # Returns whether values of the given type are encoded to order as raw bytes.
+  @classmethod
+  def isOrdered(cls, typeDesc):
+    matches = Types.parseType(typeDesc)
+    return bool(matches) and matches["typeStr"] in Types.orderedTypes
+
   @classmethod
   def formatType(cls, typeDesc):
     """
@@ -62,11 +168,14 @@ class Types:
     if matches:
       typeStr = matches.get("typeStr", None)
       size    = matches.get("size", None)
+      scale   = matches.get("scale", None)
       rest    = matches.get("rest", None)
       if not rest:
         (format, requiresSize, _, _) = Types.types.get(typeStr, (None, None, None, None))
-        if requiresSize:
-          format = size+format if size else None
+        if typeStr in Types.scaledTypes:
+          format = format if Types.validScale(size, scale) else None
+        elif requiresSize:
+          format = size+format if size and scale is None else None
         else:
           format = format if not size else None
 
@@ -94,11 +203,14 @@ class Types:
     if matches:
       typeStr = matches.get("typeStr", None)
       size    = matches.get("size", None)
+      scale   = matches.get("scale", None)
       rest    = matches.get("rest", None)
       if not rest:
         (_, requiresSize, val, _) = Types.types.get(typeStr, (None, None, None, None))
-        if requiresSize:
-          default = val * 0 if size else None
+        if typeStr in Types.scaledTypes:
+          default = val if Types.validScale(size, scale) else None
+        elif requiresSize:
+          default = val * 0 if size and scale is None else None
         else:
           default = val if not size else None
 
@@ -114,14 +226,79 @@ class Types:
     For now, this converts character sequences from Python strings
     into bytes for Python's struct module.
     """
-    prefixes = ['char', 'text']
-    if list(filter(typeDesc.startswith, prefixes)):
-      if forSerialization:
-        return value.encode() if isinstance(value, str) else value
-      else:
-        return (value.decode() if isinstance(value, bytes) else value).rstrip("\x00 \n")
-    else:
-      return value
+    (toBinary, fromBinary) = Types.converters(typeDesc)
+    converter = toBinary if forSerialization else fromBinary
+    return converter(value) if converter else value
+
+  @classmethod
+  def converters(cls, typeDesc):
+    """
+    Returns a pair of functions converting values of the given type to and
+    from their struct module representation, with None for values needing
+    no conversion.
+
+    >>> (toBinary, fromBinary) = Types.converters('char(10)')
+    >>> toBinary('abc'), fromBinary(b'abc\\x00\\x00')
+    (b'abc', 'abc')
+
+    >>> Types.converters('int')
+    (None, None)
+    """
+    if typeDesc.startswith(Types.charPrefixes):
+      return (Types.encodeChars, Types.decodeChars)
+
+    matches = Types.parseType(typeDesc)
+    typeStr = matches.get("typeStr", None) if matches else None
+    if typeStr == 'date':
+      return (Types.encodeDate, Types.decodeDate)
+    elif typeStr == 'decimal':
+      return Types.decimalConverters(int(matches["size"]), int(matches["scale"] or 0))
+    return (None, None)
+
+  @classmethod
+  def encodeChars(cls, value):
+    return value.encode() if isinstance(value, str) else value
+
+  @classmethod
+  def decodeChars(cls, value):
+    return (value.decode() if isinstance(value, bytes) else value).rstrip("\x00 \n")
+
+  # Dates are encoded as their day number, with the empty date as zero.
+  @classmethod
+  def encodeDate(cls, value):
+    if isinstance(value, int):
+      value = datetime.date(value // 10000, value // 100 % 100, value % 100)
+    elif isinstance(value, (str, bytes)):
+      value = Types.decodeChars(value)
+      value = datetime.datetime.strptime(value, "%Y-%m-%d").date() if value else None
+    return (value.toordinal() if value else 0).to_bytes(4, 'big')
+
+  @classmethod
+  def decodeDate(cls, value):
+    day = int.from_bytes(value, 'big')
+    return datetime.date.fromordinal(day).isoformat() if day else ''
+
+  # Returns converters for decimals with the given precision and scale.
+  # Decimals are encoded as their value scaled to an integer, biased to be
+  # non-negative so that their big-endian bytes order as their values.
+  @classmethod
+  def decimalConverters(cls, precision, scale):
+    bound = 10 ** precision
+    unit  = 10 ** scale
+    def toBinary(value):
+      if isinstance(value, bytes):
+        value = value.decode()
+      if not isinstance(value, (int, decimal.Decimal)):
+        value = str(value).strip()
+      scaled = int(decimal.Decimal(value).scaleb(scale).to_integral_value(rounding=decimal.ROUND_HALF_EVEN))
+      if abs(scaled) >= bound:
+        raise ValueError("Value out of range for decimal(" + str(precision) + "," + str(scale) + "): " + str(value))
+      return (scaled + Types.decimalBias).to_bytes(8, 'big')
+
+    def fromBinary(value):
+      return (int.from_bytes(value, 'big') - Types.decimalBias) / unit
+
+    return (toBinary, fromBinary)
 
   @classmethod
   def valueFromString(cls, string, typeDesc):
@@ -136,7 +313,7 @@ class Types:
       rest    = matches.get("rest", None)
       if not rest and typeStr:
         (_, requiresSize, val, conv_lambda) = Types.types.get(typeStr, (None, None, None, None))
-        if requiresSize:
+        if requiresSize and typeStr not in Types.scaledTypes:
           if size:
             rem_length = int(size) - len(string)
             string = string + val * rem_length
@@ -199,16 +376,94 @@ class DBSchema:
 
   >>> schema.match(DBSchema('employee2', [('id', 'int'), ('dob', 'char(10)'), ('salary', 'int')]))
   True
+
+  # Field offsets include the struct module's alignment padding.
+  >>> schema.fieldLayout()
+  [(0, 4), (4, 10), (16, 4)]
+
+  Character fields with few distinct values may be dictionary-encoded, by
+  supplying a ColumnDictionary per field. Packed tuples then store a two-byte
+  code for the field, while unpacked tuples hold the original value.
+
+  >>> from Catalog.Dictionary import ColumnDictionary
+  >>> eschema = DBSchema('shipment', [('id', 'int'), ('mode', 'char(10)')], {'mode': ColumnDictionary()})
+  >>> eschema.size
+  6
+
+  >>> s1 = eschema.instantiate(1, 'RAIL')
+  >>> eschema.unpack(eschema.pack(s1))
+  shipment(id=1, mode='RAIL')
+
+  >>> eschema.unpack(eschema.pack(s1), decode=False)
+  shipment(id=1, mode=0)
+
+  # Projection and renaming preserve encodings.
+  >>> eschema.rename('shipment2', {'id': 'id2', 'mode': 'mode2'}).size
+  6
+
+  >>> eschema.subschema(['mode']).unpack(b'\\x00\\x00')
+  shipment(mode='RAIL')
+
+  # Serialized schemas include dictionary contents, unless requested otherwise.
+  >>> DBSchema.unpackSchema(eschema.packSchema()).dictionaries['mode'].values
+  ['RAIL']
+
+  >>> DBSchema.unpackSchema(eschema.packSchema(dictionaryValues=False)).dictionaries['mode'].values
+  []
+
+  # Encoded values are truncated to the declared size, as are plain values.
+  >>> eschema.unpack(eschema.pack(eschema.instantiate(2, 'RAIL FREIGHT')))
+  shipment(id=2, mode='RAIL FREIG')
+
+  Packed tuples may be viewed as NumPy structured arrays, whose dtype follows
+  the struct layout including any padding, and holds codes for encoded fields.
+
+  >>> import numpy
+  >>> dtype = schema.numpyDtype()
+  >>> dtype.itemsize == schema.size, dtype.fields['salary'][1]
+  (True, 16)
+  >>> rows = numpy.frombuffer(schema.pack(e1) * 2, dtype=dtype)
+  >>> rows['salary'].tolist(), rows['dob'].tolist()
+  ([100000, 100000], [b'1990-01-01', b'1990-01-01'])
+  >>> numpy.frombuffer(eschema.pack(s1), dtype=eschema.numpyDtype())['mode'].tolist()
+  [0]
+
+  Each schema compiles a codec of per-field conversions, used to unpack many
+  packed tuples in one pass, and to pack tuples directly into a buffer.
+
+  >>> buffer = bytearray(2 * schema.size)
+  >>> schema.packInto(buffer, schema.size, e1)
+  >>> schema.unpackMany(buffer)
+  [employee(id=0, dob='', salary=0), employee(id=1, dob='1990-01-01', salary=100000)]
+  >>> schema.unpackFrom(buffer, schema.size) == e1
+  True
+
+  >>> eschema.unpackMany(eschema.pack(s1) * 2, decode=False)
+  [shipment(id=1, mode=0), shipment(id=1, mode=0)]
   """
 
-  def __init__(self, name, fieldsAndTypes):
+  maxProjectors = 64
+
+  def __init__(self, name, fieldsAndTypes, dictionaries=None):
     self.name = name
     if self.name and fieldsAndTypes:
       self.fields  = [x[0] for x in fieldsAndTypes]
       self.types   = [x[1] for x in fieldsAndTypes]
+      self.dictionaries = dictionaries if dictionaries else {}
+
+      for f in self.dictionaries:
+        if f not in self.fields or not self.types[self.fields.index(f)].startswith(Types.charPrefixes):
+          raise ValueError("Invalid dictionary-encoded field in schema: "+f)
+
+      self.encoders = [self.dictionaries.get(f, None) for f in self.fields]
+      self.formats  = [ColumnDictionary.codeFormat if d is not None else Types.formatType(t) \
+                         for (t, d) in zip(self.types, self.encoders)]
       self.clazz   = namedtuple(self.name, self.fields)
-      self.binrepr = Struct(''.join([Types.formatType(x) for x in self.types]))
+      self.binrepr = Struct(''.join(self.formats))
       self.size    = self.binrepr.size
+      self.dtype   = None
+      self.projectors = {}
+      self.compileCodec()
     else:
       raise ValueError("Invalid attributes when constructing a schema")
 
@@ -232,13 +487,47 @@ class DBSchema:
   # attrNameMap = {'a': 'a2', 'b': 'b2'}
   def rename(self, schemaName, attrNameMap):
     newFields = [attrNameMap[x] for x in self.fields]
-    return DBSchema(schemaName, list(zip(newFields, self.types)))
+    newDictionaries = dict([(attrNameMap[f], d) for (f, d) in self.dictionaries.items()])
+    return DBSchema(schemaName, list(zip(newFields, self.types)), newDictionaries)
+
+  # Returns a schema with the given subset of fields, in the order of this schema.
+  # Any dictionary encodings for the retained fields are preserved.
+  def subschema(self, fields, schemaName=None):
+    return DBSchema(schemaName if schemaName else self.name, \
+                    [(f, t) for (f, t) in self.schema() if f in fields], \
+                    dict([(f, d) for (f, d) in self.dictionaries.items() if f in fields]))
 
   # Return a list of fields and types of the schema
   def schema(self):
     if self.fields and self.types:
       return list(zip(self.fields, self.types))
 
+  # Return a list of (offset, size) pairs locating each field in a packed tuple.
+  # Offsets account for any alignment padding inserted by the struct module.
+  def fieldLayout(self):
+    layout = []
+    prefix = ''
+    for fmt in self.formats:
+      end = struct.calcsize(prefix + fmt)
+      size = struct.calcsize(fmt)
+      layout.append((end - size, size))
+      prefix += fmt
+    return layout
+
+  # Returns a NumPy structured dtype laid out as packed tuples of this schema.
+  # The dtype is built on first use, so that NumPy is only required by callers.
+  def numpyDtype(self):
+    if self.dtype is None:
+      numpy = Types.numpy()
+      self.dtype = numpy.dtype({
+          'names'    : self.fields,
+          'formats'  : [Types.numpyFormat(fmt, t if d is None else None) \
+                          for (fmt, t, d) in zip(self.formats, self.types, self.encoders)],
+          'offsets'  : [offset for (offset, _) in self.fieldLayout()],
+          'itemsize' : self.size
+        })
+    return self.dtype
+
   # Return a namedtuple representing a default instance of the schema
   def default(self):
     if self.clazz:
@@ -265,31 +554,177 @@ class DBSchema:
     return schema.instantiate(*fields)
 
   # Project a packed tuple to a binary representation of the given schema.
-  # TODO: make this more efficient by direct field access and copying.
   def projectBinary(self, binaryInstance, schema):
-    return schema.pack(self.project(self.unpack(binaryInstance), schema))
+    return self.projector(schema).project(binaryInstance)
+
+  # Returns a reusable projector of packed tuples onto the given schema.
+  # Projectors are built once per target schema, keeping a bounded number.
+  def projector(self, schema):
+    projector = self.projectors.get(schema, None)
+    if projector is None:
+      projector = BinaryProjector(self, schema)
+      if len(self.projectors) >= DBSchema.maxProjectors:
+        self.projectors.clear()
+      self.projectors[schema] = projector
+    return projector
+
+  # Builds the schema's codec, as lists of (field index, converter) pairs for
+  # the fields whose values need conversion when packing and unpacking.
+  # Fields without a conversion are passed to and from the struct as is.
+  def compileCodec(self):
+    self.packers       = []
+    self.unpackers     = []
+    self.codeUnpackers = []
+    for (i, (t, d)) in enumerate(zip(self.types, self.encoders)):
+      (toBinary, fromBinary) = (functools.partial(d.encode, size=Types.charSize(t)), d.decode) \
+                                 if d is not None else Types.converters(t)
+      if toBinary:
+        self.packers.append((i, toBinary))
+      if fromBinary:
+        self.unpackers.append((i, fromBinary))
+        if d is None:
+          self.codeUnpackers.append((i, fromBinary))
+
+  # Applies the given converters to a sequence of field values.
+  @staticmethod
+  def convert(values, converters):
+    if converters:
+      values = list(values)
+      for (i, converter) in converters:
+        values[i] = converter(values[i])
+    return values
 
   # Return a binary representation of the instance
+  # Dictionary-encoded fields are packed as codes.
   def pack(self, instance):
     if self.binrepr:
-      values = [Types.formatValue(instance[i], self.types[i])
-                  for i in range(len(instance))]
-      return self.binrepr.pack(*values)
+      return self.binrepr.pack(*DBSchema.convert(instance, self.packers))
 
-  def unpack(self, buffer):
-    if self.clazz and self.binrepr:
-      values = [Types.formatValue(v, self.types[i], False)
-                  for i, v in enumerate(self.binrepr.unpack(buffer))]
-      return self.clazz._make(values)
+  # Packs an instance directly into a buffer at the given offset.
+  def packInto(self, buffer, offset, instance):
+    self.binrepr.pack_into(buffer, offset, *DBSchema.convert(instance, self.packers))
 
-  def packSchema(self):
-    return json.dumps(self, cls=DBSchemaEncoder).encode()
+  # Unpacks a tuple. Dictionary-encoded fields are decoded into their values,
+  # unless 'decode' is false, in which case their codes are returned.
+  def unpack(self, buffer, decode=True):
+    if self.clazz and self.binrepr:
+      converters = self.unpackers if decode else self.codeUnpackers
+      return self.clazz._make(DBSchema.convert(self.binrepr.unpack(buffer), converters))
+
+  # Unpacks a tuple stored in a buffer at the given offset.
+  def unpackFrom(self, buffer, offset, decode=True):
+    converters = self.unpackers if decode else self.codeUnpackers
+    return self.clazz._make(DBSchema.convert(self.binrepr.unpack_from(buffer, offset), converters))
+
+  # Unpacks a buffer of consecutive packed tuples into a list of instances.
+  def unpackMany(self, buffer, decode=True):
+    converters = self.unpackers if decode else self.codeUnpackers
+    make       = self.clazz._make
+    if converters:
+      return [make(DBSchema.convert(values, converters)) for values in self.binrepr.iter_unpack(buffer)]
+    return [make(values) for values in self.binrepr.iter_unpack(buffer)]
+
+  # Serializes the schema. When 'dictionaryValues' is false, only the names of
+  # dictionary-encoded fields are recorded, giving a fixed-size description.
+  def packSchema(self, dictionaryValues=True):
+    return json.dumps(self, cls=DBSchemaEncoder, dictionaryValues=dictionaryValues).encode()
 
   @classmethod
   def unpackSchema(cls, buffer):
     return json.loads(buffer.decode(), cls=DBSchemaDecoder)
 
 
+class BinaryProjector:
+  """
+  A projection of packed tuples of a source schema onto a target schema,
+  operating directly on their bytes.
+
+  The projector precomputes a plan of the byte ranges of the target fields
+  in the source tuple, merging fields that are adjacent in both tuples, and
+  interleaving the zero padding required by the target layout. Projections
+  then slice and concatenate these ranges, or take a single slice when the
+  target fields are contiguous in the source. Fields whose type or encoding
+  differ between the schemas cannot be copied, and such projections unpack
+  and repack the tuple instead.
+
+  >>> schema = DBSchema('employee', [('id', 'int'), ('dob', 'char(10)'), ('age', 'short'), ('salary', 'int')])
+  >>> e1     = schema.pack(schema.instantiate(1, '1990-01-01', 25, 100000))
+
+  # Non-contiguous fields, with padding in the target layout.
+  >>> p = schema.projector(DBSchema('key', [('age', 'short'), ('id', 'int')]))
+  >>> p.binary, p.contiguous, len(p.pieces)
+  (True, False, 3)
+  >>> p.target.unpack(p.project(e1))
+  key(age=25, id=1)
+  >>> p.project(e1) == p.target.pack(p.target.instantiate(25, 1))
+  True
+
+  # Contiguous fields are a single slice.
+  >>> p = schema.projector(DBSchema('dates', [('id', 'int'), ('dob', 'char(10)'), ('age', 'short')]))
+  >>> p.contiguous, p.target.unpack(p.project(e1))
+  (True, dates(id=1, dob='1990-01-01', age=25))
+
+  # Projectors are cached per target schema.
+  >>> schema.projector(p.target) is p
+  True
+
+  # Type changes fall back to unpacking and repacking.
+  >>> p = schema.projector(DBSchema('ages', [('age', 'int')]))
+  >>> p.binary, p.target.unpack(p.project(e1))
+  (False, ages(age=25))
+
+  >>> schema.projector(DBSchema('bad', [('name', 'int')]))
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid field in projection: name
+  """
+
+  def __init__(self, source, target):
+    for f in target.fields:
+      if f not in source.fields:
+        raise ValueError("Invalid field in projection: "+f)
+
+    self.source    = source
+    self.target    = target
+    self.positions = [source.fields.index(f) for f in target.fields]
+    self.binary    = all(source.types[i] == target.types[j] and source.encoders[i] is target.encoders[j] \
+                           for (j, i) in enumerate(self.positions))
+
+    # Byte ranges as [sourceStart, sourceEnd, targetStart], merging adjacent fields.
+    sourceLayout = source.fieldLayout()
+    ranges = []
+    for ((targetOffset, size), i) in zip(target.fieldLayout(), self.positions):
+      sourceOffset = sourceLayout[i][0]
+      if ranges and ranges[-1][1] == sourceOffset and ranges[-1][2] + (ranges[-1][1] - ranges[-1][0]) == targetOffset:
+        ranges[-1][1] = sourceOffset + size
+      else:
+        ranges.append([sourceOffset, sourceOffset + size, targetOffset])
+
+    # Plan pieces are either slices of the source tuple, or padding bytes.
+    self.pieces = []
+    offset = 0
+    for (start, end, targetOffset) in ranges:
+      if targetOffset > offset:
+        self.pieces.append(bytes(targetOffset - offset))
+      self.pieces.append(slice(start, end))
+      offset = targetOffset + (end - start)
+    if target.size > offset:
+      self.pieces.append(bytes(target.size - offset))
+
+    self.contiguous = len(self.pieces) == 1
+    self.slice      = self.pieces[0] if self.contiguous else None
+
+  # Returns the packed projection of a packed source tuple.
+  def project(self, tupleData):
+    if not self.binary:
+      values = self.source.unpack(tupleData)
+      return self.target.pack([values[i] for i in self.positions])
+    elif self.contiguous:
+      return bytes(tupleData[self.slice])
+    else:
+      return b''.join([tupleData[p] if p.__class__ is slice else p for p in self.pieces])
+
+
 class DBSchemaEncoder(json.JSONEncoder):
   """
   Custom JSON encoder for serializing DBSchema objects.
@@ -298,9 +733,18 @@ class DBSchemaEncoder(json.JSONEncoder):
   >>> json.dumps(schema, cls=DBSchemaEncoder)
   '{"__pytype__": "DBSchema", "name": "employee", "schema": [["id", "int"], ["salary", "int"]]}'
   """
+  def __init__(self, dictionaryValues=True, **kwargs):
+    super().__init__(**kwargs)
+    self.dictionaryValues = dictionaryValues
+
   def default(self, obj):
     if isinstance(obj, DBSchema):
-      return OrderedDict([('__pytype__', 'DBSchema'), ('name', obj.name), ('schema', obj.schema())])
+      desc = OrderedDict([('__pytype__', 'DBSchema'), ('name', obj.name), ('schema', obj.schema())])
+      if obj.dictionaries:
+        desc['dictionaries'] = \
+          OrderedDict([(f, obj.dictionaries[f].values if self.dictionaryValues else []) \
+                         for f in obj.fields if f in obj.dictionaries])
+      return desc
     else:
       return super().default(obj)
 
@@ -328,7 +772,9 @@ class DBSchemaDecoder(json.JSONDecoder):
 
   def decodeDBSchema(self, objDict):
     if '__pytype__' in objDict and objDict['__pytype__'] == 'DBSchema':
-      return DBSchema(objDict['name'], objDict['schema'])
+      dictionaries = dict([(f, ColumnDictionary(values=v)) \
+                            for (f, v) in objDict.get('dictionaries', {}).items()])
+      return DBSchema(objDict['name'], objDict['schema'], dictionaries)
     else:
       return objDict
 
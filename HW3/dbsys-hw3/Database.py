@@ -1,5 +1,6 @@
 import json, io, os, os.path
 
+from Catalog.Dictionary    import ColumnDictionary
 from Catalog.Schema        import DBSchema, DBSchemaEncoder, DBSchemaDecoder
 from Query.Plan            import PlanBuilder
 from Query.Optimizer       import Optimizer
@@ -14,6 +15,22 @@ class Database:
 
   Also, it provies the ability to construct query
   plan objects, as well as wrapping the storage layer methods.
+
+  >>> db = Database(dataDir='data/restart')
+  >>> db.createRelation('shipment', [('id', 'int'), ('mode', 'char(10)')], encodedFields=['mode'], bloomKeys=['mode'])
+  >>> schema = db.relationSchema('shipment')
+  >>> for tup in [schema.pack(schema.instantiate(i, ['AIR', 'RAIL', 'SHIP'][i % 3])) for i in range(30)]:
+  ...    _ = db.insertTuple(schema.name, tup)
+  ...
+  >>> db.close()
+
+  # After a restart, the relation's files decode tuples with the catalog's dictionaries.
+  >>> db = Database(dataDir='data/restart')
+  >>> schema = db.relationSchema('shipment')
+  >>> _ = db.insertTuple(schema.name, schema.pack(schema.instantiate(30, 'TRUCK')))
+  >>> [schema.unpack(tup).mode for (_, page) in db.storageEngine().pages(schema.name) for tup in page][-4:]
+  ['AIR', 'RAIL', 'SHIP', 'TRUCK']
+  >>> db.close()
   """
 
   checkpointEncoding = "latin1"
@@ -26,7 +43,9 @@ class Database:
 
     else:
       storageArgs = {k:v for (k,v) in kwargs.items() \
-                      if k in ["pageSize", "poolSize", "dataDir", "indexDir"]}
+                      if k in ["pageSize", "poolSize", "dataDir", "indexDir", \
+                               "wal", "groupCommitDelay", "checkpointSize", \
+                               "tablespaces", "readAhead", "cacheHotScans", "cacheMaxTuples"]}
 
       self.relationMap     = kwargs.get("relations", {})
       self.defaultPageSize = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
@@ -47,6 +66,8 @@ class Database:
 
   def close(self):
     if self.storage:
+      if self.dictionariesChanged():
+        self.checkpoint()
       self.storage.close()
 
   # Database internal components
@@ -76,11 +97,19 @@ class Database:
       return self.relationMap[relationName]
 
   # DDL statements
-  def createRelation(self, relationName, relationFields):
+  # Creates a new relation. Storage options such as the page layout may be given
+  # as keyword arguments, e.g. pageClass=PaxPage for a column-partitioned layout,
+  # or clusterKey='field' to keep the relation approximately sorted on a field.
+  #
+  # The 'encodedFields' argument lists character fields to store with dictionary
+  # encoding. Their dictionaries are kept in the catalog with the relation schema.
+  def createRelation(self, relationName, relationFields, **kwargs):
     if relationName not in self.relationMap:
-      schema = DBSchema(relationName, relationFields)
+      encodedFields = kwargs.pop("encodedFields", [])
+      dictionaries  = dict([(f, ColumnDictionary()) for f in encodedFields])
+      schema = DBSchema(relationName, relationFields, dictionaries)
       self.relationMap[relationName] = schema
-      self.storage.createRelation(relationName, schema)
+      self.storage.createRelation(relationName, schema, **kwargs)
       self.checkpoint()
     else:
       raise ValueError("Relation '" + relationName + "' already exists")
@@ -98,10 +127,24 @@ class Database:
   # Returns a tuple id for the newly inserted data.
   def insertTuple(self, relationName, tupleData):
     if relationName in self.relationMap:
-      return self.storage.insertTuple(relationName, tupleData)
+      tupleId = self.storage.insertTuple(relationName, tupleData)
+      # Persist any values newly added to the relation's dictionaries.
+      if self.relationMap[relationName].dictionaries and self.dictionariesChanged():
+        self.checkpoint()
+      return tupleId
     else:
       raise ValueError("Unknown relation '" + relationName + "' while inserting a tuple")
 
+  # Inserts a batch of tuples, returning their tuple ids.
+  def bulkLoad(self, relationName, tuples):
+    if relationName in self.relationMap:
+      tupleIds = self.storage.bulkLoad(relationName, list(tuples))
+      if self.relationMap[relationName].dictionaries and self.dictionariesChanged():
+        self.checkpoint()
+      return tupleIds
+    else:
+      raise ValueError("Unknown relation '" + relationName + "' while loading tuples")
+
   def deleteTuple(self, tupleId):
     self.storage.deleteTuple(tupleId)
 
@@ -123,12 +166,21 @@ class Database:
     return optimizer.optimizeQuery(queryPlan)
 
   # Save the database internals to the data directory.
+  # This includes the contents of any column dictionaries.
   def checkpoint(self):
     if self.storage:
       dbcPath = os.path.join(self.storage.fileMgr.dataDir, Database.checkpointFile)
       with open(dbcPath, 'w', encoding=Database.checkpointEncoding) as f:
         f.write(self.pack())
 
+      for schema in self.relationMap.values():
+        for dictionary in schema.dictionaries.values():
+          dictionary.dirty = False
+
+  # Returns whether any column dictionary has changed since the last checkpoint.
+  def dictionariesChanged(self):
+    return any([d.dirty for schema in self.relationMap.values() for d in schema.dictionaries.values()])
+
   # Load relations and schema from an existing data directory.
   def restore(self):
     if self.storage:
@@ -137,6 +189,11 @@ class Database:
         other = Database.unpack(f.read(), self.storage)
         self.fromOther(other)
 
+      # Storage files decode tuples with the catalog's dictionaries.
+      for (relationName, schema) in self.relationMap.items():
+        if schema.dictionaries:
+          self.storage.setRelationSchema(relationName, schema)
+
   # Database schema catalog serialization
   def pack(self):
     if self.relationMap is not None:
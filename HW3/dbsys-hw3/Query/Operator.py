@@ -75,7 +75,17 @@ class Operator:
   # The operator implementation must store this tuple in an output page, allocating a
   # new output page as necessary.
   def emitOutputTuple(self, tupleData):
-    
+    self.nextOutputPage().insertTuple(tupleData)
+    self.countOutputTuple()
+
+  # Used during operator processing to indicate a new output tuple, given as an
+  # instance of the given schema. The instance is packed directly into the output page.
+  def emitOutputInstance(self, schema, instance):
+    self.nextOutputPage().insertInstance(schema, instance)
+    self.countOutputTuple()
+
+  # Returns the output page in which to store the next output tuple.
+  def nextOutputPage(self):
     if self.tempFile is None:
       self.initializeOutput()
 
@@ -91,7 +101,9 @@ class Operator:
     else:
       outputPage = self.outputPages[-1][1]
 
-    outputPage.insertTuple(tupleData)
+    return outputPage
+
+  def countOutputTuple(self):
     if self.sampled:
       self.estimatedCardinality += 1
     else:
@@ -128,11 +140,10 @@ class Operator:
   # Python variables.
   # Query operator expressions (e.g., where-clauses, select lists, join
   # expressions) can then be evaluated in this environment.
-  def loadSchema(self, schema, tupleData):
-    schemaLocals = {}
-    for ((k,t),v) in zip(schema.schema(), schema.unpack(tupleData)):
-      schemaLocals[k] = v
-    return schemaLocals
+  #
+  # With 'decode' set to false, dictionary-encoded fields are bound to their codes.
+  def loadSchema(self, schema, tupleData, decode=True):
+    return dict(zip(schema.fields, schema.unpack(tupleData, decode)))
 
   # Plan and statistics information
 
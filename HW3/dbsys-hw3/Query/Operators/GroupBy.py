@@ -109,9 +109,8 @@ class GroupBy(Operator):
       # Use an in-memory Python dict to accumulate the aggregates.
       aggregates = {}
       for (pageId, page) in partFile.pages():
-        for tup in page:
+        for namedTup in page.unpackTuples(self.subSchema):
           # Evaluate group-by value.
-          namedTup = self.subSchema.unpack(tup)
           groupVal = self.ensureTuple(self.groupExpr(namedTup))
 
           # Look up the aggregate for the group.
@@ -128,7 +127,7 @@ class GroupBy(Operator):
       for (groupVal, aggVals) in aggregates.items():
         finalVals = list(map(lambda x: x[0](x[1]), zip(self.finalizeExprs(), aggVals)))
         outputTuple = self.outputSchema.instantiate(*(list(groupVal) + finalVals))
-        self.emitOutputTuple(self.outputSchema.pack(outputTuple))
+        self.emitOutputInstance(self.outputSchema, outputTuple)
 
       # No need to track anything but the last output page when in batch mode.
       if self.outputPages:
@@ -2,6 +2,8 @@ import itertools
 
 from Catalog.Schema import DBSchema
 from Query.Operator import Operator
+from Query.Operators.TableScan import TableScan
+from Utils.ExpressionInfo import CompiledExpression
 from time import time;
 
 import math;
@@ -105,6 +107,7 @@ class Join(Operator):
       return self.storage.pages(relId);
   
     self.initializeOutput()
+    self.initializeExpressions()
     self.partitionFiles = {0:{}, 1:{}}
     self.outputIterator = self.processAllPages()
     return self
@@ -112,6 +115,18 @@ class Join(Operator):
   def __next__(self):
     return next(self.outputIterator)
 
+  # Compiles the join expression and hash functions once per execution,
+  # as functions over the unpacked lhs and rhs tuples.
+  def initializeExpressions(self):
+    compiled = lambda expr, schemas: CompiledExpression(expr, schemas, globals()).function if expr else None
+    self.joinFn    = compiled(self.joinExpr, [self.lhsSchema, self.rhsSchema])
+    self.lhsKeyFn  = compiled(self.lhsHashFn, [self.lhsSchema])
+    self.rhsKeyFn  = compiled(self.rhsHashFn, [self.rhsSchema])
+
+  # Emits the concatenation of a matching pair of lhs and rhs tuples.
+  def emitJoinOutput(self, lTuple, rTuple):
+    self.emitOutputInstance(self.joinSchema, self.lhsSchema.unpack(lTuple) + self.rhsSchema.unpack(rTuple))
+
   # Page-at-a-time operator processing
   def processInputPage(self, pageId, page):
     raise ValueError("Page-at-a-time processing not supported for joins")
@@ -139,20 +154,17 @@ class Join(Operator):
   # Nested loops implementation
   #
   def nestedLoops(self):
+    (lUnpack, rUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
     for (lPageId, lhsPage) in iter(self.lhsPlan):
       for lTuple in lhsPage:
-        # Load the lhs once per inner loop.
-        joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+        # Unpack the lhs once per inner loop.
+        lRow = lUnpack(lTuple)
 
         for (rPageId, rhsPage) in iter(self.rhsPlan):
           for rTuple in rhsPage:
-            # Load the RHS tuple fields.
-            joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
-
             # Evaluate the join predicate, and output if we have a match.
-            if eval(self.joinExpr, globals(), joinExprEnv):
-              outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-              self.emitOutputTuple(self.joinSchema.pack(outputTuple))
+            if self.joinFn(lRow, rUnpack(rTuple)):
+              self.emitJoinOutput(lTuple, rTuple)
 
         # No need to track anything but the last output page when in batch mode.
         if self.outputPages:
@@ -192,21 +204,18 @@ class Join(Operator):
     lhsIter    = iter(self.lhsPlan)
     lPageBlock = self.accessPageBlock(bufPool, lhsIter)
 
+    (lUnpack, rUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
     while lPageBlock:
       for (lPageId, lhsPage) in lPageBlock:
         for lTuple in lhsPage:
-          # Load the lhs once per inner loop.
-          joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+          # Unpack the lhs once per inner loop.
+          lRow = lUnpack(lTuple)
 
           for (rPageId, rhsPage) in iter(self.rhsPlan):
             for rTuple in rhsPage:
-              # Load the RHS tuple fields.
-              joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
-
               # Evaluate the join predicate, and output if we have a match.
-              if eval(self.joinExpr, globals(), joinExprEnv):
-                outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-                self.emitOutputTuple(self.joinSchema.pack(outputTuple))
+              if self.joinFn(lRow, rUnpack(rTuple)):
+                self.emitJoinOutput(lTuple, rTuple)
 
           # No need to track anything but the last output page when in batch mode.
           if self.outputPages:
@@ -233,8 +242,8 @@ class Join(Operator):
       bufPool = self.storage.bufPool
       for (lPageId, lhsPage) in iter(self.lhsPlan):
         for lTuple in lhsPage:
-          # Load the lhs once per inner loop.
-          joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+          # Unpack the lhs once per inner loop.
+          lRow = self.lhsSchema.binrepr.unpack(lTuple)
 
           # Match against RHS tuples using the index.
           joinKey = self.lhsSchema.projectBinary(lTuple, self.lhsKeySchema)
@@ -244,14 +253,10 @@ class Join(Operator):
             rhsPage = bufPool.getPage(rhsTupId.pageId)
             rTuple  = rhsPage.getTuple(rhsTupId)
 
-            # Load the RHS tuple fields.
-            joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
-
             # Evaluate any remaining join predicate, and output if we have a match.
-            fullMatch = eval(self.joinExpr, globals(), joinExprEnv) if self.joinExpr else True
+            fullMatch = self.joinFn(lRow, self.rhsSchema.binrepr.unpack(rTuple)) if self.joinFn else True
             if fullMatch:
-              outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-              self.emitOutputTuple(self.joinSchema.pack(outputTuple))
+              self.emitJoinOutput(lTuple, rTuple)
 
           # No need to track anything but the last output page when in batch mode.
           if self.outputPages:
@@ -269,35 +274,57 @@ class Join(Operator):
   # Hash join implementation.
   #
   def hashJoin(self):
+    # Join co-partitioned relations one partition pair at a time.
+    partitions = self.joinPartitions()
+    if partitions:
+      return self.partitionWiseHashJoin(partitions)
+
+    # Collect the LHS join keys for any RHS key fields with Bloom filters.
+    bloomKeys = self.rhsBloomKeys()
+    keyValues = dict([(rField, set()) for (_, rField) in bloomKeys])
+
     # Partition the LHS and RHS inputs, creating a temporary file for each partition.
     # We assume one-level of partitioning is sufficient and skip recurring.
+    (lUnpack, rUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
     for (lPageId, lPage) in iter(self.lhsPlan):
       for lTuple in lPage:
-        lPartEnv = self.loadSchema(self.lhsSchema, lTuple)
-        lPartKey = eval(self.lhsHashFn, globals(), lPartEnv)
+        lPartKey = self.lhsKeyFn(lUnpack(lTuple))
         self.emitPartitionTuple(lPartKey, lTuple, left=True)
 
+        lValues = self.lhsSchema.unpack(lTuple) if keyValues else None
+        for (lField, rField) in bloomKeys:
+          if rField in keyValues:
+            keyValues[rField].add(getattr(lValues, lField))
+            if len(keyValues[rField]) > Join.bloomProbeLimit:
+              del keyValues[rField]
+
+    # Skip RHS pages whose Bloom filters contain none of the LHS keys.
+    if keyValues:
+      self.rhsPlan.keyValues = keyValues
+
     for (rPageId, rPage) in iter(self.rhsPlan):
       for rTuple in rPage:
-        rPartEnv = self.loadSchema(self.rhsSchema, rTuple)
-        rPartKey = eval(self.rhsHashFn, globals(), rPartEnv)
+        rPartKey = self.rhsKeyFn(rUnpack(rTuple))
         self.emitPartitionTuple(rPartKey, rTuple, left=False)
 
+    if keyValues:
+      self.rhsPlan.keyValues = None
+
     # Iterate over partition pairs and output matches
     # evaluating the join expression as necessary.
+    lhsKey = self.lhsSchema.projector(self.lhsKeySchema).project
+    rhsKey = self.rhsSchema.projector(self.rhsKeySchema).project
     for ((lPageId, lPage), (rPageId, rPage)) in self.partitionPairs():
       for lTuple in lPage:
-        joinExprEnv = self.loadSchema(self.lhsSchema, lTuple)
+        lRow = lUnpack(lTuple)
+        lKey = lhsKey(lTuple)
         for rTuple in rPage:
-          joinExprEnv.update(self.loadSchema(self.rhsSchema, rTuple))
           output = \
-            ( self.lhsSchema.projectBinary(lTuple, self.lhsKeySchema) \
-                == self.rhsSchema.projectBinary(rTuple, self.rhsKeySchema) ) \
-            and ( eval(self.joinExpr, globals(), joinExprEnv) if self.joinExpr else True )
+            ( lKey == rhsKey(rTuple) ) \
+            and ( self.joinFn(lRow, rUnpack(rTuple)) if self.joinFn else True )
 
           if output:
-            outputTuple = self.joinSchema.instantiate(*[joinExprEnv[f] for f in self.joinSchema.fields])
-            self.emitOutputTuple(self.joinSchema.pack(outputTuple))
+            self.emitJoinOutput(lTuple, rTuple)
 
       # No need to track anything but the last output page when in batch mode.
       if self.outputPages:
@@ -308,7 +335,74 @@ class Join(Operator):
     # Return an iterator to the output relation
     return self.storage.pages(self.relationId())
 
+  # Partition-wise hash join, for table scans over relations partitioned on
+  # their join keys with compatible schemes. Matching tuples lie in partitions
+  # with the same index, so each partition pair is joined with an in-memory
+  # hash table over the LHS partition, without repartitioning either input.
+  def partitionWiseHashJoin(self, partitions):
+    lhsKey = self.lhsSchema.projector(self.lhsKeySchema).project
+    rhsKey = self.rhsSchema.projector(self.rhsKeySchema).project
+    (lUnpack, rUnpack) = (self.lhsSchema.binrepr.unpack, self.rhsSchema.binrepr.unpack)
+    for partition in partitions:
+      self.lhsPlan.partitions = [partition]
+      self.rhsPlan.partitions = [partition]
+
+      hashTable = {}
+      for (lPageId, lPage) in iter(self.lhsPlan):
+        for lTuple in lPage:
+          hashTable.setdefault(lhsKey(lTuple), []).append(bytes(lTuple))
+
+      if hashTable:
+        for (rPageId, rPage) in iter(self.rhsPlan):
+          for rTuple in rPage:
+            for lTuple in hashTable.get(rhsKey(rTuple), []):
+              if not self.joinFn or self.joinFn(lUnpack(lTuple), rUnpack(rTuple)):
+                self.emitJoinOutput(lTuple, rTuple)
+
+      # No need to track anything but the last output page when in batch mode.
+      if self.outputPages:
+        self.outputPages = [self.outputPages[-1]]
+
+    self.lhsPlan.partitions = None
+    self.rhsPlan.partitions = None
+    return self.storage.pages(self.relationId())
+
+  # Returns the partitions to join partition-wise, if both inputs are table scans over
+  # relations partitioned on the (single) join key with compatible schemes, and None otherwise.
+  def joinPartitions(self):
+    if isinstance(self.lhsPlan, TableScan) and isinstance(self.rhsPlan, TableScan) \
+        and len(self.lhsKeySchema.fields) == 1 and self.storage.fileMgr:
+      lScheme = self.storage.partitionScheme(self.lhsPlan.relationId())
+      rScheme = self.storage.partitionScheme(self.rhsPlan.relationId())
+      lField  = self.scanField(self.lhsPlan, self.lhsSchema, self.lhsKeySchema.fields[0])
+      rField  = self.scanField(self.rhsPlan, self.rhsSchema, self.rhsKeySchema.fields[0])
+      if lScheme and lScheme.compatible(rScheme) and lScheme.key == lField and rScheme.key == rField:
+        return list(range(lScheme.numPartitions()))
+
+  # Maps a join input field back to the field name of the input's table scan,
+  # since the join's input schemas may rename the scan's fields.
+  def scanField(self, plan, inputSchema, field):
+    return plan.schema().fields[inputSchema.fields.index(field)]
+
   # Hash join helpers.
+
+  # The largest number of distinct LHS keys used to probe RHS Bloom filters.
+  bloomProbeLimit = 1024
+
+  # Returns pairs of LHS key fields and RHS relation fields for which the RHS is a
+  # table scan over a relation with Bloom filters on the RHS key field.
+  # RHS key fields are mapped back to the relation's field names, since the
+  # join's RHS schema may rename the scan's fields.
+  def rhsBloomKeys(self):
+    if isinstance(self.rhsPlan, TableScan) and self.storage.fileMgr:
+      rFiles = self.storage.fileMgr.partitionFiles(self.rhsPlan.relationId())
+      rFile  = rFiles[0] if rFiles else None
+      if rFile and rFile.bloomFilters:
+        keyFields  = [(lField, self.scanField(self.rhsPlan, self.rhsSchema, rField)) \
+                        for (lField, rField) in zip(self.lhsKeySchema.fields, self.rhsKeySchema.fields)]
+        return [(lField, rField) for (lField, rField) in keyFields if rField in rFile.bloomFilters.keys]
+    return []
+
   def partitionRelationId(self, left, partitionId):
     return self.operatorType() + str(self.id()) + "_" \
             + ("l" if left else "r") + "part_" + str(partitionId) + str(self.opMarker);
@@ -1,5 +1,7 @@
 from Catalog.Schema import DBSchema
 from Query.Operator import Operator
+from Storage.ColumnCache import ColumnBatch, ColumnCache, ColumnExpression
+from Utils.ExpressionInfo import CompiledExpression
 
 class Project(Operator):
   """
@@ -45,6 +47,7 @@ class Project(Operator):
     if self.storage.hasRelation(relId):
       return self.storage.pages(relId);
   
+    self.initializeExpressions()
     self.initializeOutput()
     self.inputIterator = iter(self.subPlan)
     self.inputFinished = False
@@ -68,22 +71,53 @@ class Project(Operator):
       return next(self.outputIterator)
 
 
+  # Compiles the projection expressions into a single function returning
+  # the output fields' values in schema order.
+  def initializeExpressions(self):
+    exprs = ["(" + self.projectExprs[f][0].strip() + ")" for f in self.outputSchema.fields]
+    self.compiledExprs = CompiledExpression("(" + ", ".join(exprs) + ",)", [self.subPlan.schema()], globals())
+
+    # Projections are evaluated over whole pages as column arrays where possible.
+    self.columnExprs = [ColumnExpression(self.projectExprs[f][0]) for f in self.outputSchema.fields]
+    self.vectorized  = ColumnCache.available()
+
   # Page-at-a-time operator processing
   def processInputPage(self, pageId, page):
     inputSchema  = self.subPlan.schema()
     outputSchema = self.schema()
 
     if set(locals().keys()).isdisjoint(set(inputSchema.fields)):
+      if self.vectorized and self.processInputBatch(page, inputSchema):
+        return
+
+      unpack  = inputSchema.binrepr.unpack
+      project = self.compiledExprs.function
       for inputTuple in page:
         # Execute the projection expressions.
-        projectExprEnv = self.loadSchema(inputSchema, inputTuple)
-        vals = {k : eval(v[0], globals(), projectExprEnv) for (k,v) in self.projectExprs.items()}
-        outputTuple = outputSchema.pack([vals[i] for i in outputSchema.fields])
-        self.emitOutputTuple(outputTuple)
+        self.emitOutputInstance(outputSchema, project(unpack(inputTuple)))
 
     else:
       raise ValueError("Overlapping variables detected with operator schema")
 
+  # Evaluates the projections over a page's tuples as a batch of column arrays.
+  # Returns whether the page was processed, and otherwise falls back to
+  # per-tuple evaluation for the rest of the execution if any projection
+  # cannot be vectorized.
+  def processInputBatch(self, page, inputSchema):
+    batch = ColumnBatch.fromPage(page, inputSchema)
+    if batch is None:
+      return False
+
+    columns = [e.evaluate(batch.columns(e.fields), batch.numRows) for e in self.columnExprs]
+    if any(c is None for c in columns):
+      self.vectorized = False
+      return False
+
+    outputSchema = self.schema()
+    for instance in zip(*[c.tolist() for c in columns]):
+      self.emitOutputInstance(outputSchema, instance)
+    return True
+
   # Set-at-a-time operator processing
   def processAllPages(self):
     if self.inputIterator is None:
@@ -1,6 +1,22 @@
-from Query.Operator import Operator
+import time
+
+from Catalog.Dictionary        import EncodedPredicateRewriter
+from Query.Operator            import Operator
+from Query.Operators.TableScan import TableScan
+from Storage.ColumnCache       import ColumnBatch, ColumnCache, ColumnPredicate
+from Storage.ZoneMap           import ZoneMap
+from Utils.ExpressionInfo      import CompiledExpression, ExpressionInfo
 
 class Select(Operator):
+  # Adaptive conjunct ordering. Every 'profileInterval'-th input tuple is
+  # evaluated against each conjunct of the predicate in isolation, tracking
+  # pass rates and evaluation times. Conjuncts are reordered after each page
+  # by rank, i.e., by evaluation cost per rejected tuple, and statistics
+  # are halved once 'statsWindow' tuples have been profiled, so that the
+  # order follows shifting data distributions.
+  profileInterval = 32
+  statsWindow     = 256
+
   def __init__(self, subPlan, selectExpr, **kwargs):
     super().__init__(**kwargs)
     self.subPlan    = subPlan
@@ -26,14 +42,15 @@ class Select(Operator):
   # Iterator abstraction for selection operator.
 
   def __iter__(self):
-    
+    self.initializePredicate()
+
     relId = self.relationId()
 
     if self.storage.hasRelation(relId):
       return self.storage.pages(relId);
     
     self.initializeOutput()
-    self.inputIterator = iter(self.subPlan)
+    self.inputIterator = self.cachedInput() or iter(self.subPlan)
     self.inputFinished = False
 
     if not self.pipelined:
@@ -56,22 +73,162 @@ class Select(Operator):
       return next(self.outputIterator)
 
 
+  # Prepares the predicate for evaluation. Predicates on dictionary-encoded
+  # fields are rewritten to compare codes where possible, avoiding decoding.
+  def initializePredicate(self):
+    codePredicate = EncodedPredicateRewriter.rewriteTree(self.selectExpr, self.subPlan.schema())
+    self.decodeInputs = codePredicate is None
+    self.predicate    = self.selectExpr if self.decodeInputs else codePredicate
+
+    # Compile the predicate once, binding referenced fields to tuple positions.
+    self.compiledPredicate = CompiledExpression(self.predicate, [self.subPlan.schema()], globals(), self.decodeInputs)
+
+    # Predicates are evaluated over whole pages as column arrays where possible.
+    self.columnPredicate = ColumnPredicate(self.predicate)
+    self.vectorized      = ColumnCache.available()
+    self.initializeConjuncts()
+
+    # Push range predicates down to a table scan input, for zone map page skipping.
+    if isinstance(self.subPlan, TableScan):
+      ranges = ZoneMap.rangesFromPredicate(self.selectExpr, self.subPlan.schema())
+      self.subPlan.ranges = self.subPlan.ranges + [r for r in ranges if r not in self.subPlan.ranges]
+
+  # Splits the predicate into its conjuncts, compiled individually.
+  # Conjunct ordering is adaptive for predicates with several conjuncts.
+  def initializeConjuncts(self):
+    schema = self.subPlan.schema()
+    try:
+      conjuncts = ExpressionInfo(self.selectExpr.strip()).decomposeCNF()
+    except SyntaxError:
+      conjuncts = []
+
+    self.conjuncts = []
+    for conjunct in conjuncts:
+      codeConjunct = EncodedPredicateRewriter.rewriteTree(conjunct, schema)
+      self.conjuncts.append(CompiledExpression(conjunct if codeConjunct is None else codeConjunct, \
+                                               [schema], globals(), codeConjunct is None))
+
+    self.adaptive         = len(self.conjuncts) > 1
+    self.conjunctOrder    = list(range(len(self.conjuncts)))
+    self.conjunctStats    = [[0, 0, 0.0] for conjunct in self.conjuncts]
+    self.orderedPredicate = self.compiledPredicate.function
+    self.profiledTuples   = 0
+
+  # Evaluates the predicate over the column cache of a scanned relation, if the
+  # relation is cached and the predicate can be evaluated over whole columns.
+  # Returns pages of the matching tuples to use as the operator's input, or None.
+  def cachedInput(self):
+    self.prefiltered = False
+    if isinstance(self.subPlan, TableScan):
+      columns = self.subPlan.cachedColumns()
+      rows    = columns.select(self.selectExpr) if columns else None
+      if rows is not None:
+        self.prefiltered = True
+        return columns.pages(rows, self.subPlan.schema(), self.storage.bufferPool.pageSize)
+
   # Page processing and control methods
 
   # Page-at-a-time operator processing
+  # Input pages from the column cache hold only matching tuples.
   def processInputPage(self, pageId, page):
+    if self.prefiltered:
+      for inputTuple in page:
+        self.emitOutputTuple(inputTuple)
+      return
+
     schema = self.subPlan.schema()
     if set(locals().keys()).isdisjoint(set(schema.fields)):
-      for inputTuple in page:
-        # Load tuple fields into the select expression context
-        selectExprEnv = self.loadSchema(schema, inputTuple)
+      if self.vectorized and self.processInputBatch(page, schema):
+        return
 
-        # Execute the predicate.
-        if eval(self.selectExpr, globals(), selectExprEnv):
+      unpack    = schema.binrepr.unpack
+      if self.adaptive:
+        self.processAdaptive(page, unpack)
+        return
+
+      predicate = self.compiledPredicate.function
+      for inputTuple in page:
+        # Execute the predicate over the tuple's fields.
+        if predicate(unpack(inputTuple)):
           self.emitOutputTuple(inputTuple)
     else:
       raise ValueError("Overlapping variables detected with operator schema")
 
+  # Evaluates the conjuncts in their current order, profiling a sample of
+  # the page's tuples, and reorders the conjuncts after the page.
+  def processAdaptive(self, page, unpack):
+    predicate = self.orderedPredicate
+    for (i, inputTuple) in enumerate(page):
+      row = unpack(inputTuple)
+      if i % Select.profileInterval == 0:
+        self.profileConjuncts(row)
+        if not self.adaptive:
+          predicate = self.compiledPredicate.function
+
+      try:
+        match = predicate(row)
+      except Exception:
+        # A reordering may evaluate conjuncts guarded by earlier ones (e.g.,
+        # a division after a test for zero), so revert to the original order.
+        if predicate is self.compiledPredicate.function:
+          raise
+        self.adaptive = False
+        predicate     = self.compiledPredicate.function
+        match         = predicate(row)
+
+      if match:
+        self.emitOutputTuple(inputTuple)
+
+    if self.adaptive:
+      self.reorderConjuncts()
+
+  # Evaluates every conjunct over a row, recording pass rates and times.
+  # Conjuncts that fail in isolation disable reordering.
+  def profileConjuncts(self, row):
+    for (conjunct, stats) in zip(self.conjuncts, self.conjunctStats):
+      start = time.perf_counter()
+      try:
+        passed = conjunct.function(row)
+      except Exception:
+        self.adaptive = False
+        return
+      stats[0] += 1
+      stats[1] += 1 if passed else 0
+      stats[2] += time.perf_counter() - start
+    self.profiledTuples += 1
+
+  # Orders the conjuncts by increasing rank, that is, by their evaluation
+  # time divided by their rejection rate.
+  def reorderConjuncts(self):
+    rank  = lambda stats: (stats[2] / stats[0]) / max(1.0 - stats[1] / stats[0], 1e-3) if stats[0] else 0.0
+    order = sorted(self.conjunctOrder, key=lambda i: rank(self.conjunctStats[i]))
+    if order != self.conjunctOrder:
+      self.conjunctOrder    = order
+      self.orderedPredicate = CompiledExpression.conjunction([self.conjuncts[i] for i in order])
+
+    if self.profiledTuples >= Select.statsWindow:
+      self.profiledTuples //= 2
+      for stats in self.conjunctStats:
+        stats[:] = [stats[0] // 2, stats[1] // 2, stats[2] / 2]
+
+  # Evaluates the predicate over a page's tuples as a batch of column arrays.
+  # Returns whether the page was processed, and otherwise falls back to
+  # per-tuple evaluation for the rest of the execution if the predicate
+  # cannot be vectorized.
+  def processInputBatch(self, page, schema):
+    batch = ColumnBatch.fromPage(page, schema, self.decodeInputs)
+    if batch is None:
+      return False
+
+    mask = self.columnPredicate.evaluate(batch.columns(self.columnPredicate.fields), batch.numRows)
+    if mask is None:
+      self.vectorized = False
+      return False
+
+    for outputTuple in batch.tuples(mask):
+      self.emitOutputTuple(outputTuple)
+    return True
+
   # Set-at-a-time operator processing
   def processAllPages(self):
     if self.inputIterator is None:
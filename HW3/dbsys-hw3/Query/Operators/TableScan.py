@@ -1,5 +1,6 @@
 import random, math
-from Query.Operator import Operator
+from Query.Operator   import Operator
+from Storage.PaxPage  import PaxPage
 
 class TableScan(Operator):
 
@@ -8,12 +9,36 @@ class TableScan(Operator):
       super().__init__(**kwargs)
       self.relId      = relId
       self.relSchema  = schema
+      self.columns    = kwargs.get("columns", None)
+
+      # Range predicates, as (field, operator, constant) triples, used
+      # to skip pages with the relation's zone map and key Bloom filters.
+      self.ranges     = kwargs.get("ranges", [])
+
+      # Candidate values per key field, e.g., the join keys of another input,
+      # used to skip pages with the relation's key Bloom filters.
+      self.keyValues  = kwargs.get("keyValues", None)
+
+      # Partitions to scan for a partitioned relation, e.g., in partition-wise joins.
+      # Partitions are also pruned with the scan's range predicates and key values.
+      self.partitions = kwargs.get("partitions", None)
+
+      # Column scans produce a schema restricted to the requested attributes,
+      # ordered as in the relation.
+      if self.columns:
+        missing = [c for c in self.columns if c not in schema.fields]
+        if missing:
+          raise ValueError("Invalid columns for a table scan: " + ', '.join(missing))
+        self.scanSchema = schema.subschema(self.columns)
+      else:
+        self.scanSchema = schema
+
     else:
       raise ValueError("Invalid relation name or schema for a table scan")
 
   # Returns the output schema of this operator
   def schema(self):
-    return self.relSchema
+    return self.scanSchema
 
   # Returns the relation accessed by this scan operator,
   # overriding the method in the parent class.
@@ -34,10 +59,19 @@ class TableScan(Operator):
 
   # Volcano-style iterator abstraction
   def __iter__(self):
-    self.pageIterator = self.storage.pages(self.relId)
+    scanArgs = dict([(k, v) for (k, v) in [("ranges", self.ranges), ("keys", self.keyValues), \
+                                           ("partitions", self.partitions)] if v])
     self.nextPageId, self.nextPage = None, None
     self.pageSize, self.numPages, _ = self.storage.relationStats(self.relId)
-    self.pageTuples = math.floor( self.pageSize / self.schema().size );
+
+    # Column scans over a cached relation produce their tuples from the column cache.
+    cached = self.cachedColumns()
+    self.cachedScan = bool(cached and self.columns)
+    if self.cachedScan:
+      self.pageIterator = cached.pages(cached.select(), self.scanSchema, self.pageSize)
+    else:
+      self.pageIterator = self.storage.pages(self.relId, **scanArgs)
+    self.pageTuples = math.floor( self.pageSize / self.relSchema.size );
     p = max(1, self.cardinality(False) / (self.pageTuples * self.sampleFactor));
     self.sampleSize = p if self.sampled else 0
     self.prevPageIndex, self.pagesToSample = (0, p)
@@ -95,18 +129,28 @@ class TableScan(Operator):
       raise StopIteration
 
   # Returns whether this operator has an output page ready for its iterator.
+  # Pages produced from the column cache have no page id.
   def isOutputPageReady(self):
-    return not(self.nextPageId is None or self.nextPage is None)
+    return self.nextPage is not None
 
   # Returns the next output page for this operator's iterator.
   def outputPage(self):
     result, self.nextPageId, self.nextPage = (self.nextPageId, self.nextPage), None, None
     return result
 
-  # Table scans simply pass along the next page.
+  # Table scans simply pass along the next page, or a projected view
+  # of the page for column scans.
   def processInputPage(self, pageId, page):
     self.nextPageId = pageId
-    self.nextPage   = page
+    self.nextPage   = ProjectedPage(page, self.relSchema, self.scanSchema) \
+                        if self.columns and not self.cachedScan else page
+
+  # Returns the relation's columns from the storage engine's column cache, if
+  # the relation is cached (see ColumnCache). Each call counts as a scan of the
+  # relation. Sampled scans and scans of selected partitions do not use the cache.
+  def cachedColumns(self):
+    if not self.sampled and self.partitions is None:
+      return self.storage.columnCache.columns(self.relId, self.relSchema)
 
   # Table scans do not need this method since they do not produce any new output.
   def emitOutputTuple(self, tupleData):
@@ -116,7 +160,16 @@ class TableScan(Operator):
 
   # Returns a single line description of the operator.
   def explain(self):
-    return super().explain() + "(" + self.relId + ")"
+    args = [self.relId]
+    if self.columns:
+      args.append("columns=" + str(self.scanSchema.fields))
+    if self.ranges:
+      args.append("ranges=" + str(self.ranges))
+    if self.keyValues:
+      args.append("keys=" + str(sorted(self.keyValues.keys())))
+    if self.partitions is not None:
+      args.append("partitions=" + str(list(self.partitions)))
+    return super().explain() + "(" + ', '.join(args) + ")"
 
   # Returns the table's cardinality by using the storage engine.
   def cardinality(self, estimated):
@@ -131,3 +184,27 @@ class TableScan(Operator):
   # A table scan returns a constant selectivity.
   def selectivity(self, estimated):
     return 1.0
+
+
+class ProjectedPage:
+  """
+  A read-only view of a page that iterates over tuples restricted to
+  a subset of the page's attributes.
+
+  PAX pages only access the minipages of the projected attributes,
+  while other page layouts project each packed tuple in turn.
+  """
+  def __init__(self, page, schema, projectSchema):
+    self.page           = page
+    self.pageId         = page.pageId
+    self.header         = page.header
+    self.schema         = schema
+    self.projectSchema  = projectSchema
+    self.fieldPositions = [schema.fields.index(f) for f in projectSchema.fields]
+    self.projector      = schema.projector(projectSchema)
+
+  def __iter__(self):
+    if isinstance(self.page, PaxPage):
+      return self.page.projectTuples(self.fieldPositions, self.projectSchema)
+    else:
+      return map(self.projector.project, self.page)
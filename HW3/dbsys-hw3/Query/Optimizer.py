@@ -5,7 +5,7 @@ from Query.Plan import Plan
 from Query.Operators.Join import Join
 from Query.Operators.Project import Project
 from Query.Operators.Select import Select
-from Utils.ExpressionInfo import ExpressionInfo
+from Utils.ExpressionInfo import ExpressionInfo, ConstantFolder, PredicateInference, SubexpressionReplacer
 from Catalog.Schema import DBSchema
 
 from DBFileSystemGC import DBFileSystemGC
@@ -39,6 +39,29 @@ class Optimizer:
 
   >>> db.optimizer.pushdownOperators(query5)
 
+  ### SELECT * FROM employee JOIN department ON id = eid WHERE id < 2 * 5
+  >>> query6 = db.query().fromTable('employee').join( \
+        db.query().fromTable('department'), \
+        method='block-nested-loops', expr='id == eid').where('id < 2 * 5').finalize()
+
+  >>> db.optimizer.simplifyExpressions(query6).root.selectExpr
+  '((id < 10)) and (eid < 10)'
+
+  ### SELECT id, age * 2.5 AS age2 FROM employee JOIN department ON id = eid WHERE age * 2.5 > 40
+  >>> query7 = lambda ageType: db.query().fromTable('employee').join( \
+        db.query().fromTable('department'), \
+        method='block-nested-loops', expr='id == eid').where('age * 2.5 > 40') \
+        .select({'id': ('id', 'int'), 'age2': ('age * 2.5', ageType)}).finalize()
+
+  >>> print(db.optimizer.eliminateCommonSubexpressions(query7('double')).explain()) # doctest: +ELLIPSIS
+  Select[...](predicate='(age2 > 40)')
+    Project[...](projections=...)
+      BNLJoin[...](expr='id == eid')
+  ...
+
+  # Outputs converted to a narrower type are not shared with the predicate.
+  >>> db.optimizer.eliminateCommonSubexpressions(query7('int')).root.operatorType()
+  'Project'
   """
 
   def __init__(self, db):
@@ -633,14 +656,162 @@ class Optimizer:
       raise ValueError("Empty plan cannot be optimized.");
     
 
+  # Expression simplification.
+  #
+  # Before pushdown, we fold constant subexpressions in all operator
+  # expressions, and infer predicates across join keys: for an inner
+  # equi-join on a == b, a predicate over a alone also holds over b.
+  # Inferred predicates are added to the topmost selection of each region
+  # of selections and joins, and pushdown then moves them to the other
+  # side of the join, filtering its input before the join.
+  def simplifyExpressions(self, plan):
+    if plan.root:
+      plan.root = self.foldConstants( plan.root );
+      plan.root = self.inferPredicates( plan.root );
+      return plan;
+    else:
+      raise ValueError("Empty plan cannot be simplified.");
+
+  def foldConstants(self, operator):
+    if operator.operatorType() == "Select":
+      operator.selectExpr = ConstantFolder.fold( operator.selectExpr );
+    elif operator.operatorType() == "Project":
+      operator.projectExprs = dict([ (k, (ConstantFolder.fold(e), t)) \
+                                     for (k, (e, t)) in operator.projectExprs.items() ]);
+    elif operator.operatorType()[-4:] == "Join":
+      for attr in ["joinExpr", "lhsHashFn", "rhsHashFn"]:
+        if isinstance(getattr(operator, attr), str):
+          setattr(operator, attr, ConstantFolder.fold( getattr(operator, attr) ));
+
+    for attr in ["subPlan", "lhsPlan", "rhsPlan"]:
+      if getattr(operator, attr, None) is not None:
+        setattr(operator, attr, self.foldConstants( getattr(operator, attr) ));
+    return operator;
+
+  def inferPredicates(self, operator):
+    if operator.operatorType() == "TableScan":
+      return operator;
+    elif operator.operatorType() == "UnionAll":
+      operator.lhsPlan = self.inferPredicates( operator.lhsPlan );
+      operator.rhsPlan = self.inferPredicates( operator.rhsPlan );
+      return operator;
+    elif operator.operatorType() != "Select" and operator.operatorType()[-4:] != "Join":
+      operator.subPlan = self.inferPredicates( operator.subPlan );
+      return operator;
+
+    # Collect the predicates and join key equalities of the region of
+    # selections and joins rooted here, and the region's input operators.
+    conjuncts  = [];
+    equalities = [];
+    inputs     = [];
+    self.collectPredicates( operator, conjuncts, equalities, inputs );
+    for (parent, attr) in inputs:
+      setattr(parent, attr, self.inferPredicates( getattr(parent, attr) ));
+
+    inferred = PredicateInference.infer( conjuncts, equalities );
+    if not inferred:
+      return operator;
+    elif operator.operatorType() == "Select":
+      operator.selectExpr = " and ".join( ["(" + operator.selectExpr + ")"] + inferred );
+      return operator;
+    else:
+      return Select( operator, " and ".join(inferred) );
+
+  # Collects conjuncts and equalities from selections and joins, and records
+  # the (operator, attribute) pairs referencing the region's inputs.
+  def collectPredicates(self, operator, conjuncts, equalities, inputs):
+    if operator.operatorType() == "Select":
+      conjuncts.extend( ExpressionInfo( operator.selectExpr.strip() ).decomposeCNF() );
+      attrs = ["subPlan"];
+    else:
+      if operator.joinExpr:
+        conjuncts.extend( ExpressionInfo( operator.joinExpr.strip() ).decomposeCNF() );
+      if operator.joinMethod == "hash":
+        equalities.extend( zip(operator.lhsKeySchema.fields, operator.rhsKeySchema.fields) );
+      attrs = ["lhsPlan", "rhsPlan"];
+
+    for attr in attrs:
+      child = getattr(operator, attr);
+      if child.operatorType() == "Select" or child.operatorType()[-4:] == "Join":
+        self.collectPredicates( child, conjuncts, equalities, inputs );
+      else:
+        inputs.append( (operator, attr) );
+
+  # Common subexpression elimination.
+  #
+  # After pushdown and join ordering, a projection directly above a selection
+  # may compute the same subexpressions as the selection's predicate. If the
+  # projection computes nothing but such shared subexpressions and fields of
+  # its input, we move the selection above the projection, replacing the
+  # shared subexpressions in the predicate by the projection's output fields,
+  # so each is evaluated once per tuple. Selections directly over a table
+  # scan are left in place, since they use the scan's zone maps and column cache.
+  #
+  # The predicate then sees output values converted to their declared types,
+  # so we only share subexpressions declared as doubles (which neither
+  # truncate strings nor round numbers) and compared directly, and fields
+  # passed through with their input type.
+  def eliminateCommonSubexpressions(self, plan):
+    if plan.root:
+      plan.root = self.shareSubexpressions( plan.root );
+      return plan;
+    else:
+      raise ValueError("Empty plan cannot be optimized.");
+
+  def shareSubexpressions(self, operator):
+    if operator.operatorType() == "TableScan":
+      return operator;
+    elif ( operator.operatorType() == "UnionAll" or operator.operatorType()[-4:] == "Join" ):
+      operator.lhsPlan = self.shareSubexpressions( operator.lhsPlan );
+      operator.rhsPlan = self.shareSubexpressions( operator.rhsPlan );
+      return operator;
+
+    operator.subPlan = self.shareSubexpressions( operator.subPlan );
+    if operator.operatorType() != "Project" or operator.subPlan.operatorType() != "Select" \
+        or operator.subPlan.subPlan.operatorType() == "TableScan":
+      return operator;
+
+    select      = operator.subPlan;
+    inputFields = select.subPlan.schema().fields;
+    inputTypes  = dict( select.subPlan.schema().schema() );
+    outputs     = dict([ (e, k) for (k, (e, _)) in operator.projectExprs.items() ]);
+    try:
+      (selectExpr, replaced, names, uncompared) = SubexpressionReplacer.replace( select.selectExpr, outputs );
+    except SyntaxError:
+      return operator;
+
+    # Every computed output must be shared with the predicate, and the
+    # predicate must not reference fields the projection does not output.
+    computed = [ k for (e, k) in outputs.items() if not ExpressionInfo( e.strip() ).isAttribute() ];
+    if not computed or not replaced or not self.isSubList( computed, list(replaced) ) \
+        or any( n in inputFields or n in operator.projectExprs for n in names ):
+      return operator;
+
+    # Shared outputs must hold the values the predicate computed.
+    for k in replaced:
+      (e, t) = operator.projectExprs[k];
+      if k in computed and (t != 'double' or k in uncompared):
+        return operator;
+      elif k not in computed and inputTypes.get( e.strip(), None ) != t:
+        return operator;
+
+    select.selectExpr = selectExpr;
+    operator.subPlan  = select.subPlan;
+    select.subPlan    = operator;
+    return select;
+
   # Optimize the given query plan, returning the resulting improved plan.
   # This should perform operation pushdown, followed by join order selection.
+  # Expressions are simplified before pushdown, and subexpressions shared
+  # after join ordering, since pushdown would move selections back down.
   def optimizeQuery(self, plan):
-    pushedDown_plan = self.pushdownOperators(plan)
+    simplified_plan = self.simplifyExpressions(plan)
+    pushedDown_plan = self.pushdownOperators(simplified_plan)
     joinPicked_plan = self.pickJoinOrder(pushedDown_plan)
+    shared_plan     = self.eliminateCommonSubexpressions(joinPicked_plan)
     # deleting all the sampling tmp files
     DBFileSystemGC.gc(db=self.db);
-    return joinPicked_plan
+    return shared_plan
 
 if __name__ == "__main__":
   import doctest
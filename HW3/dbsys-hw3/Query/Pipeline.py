@@ -0,0 +1,282 @@
+import ast, sys
+
+from Catalog.Schema            import DBSchema
+from Query.Operator            import Operator
+from Query.Operators.GroupBy   import GroupBy
+from Query.Operators.Project   import Project
+from Query.Operators.Select    import Select
+from Utils.ExpressionInfo      import CompiledExpression
+
+class Pipeline(Operator):
+  """
+  A fused chain of selection, projection and group-by operators, executed
+  as a single generated Python function over the pages of the chain's input.
+
+  The generated function loops over input tuples with the operators'
+  predicates and projections inlined (see Utils.ExpressionInfo's
+  CompiledExpression), and updates group-by aggregates in place, in an
+  in-memory dictionary. Only the pipeline's final output is written to a
+  temporary relation; intermediate results are never materialized, and
+  values flow between fused operators without conversion to their packed
+  representation. Operators above a group-by are applied to its groups.
+
+  Pipelines are built from a plan with Plan.fusePipelines, which replaces
+  every chain of at least two such operators (with at most one group-by).
+
+  >>> import Database
+  >>> db = Database.Database()
+  >>> db.createRelation('lineorder', [('id', 'int'), ('price', 'double'), ('discount', 'double'), ('mode', 'char(10)')])
+  >>> schema = db.relationSchema('lineorder')
+  >>> for tup in [schema.pack(schema.instantiate(i, 10.0 * i, (i % 10) / 100, ['AIR', 'RAIL'][i % 2])) for i in range(100)]:
+  ...    _ = db.insertTuple(schema.name, tup)
+  ...
+
+  ### SELECT mode, sum(price * discount) FROM lineorder WHERE 0.02 <= discount <= 0.06 GROUP BY mode
+  >>> keySchema = DBSchema('modeKey', [('mode', 'char(10)')])
+  >>> aggSchema = DBSchema('revenue', [('revenue', 'double')])
+  >>> query = lambda: db.query().fromTable('lineorder').where("0.02 <= discount <= 0.06").groupBy( \\
+  ...           groupSchema=keySchema, aggSchema=aggSchema, groupExpr=(lambda e: e.mode), \\
+  ...           aggExprs=[(0, lambda acc, e: acc + e.price * e.discount, lambda x: x)], \\
+  ...           groupHashFn=(lambda gbVal: hash(gbVal) % 2)).select( \\
+  ...           {'mode': ('mode.lower()', 'char(10)'), 'revenue': ('round(revenue, 2)', 'double')}).finalize()
+
+  >>> fused = query().fusePipelines()
+  >>> print(fused.explain()) # doctest: +ELLIPSIS
+  Pipeline[...,cost=...](Select[...] -> GroupBy[...] -> Project[...])
+    TableScan[...,cost=...](lineorder)
+
+  >>> results = lambda plan: sorted([tuple(plan.schema().unpack(tup)) for page in db.processQuery(plan) for tup in page[1]])
+  >>> results(fused)
+  [('air', 596.0), ('rail', 394.0)]
+  >>> results(fused) == results(query())
+  True
+
+  # Chains without a group-by emit their input tuples, or projected values.
+  >>> fused = db.query().fromTable('lineorder').where("id < 50").where("mode == 'AIR'").finalize().fusePipelines()
+  >>> [schema.unpack(tup).id for page in db.processQuery(fused) for tup in page[1]][:4]
+  [0, 2, 4, 6]
+  """
+
+  fusedOperators = (Select, Project, GroupBy)
+
+  def __init__(self, subPlan, operators, **kwargs):
+    super().__init__(**kwargs)
+
+    if self.pipelined:
+      raise ValueError("Pipelined fused operators not supported")
+
+    self.subPlan   = subPlan
+    self.operators = operators
+
+  # Replaces fusible operator chains in the plan rooted at the given operator
+  # with pipelines, returning the new root. Chains are maximal sequences of
+  # selections, projections and group-bys with at most one group-by.
+  @classmethod
+  def fuse(cls, operator):
+    chain = []
+    while isinstance(operator, cls.fusedOperators) \
+            and not (isinstance(operator, GroupBy) and any(isinstance(op, GroupBy) for op in chain)):
+      chain.append(operator)
+      operator = operator.subPlan
+
+    if not chain:
+      for attr in ['lhsPlan', 'rhsPlan']:
+        if getattr(operator, attr, None) is not None:
+          setattr(operator, attr, cls.fuse(getattr(operator, attr)))
+      return operator
+
+    chain[-1].subPlan = cls.fuse(operator)
+    return cls(chain[-1].subPlan, list(reversed(chain))) if len(chain) > 1 else chain[0]
+
+  # Returns the output schema of this operator
+  def schema(self):
+    return self.operators[-1].schema()
+
+  # Returns any input schemas for the operator if present
+  def inputSchemas(self):
+    return [self.subPlan.schema()]
+
+  # Returns a string describing the operator type
+  def operatorType(self):
+    return "Pipeline"
+
+  # Returns child operators if present
+  def inputs(self):
+    return [self.subPlan]
+
+  # Prepares the operator and the fused operators for execution.
+  def prepare(self, database):
+    super().prepare(database)
+    for operator in self.operators:
+      operator.prepare(database)
+
+  # Iterator abstraction for the pipeline.
+  def __iter__(self):
+    relId = self.relationId()
+
+    if self.storage.hasRelation(relId):
+      return self.storage.pages(relId);
+
+    self.initializeOutput()
+    self.function = self.compilePipeline()
+    self.outputIterator = self.processAllPages()
+    return self
+
+  def __next__(self):
+    return next(self.outputIterator)
+
+  # Page-at-a-time operator processing
+  def processInputPage(self, pageId, page):
+    raise ValueError("Page-at-a-time processing not supported for pipelines")
+
+  # Set-at-a-time operator processing
+  def processAllPages(self):
+    self.function(iter(self.subPlan))
+    return self.storage.pages(self.relationId())
+
+  # No need to track anything but the last output page, as in batch mode.
+  def trimOutputPages(self):
+    if self.outputPages:
+      self.outputPages = [self.outputPages[-1]]
+
+
+  # Code generation.
+  #
+  # The pipeline is generated as Python source with placeholder names for
+  # inlined expressions, whose syntax trees are substituted after parsing.
+  # Rows are bound to variables '__row0', '__row1', ..., with a new variable
+  # for each projection or group-by. Rows read from the input hold struct
+  # values, and are emitted as the input tuple itself if never projected.
+
+  def compilePipeline(self):
+    self.environment  = { '__emitTuple' : self.emitOutputTuple,
+                          '__emit'      : self.emitOutputInstance,
+                          '__output'    : self.schema(),
+                          '__trim'      : self.trimOutputPages,
+                          '__unpack'    : self.subPlan.schema().binrepr.unpack }
+    self.placeholders = {}
+
+    lines = [ 'def __pipeline(__pages):',
+              '  __aggregates = {}',
+              '  __partitions = {}',
+              '  for (__pageId, __page) in __pages:',
+              '    for __tuple in __page:',
+              '      __row0 = __unpack(__tuple)' ]
+
+    # Code generation state: the indentation, row variable, whether the
+    # row holds struct values, and the row's schema.
+    state = ('      ', 0, True, self.subPlan.schema())
+    for operator in self.operators:
+      if isinstance(operator, Select):
+        state = self.generateSelect(lines, state, operator)
+      elif isinstance(operator, Project):
+        state = self.generateProject(lines, state, operator)
+      else:
+        state = self.generateGroupBy(lines, state, operator)
+
+    (indent, row, raw, schema) = state
+    lines.append(indent + ('__emitTuple(__tuple)' if raw else '__emit(__output, __row' + str(row) + ')'))
+    lines.append('    __trim()')
+
+    self.source = '\n'.join(lines)
+    tree = ast.fix_missing_locations(PlaceholderBinder(self.placeholders).visit(ast.parse(self.source)))
+    exec(compile(tree, '<pipeline>', 'exec'), self.environment)
+    return self.environment['__pipeline']
+
+  # Returns a placeholder name for an inlined expression.
+  def placeholder(self, expr):
+    name = '__expr' + str(len(self.placeholders))
+    (tree, environment) = expr.inline(name + 'Fn')
+    self.placeholders[name] = tree
+    self.environment.update((k, v) for (k, v) in environment.items() if k not in self.environment)
+    return name
+
+  # Returns the global environment of an operator's module, in which the
+  # operator evaluates its expressions.
+  def operatorGlobals(self, operator):
+    return vars(sys.modules[type(operator).__module__])
+
+  def generateSelect(self, lines, state, operator):
+    (indent, row, raw, schema) = state
+
+    # Predicates on struct values may compare dictionary codes.
+    operator.initializePredicate()
+    predicate = operator.predicate if raw else operator.selectExpr
+    decode    = operator.decodeInputs if raw else True
+    expr = CompiledExpression(predicate, [schema], self.operatorGlobals(operator), decode, \
+                              rowNames=['__row' + str(row)], raw=raw)
+
+    lines.append(indent + 'if not (' + self.placeholder(expr) + '):')
+    lines.append(indent + '  continue')
+    return state
+
+  def generateProject(self, lines, state, operator):
+    (indent, row, raw, schema) = state
+    outputSchema = operator.schema()
+    exprs = ["(" + operator.projectExprs[f][0].strip() + ")" for f in outputSchema.fields]
+    expr  = CompiledExpression("(" + ", ".join(exprs) + ",)", [schema], self.operatorGlobals(operator), \
+                               rowNames=['__row' + str(row)], raw=raw)
+
+    lines.append(indent + '__row' + str(row+1) + ' = ' + self.placeholder(expr))
+    return (indent, row+1, False, outputSchema)
+
+  # Group-by operators accumulate aggregates per group, in the order of
+  # the groups' hash partitions as in the group-by operator, and continue
+  # the pipeline in a loop over the groups after consuming all input pages.
+  def generateGroupBy(self, lines, state, operator):
+    (indent, row, raw, schema) = state
+    subSchema  = operator.subSchema
+    converters = subSchema.unpackers if raw else []
+    numAggs    = len(operator.aggExprs)
+
+    self.environment.update({
+        '__makeRecord'  : lambda values: subSchema.clazz._make(DBSchema.convert(values, converters)),
+        '__groupExpr'   : operator.groupExpr,
+        '__groupHashFn' : operator.groupHashFn,
+        '__initial'     : operator.initialExprs() })
+    for (i, (incr, final)) in enumerate(zip(operator.incrExprs(), operator.finalizeExprs())):
+      self.environment['__incr' + str(i)]  = incr
+      self.environment['__final' + str(i)] = final
+
+    lines.extend([indent + line for line in [
+        '__record = __makeRecord(__row' + str(row) + ')',
+        '__key = __groupExpr(__record)',
+        'if not isinstance(__key, tuple):',
+        '  __key = (__key,)',
+        '__acc = __aggregates.get(__key)',
+        'if __acc is None:',
+        '  __acc = __aggregates[__key] = list(__initial)',
+        '  __partitions.setdefault(__groupHashFn(__key), []).append(__key)' ]])
+    lines.extend([indent + '__acc[{0}] = __incr{0}(__acc[{0}], __record)'.format(i) for i in range(numAggs)])
+
+    finals = ', '.join(['__final{0}(__acc[{0}])'.format(i) for i in range(numAggs)])
+    lines.extend([
+        '    __trim()',
+        '  for __keys in __partitions.values():',
+        '    for __key in __keys:',
+        '      __acc = __aggregates[__key]',
+        '      __row' + str(row+1) + ' = __key + (' + finals + ',)' ])
+    return ('      ', row+1, False, operator.schema())
+
+  # Plan and statistics information
+
+  # Returns a single line description of the operator.
+  def explain(self):
+    fused = [op.operatorType() + "[" + str(op.id()) + "]" for op in self.operators]
+    return super().explain() + "(" + " -> ".join(fused) + ")"
+
+
+class PlaceholderBinder(ast.NodeTransformer):
+  """
+  Substitutes the syntax trees of inlined expressions for their placeholder names.
+  """
+  def __init__(self, placeholders):
+    self.placeholders = placeholders
+
+  def visit_Name(self, node):
+    tree = self.placeholders.get(node.id, None)
+    return ast.copy_location(tree, node) if tree is not None else node
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -9,6 +9,7 @@ from Query.Operators.Project   import Project
 from Query.Operators.Union     import Union
 from Query.Operators.Join      import Join
 from Query.Operators.GroupBy   import GroupBy
+from Query.Pipeline            import Pipeline
 
 class Plan:
   """
@@ -136,6 +137,12 @@ class Plan:
     self.root = self.root.pushdownOperators()
     return self
 
+  # Replaces chains of selections, projections and group-bys with
+  # pipelines, each running as a single generated function.
+  def fusePipelines(self):
+    self.root = Pipeline.fuse(self.root)
+    return self
+
 class PlanBuilder:
   """
   A query plan builder class that can be used for LINQ-like construction of queries.
@@ -253,6 +260,134 @@ class PlanBuilder:
   >>> sorted([(tup.id, tup.minAge, tup.maxAge) for tup in q6results]) # doctest:+ELLIPSIS
   [(0, 20, 20), (1, 22, 22), ..., (18, 56, 56), (19, 58, 58)]
 
+  ### SELECT id FROM Employee, stored in a column-partitioned (PAX) layout
+  >>> from Storage.PaxPage import PaxPage
+  >>> db.createRelation('employeePax', [('id', 'int'), ('age', 'int')], pageClass=PaxPage)
+  >>> paxSchema = db.relationSchema('employeePax')
+  >>> for tup in [paxSchema.pack(paxSchema.instantiate(i, 2*i+20)) for i in range(20)]:
+  ...    _ = db.insertTuple(paxSchema.name, tup)
+  ...
+
+  >>> query7 = db.query().fromTable('employeePax', columns=['id']).where("id < 5").finalize()
+  >>> print(query7.explain()) # doctest: +ELLIPSIS
+  Select[...,cost=...](predicate='id < 5')
+    TableScan[...,cost=...](employeePax, columns=['id'])
+
+  >>> [query7.schema().unpack(tup) for page in db.processQuery(query7) for tup in page[1]]
+  [employeePax(id=0), employeePax(id=1), employeePax(id=2), employeePax(id=3), employeePax(id=4)]
+
+  ### SELECT * FROM Shipment WHERE mode = 'RAIL', with a dictionary-encoded mode
+  >>> db.createRelation('shipment', [('id', 'int'), ('mode', 'char(10)')], encodedFields=['mode'])
+  >>> shipSchema = db.relationSchema('shipment')
+  >>> for tup in [shipSchema.pack(shipSchema.instantiate(i, ['AIR', 'RAIL', 'SHIP'][i % 3])) for i in range(20)]:
+  ...    _ = db.insertTuple(shipSchema.name, tup)
+  ...
+
+  >>> shipSchema.size
+  6
+
+  >>> query9 = db.query().fromTable('shipment').where("mode == 'RAIL'").finalize()
+  >>> [shipSchema.unpack(tup) for page in db.processQuery(query9) for tup in page[1]][:2]
+  [shipment(id=1, mode='RAIL'), shipment(id=4, mode='RAIL')]
+
+  ### SELECT * FROM Orders WHERE id >= 2990, skipping pages with a zone map
+  >>> db.createRelation('orders', [('id', 'int'), ('total', 'int')], zoneMaps=True)
+  >>> orderSchema = db.relationSchema('orders')
+  >>> for tup in [orderSchema.pack(orderSchema.instantiate(i, i % 100)) for i in range(3000)]:
+  ...    _ = db.insertTuple(orderSchema.name, tup)
+  ...
+
+  >>> query10 = db.query().fromTable('orders').where("id >= 2990").finalize()
+  >>> [orderSchema.unpack(tup).id for page in db.processQuery(query10) for tup in page[1]][:3]
+  [2990, 2991, 2992]
+
+  >>> print(query10.explain()) # doctest: +ELLIPSIS
+  Select[...,cost=...](predicate='id >= 2990')
+    TableScan[...,cost=...](orders, ranges=[('id', '>=', 2990)])
+
+  ### SELECT * FROM Orders O JOIN Customer C ON O.id = C.custkey WHERE O.id < 3,
+  ### skipping customer pages with Bloom filters on the join key
+  >>> db.createRelation('customer', [('custkey', 'int'), ('region', 'char(8)')], bloomKeys=['custkey', 'region'])
+  >>> custSchema = db.relationSchema('customer')
+  >>> for tup in [custSchema.pack(custSchema.instantiate(i, ['ASIA', 'EUROPE'][i // 2000])) for i in range(3000)]:
+  ...    _ = db.insertTuple(custSchema.name, tup)
+  ...
+
+  >>> query11 = db.query().fromTable('orders').where("id < 3").join( \
+          db.query().fromTable('customer'), \
+          method='hash', \
+          lhsHashFn='hash(id) % 4',  lhsKeySchema=DBSchema('orderKey', [('id', 'int')]), \
+          rhsHashFn='hash(custkey) % 4', rhsKeySchema=DBSchema('custKey', [('custkey', 'int')]), \
+        ).finalize()
+
+  >>> sorted([(tup.id, tup.custkey) for tup in [query11.schema().unpack(tup) for page in db.processQuery(query11) for tup in page[1]]])
+  [(0, 0), (1, 1), (2, 2)]
+
+  >>> query12 = db.query().fromTable('customer').where("region == 'EUROPE' and custkey == 2999").finalize()
+  >>> [custSchema.unpack(tup) for page in db.processQuery(query12) for tup in page[1]]
+  [customer(custkey=2999, region='EUROPE')]
+
+  ### SELECT * FROM Shipments WHERE shipdate >= 19950101, over a range partitioned relation
+  >>> db.createRelation('shipments', [('orderkey', 'int'), ('shipdate', 'int')], \
+                        partitionBy=('range', 'shipdate', [19940101, 19950101]))
+  >>> shipmentSchema = db.relationSchema('shipments')
+  >>> for tup in [shipmentSchema.pack(shipmentSchema.instantiate(i, 19930101 + 10000 * (i % 3))) for i in range(300)]:
+  ...    _ = db.insertTuple(shipmentSchema.name, tup)
+  ...
+
+  >>> query13 = db.query().fromTable('shipments').where("shipdate >= 19950101").finalize()
+  >>> len([tup for page in db.processQuery(query13) for tup in page[1]])
+  100
+  >>> [pId.fileId for (pId, _) in db.storage.pages('shipments', ranges=[('shipdate', '>=', 19950101)])] \
+        == [f.fileId for f in db.storage.fileMgr.partitionFiles('shipments', [2])]
+  True
+
+  ### SELECT * FROM Parts P JOIN Supplies S ON P.partkey = S.partkey, joined partition-wise
+  >>> db.createRelation('parts', [('partkey', 'int'), ('size', 'int')], partitionBy=('hash', 'partkey', 4))
+  >>> db.createRelation('supplies', [('spartkey', 'int'), ('qty', 'int')], partitionBy=('hash', 'spartkey', 4))
+  >>> (partSchema, supplySchema) = (db.relationSchema('parts'), db.relationSchema('supplies'))
+  >>> _ = db.bulkLoad('parts', [partSchema.pack(partSchema.instantiate(i, i % 7)) for i in range(200)])
+  >>> _ = db.bulkLoad('supplies', [supplySchema.pack(supplySchema.instantiate(i % 50, i)) for i in range(400)])
+
+  >>> query14 = db.query().fromTable('parts').join( \
+          db.query().fromTable('supplies'), \
+          method='hash', \
+          lhsHashFn='hash(partkey) % 4',  lhsKeySchema=DBSchema('partKey', [('partkey', 'int')]), \
+          rhsHashFn='hash(spartkey) % 4', rhsKeySchema=DBSchema('supplyKey', [('spartkey', 'int')]), \
+        ).finalize()
+  >>> query14.root.joinPartitions()
+  [0, 1, 2, 3]
+
+  >>> results = [query14.schema().unpack(tup) for page in db.processQuery(query14) for tup in page[1]]
+  >>> len(results), all(tup.partkey == tup.spartkey for tup in results)
+  (400, True)
+
+  ### SELECT * FROM Parts WHERE size < 3, and a column scan, over the column cache
+  >>> db.createRelation('partsC', [('partkey', 'int'), ('size', 'int')])
+  >>> _ = db.bulkLoad('partsC', [partSchema.pack(partSchema.instantiate(i, i % 7)) for i in range(200)])
+  >>> query15 = db.query().fromTable('partsC').where("size < 3").finalize()
+  >>> uncached = sorted([bytes(tup) for page in db.processQuery(query15) for tup in page[1]])
+  >>> db.storage.cacheRelation('partsC')
+  >>> query15 = db.query().fromTable('partsC').where("size < 3").finalize()
+  >>> cached = sorted([bytes(tup) for page in db.processQuery(query15) for tup in page[1]])
+  >>> query15.root.prefiltered, len(cached), cached == uncached
+  (True, 87, True)
+
+  >>> query16 = db.query().fromTable('partsC', columns=['size']).finalize()
+  >>> sum([query16.schema().unpack(tup).size for page in db.processQuery(query16) for tup in page[1]])
+  594
+
+  ### Conjuncts are reordered by their observed pass rates and costs, when
+  ### the predicate is evaluated per tuple, and reverted to their original
+  ### order if a reordered conjunct would fail.
+  >>> query17 = db.query().fromTable('employee').where("str(id).isdigit() and age < 0").finalize()
+  >>> [tup for page in db.processQuery(query17) for tup in page[1]], query17.root.conjunctOrder
+  ([], [1, 0])
+
+  >>> query18 = db.query().fromTable('employee').where("str(id).isdigit() and age != 20 and 100 // (age - 20) > 1").finalize()
+  >>> [schema.unpack(tup).age for page in db.processQuery(query18) for tup in page[1]], query18.root.adaptive
+  ([22, 24, 26, 28, 30, 32, 34, 36, 38, 40, 42, 44, 46, 48, 50, 52, 54, 56, 58], False)
+
   # Populate employees relation with another 10000 tuples
   >>> for tup in [schema.pack(schema.instantiate(i, math.ceil(random.gauss(45, 25)))) for i in range(10000)]:
   ...    _ = db.insertTuple(schema.name, tup)
@@ -284,10 +419,12 @@ class PlanBuilder:
     self.database = other.database
     self.operator = other.operator
 
-  def fromTable(self, relId):
+  # Starts a plan with a table scan. The optional 'columns' list restricts
+  # the scan to the given attributes of the relation.
+  def fromTable(self, relId, columns=None):
     if self.database:
       schema = self.database.relationSchema(relId)
-      return PlanBuilder(operator=TableScan(relId, schema), db=self.database)
+      return PlanBuilder(operator=TableScan(relId, schema, columns=columns), db=self.database)
 
   def where(self, conditionExpr):
     if self.operator:
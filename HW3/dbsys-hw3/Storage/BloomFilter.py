@@ -0,0 +1,265 @@
+import hashlib, os, os.path
+from struct import Struct
+
+class BloomFilter:
+  """
+  A counting Bloom filter, supporting both insertions and deletions.
+
+  Each value is hashed to 'numHashes' counters. Lookups may return false
+  positives, but never false negatives. Counters saturate rather than
+  overflow, and saturated counters are never decremented.
+
+  >>> f = BloomFilter(64, 3)
+  >>> for v in [1, 2, 3, 'AIR']:
+  ...   f.add(v)
+  ...
+  >>> [f.mayContain(v) for v in [1, 2, 3, 'AIR']]
+  [True, True, True, True]
+
+  # Values are normalized, so packed character fields match string constants.
+  >>> f.mayContain(b'AIR\\x00\\x00')
+  True
+
+  >>> f.remove(2)
+  >>> f.mayContain(2)
+  False
+
+  >>> BloomFilter(64, 3, counters=f.pack()).mayContain(3)
+  True
+  """
+
+  maxCount = 255
+
+  def __init__(self, numCounters, numHashes, **kwargs):
+    self.numCounters = numCounters
+    self.numHashes   = numHashes
+    self.counters    = bytearray(kwargs.get("counters", bytes(numCounters)))
+
+  # Returns the byte representation of a value used for hashing.
+  @classmethod
+  def keyBytes(cls, value):
+    if isinstance(value, bytes):
+      return value.rstrip(b"\x00 \n")
+    elif isinstance(value, str):
+      return value.rstrip("\x00 \n").encode()
+    elif isinstance(value, float) and value.is_integer():
+      return str(int(value)).encode()
+    return str(value).encode()
+
+  # Returns the counter positions of a value, using double hashing.
+  @classmethod
+  def positions(cls, value, numCounters, numHashes):
+    digest = hashlib.blake2b(BloomFilter.keyBytes(value), digest_size=16).digest()
+    (h1, h2) = (int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little'))
+    return [(h1 + i * h2) % numCounters for i in range(numHashes)]
+
+  def add(self, value):
+    self.addPositions(BloomFilter.positions(value, self.numCounters, self.numHashes))
+
+  def addPositions(self, positions):
+    for p in positions:
+      if self.counters[p] < BloomFilter.maxCount:
+        self.counters[p] += 1
+
+  def remove(self, value):
+    for p in BloomFilter.positions(value, self.numCounters, self.numHashes):
+      if 0 < self.counters[p] < BloomFilter.maxCount:
+        self.counters[p] -= 1
+
+  def mayContain(self, value):
+    return self.mayContainPositions(BloomFilter.positions(value, self.numCounters, self.numHashes))
+
+  def mayContainPositions(self, positions):
+    return all(self.counters[p] for p in positions)
+
+  def clear(self):
+    self.counters = bytearray(self.numCounters)
+
+  def pack(self):
+    return bytes(self.counters)
+
+
+class PageBloomFilters:
+  """
+  Per-page Bloom filters on the key fields of a storage file.
+
+  Each page has a tuple count and a counting Bloom filter for every
+  key field. All filters in a file have the same size, chosen from the
+  page capacity, so that a probe value is hashed once per scan.
+
+  Pages are tested against probes built from equality range predicates,
+  i.e., (field, '==', constant) triples, and from sets of key values, e.g.,
+  the join keys of another relation. A page is skipped when, for some key
+  field, its filter contains none of the probe values.
+
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('orders', [('orderkey', 'int'), ('custkey', 'int'), ('status', 'char(1)')])
+  >>> bf = PageBloomFilters(schema, ['orderkey', 'status'], numCounters=PageBloomFilters.countersFor(100))
+  >>> for i in range(200):
+  ...   bf.insertTuple(i // 100, schema.pack(schema.instantiate(i, i % 7, 'FO'[i // 100])))
+  ...
+
+  >>> probes = bf.probes([('orderkey', '==', 150)])
+  >>> [bf.mayMatch(i, probes) for i in range(2)]
+  [False, True]
+
+  >>> probes = bf.probes([], {'status': ['O', 'P']})
+  >>> [bf.mayMatch(i, probes) for i in range(2)]
+  [False, True]
+
+  # Predicates on fields without filters do not restrict pages.
+  >>> bf.probes([('custkey', '==', 3), ('orderkey', '<', 10)])
+  []
+
+  >>> bf.deleteTuple(1, schema.pack(schema.instantiate(150, 3, 'O')))
+  >>> bf.mayMatch(1, bf.probes([('orderkey', '==', 150)]))
+  False
+
+  >>> bf.save('test.bloom')
+  >>> bf2 = PageBloomFilters.load('test.bloom', schema, ['orderkey', 'status'])
+  >>> [(c, [f.pack() for f in fs]) for (c, fs) in bf2.pages] == [(c, [f.pack() for f in fs]) for (c, fs) in bf.pages]
+  True
+
+  >>> os.remove('test.bloom')
+
+  >>> PageBloomFilters(schema, ['price'])
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid Bloom filter key fields: price
+  """
+
+  # Counters per key, and hash functions, giving a false positive rate of about 3%.
+  countersPerKey = 8
+  defaultHashes  = 3
+
+  headerRepr = Struct("=III")
+  countRepr  = Struct("=I")
+
+  def __init__(self, schema, keys, **kwargs):
+    missing = [k for k in keys if k not in schema.fields]
+    if missing:
+      raise ValueError("Invalid Bloom filter key fields: " + ', '.join(missing))
+
+    self.schema      = schema
+    self.keys        = list(keys)
+    self.positions   = [schema.fields.index(k) for k in self.keys]
+    self.numCounters = kwargs.get("numCounters", PageBloomFilters.countersFor(1))
+    self.numHashes   = kwargs.get("numHashes", PageBloomFilters.defaultHashes)
+    self.pages       = kwargs.get("pages", [])
+
+  # Returns the filter size for pages holding up to the given number of tuples.
+  @classmethod
+  def countersFor(cls, tuplesPerPage):
+    return max(64, tuplesPerPage * cls.countersPerKey)
+
+  def numPages(self):
+    return len(self.pages)
+
+  def newFilter(self, counters=None):
+    if counters is None:
+      return BloomFilter(self.numCounters, self.numHashes)
+    return BloomFilter(self.numCounters, self.numHashes, counters=counters)
+
+  # Extends the filters with empty pages up to the given page.
+  def ensure(self, pageIndex):
+    while len(self.pages) <= pageIndex:
+      self.pages.append([0, [self.newFilter() for _ in self.keys]])
+
+  # Drops the filters of pages truncated from the file.
+  def truncate(self, numPages):
+    del self.pages[numPages:]
+
+  def count(self, pageIndex):
+    self.ensure(pageIndex)
+    return self.pages[pageIndex][0]
+
+  def values(self, tupleData):
+    values = self.schema.unpack(tupleData)
+    return [values[i] for i in self.positions]
+
+  # Filter maintenance
+  def insertTuple(self, pageIndex, tupleData):
+    self.ensure(pageIndex)
+    entry = self.pages[pageIndex]
+    entry[0] += 1
+    for (f, v) in zip(entry[1], self.values(tupleData)):
+      f.add(v)
+
+  def deleteTuple(self, pageIndex, tupleData):
+    self.ensure(pageIndex)
+    entry = self.pages[pageIndex]
+    entry[0] = max(0, entry[0] - 1)
+    for (f, v) in zip(entry[1], self.values(tupleData)):
+      f.remove(v)
+
+  def updateTuple(self, pageIndex, oldData, tupleData):
+    self.deleteTuple(pageIndex, oldData)
+    self.insertTuple(pageIndex, tupleData)
+
+  # Recomputes a page's filters from its contents.
+  def refresh(self, pageIndex, page):
+    self.ensure(pageIndex)
+    self.pages[pageIndex] = [0, [self.newFilter() for _ in self.keys]]
+    for tupleData in page:
+      self.insertTuple(pageIndex, tupleData)
+
+  # Returns the probes for a scan, as a list of key indexes and the counter positions
+  # of each candidate value for that key. Equality predicates and key value sets
+  # on the same field are intersected.
+  def probes(self, ranges, keyValues=None):
+    candidates = {}
+    for (field, op, value) in ranges:
+      if op == '==' and field in self.keys:
+        candidates[field] = candidates.get(field, {value}) & {value}
+    for (field, values) in (keyValues or {}).items():
+      if field in self.keys:
+        candidates[field] = candidates[field] & set(values) if field in candidates else set(values)
+
+    return [(self.keys.index(field), [BloomFilter.positions(v, self.numCounters, self.numHashes) for v in values]) \
+              for (field, values) in candidates.items()]
+
+  # Returns whether any tuple in the page may match all the given probes.
+  def mayMatch(self, pageIndex, probes):
+    if pageIndex >= len(self.pages):
+      return True
+
+    (count, filters) = self.pages[pageIndex]
+    if count == 0:
+      return False
+
+    for (keyIndex, positions) in probes:
+      if not any(filters[keyIndex].mayContainPositions(p) for p in positions):
+        return False
+    return True
+
+  # Filter serialization
+  def save(self, path):
+    with open(path, 'wb') as f:
+      f.write(PageBloomFilters.headerRepr.pack(len(self.pages), self.numCounters, self.numHashes))
+      for (count, filters) in self.pages:
+        f.write(PageBloomFilters.countRepr.pack(count))
+        f.write(b''.join([bf.pack() for bf in filters]))
+
+  @classmethod
+  def load(cls, path, schema, keys, **kwargs):
+    if os.path.exists(path):
+      with open(path, 'rb') as f:
+        buffer = f.read()
+      (numPages, numCounters, numHashes) = PageBloomFilters.headerRepr.unpack_from(buffer)
+      filters = cls(schema, keys, numCounters=numCounters, numHashes=numHashes)
+      offset  = PageBloomFilters.headerRepr.size
+      for i in range(numPages):
+        count   = PageBloomFilters.countRepr.unpack_from(buffer, offset)[0]
+        offset += PageBloomFilters.countRepr.size
+        pageFilters = []
+        for _ in keys:
+          pageFilters.append(filters.newFilter(buffer[offset:offset+numCounters]))
+          offset += numCounters
+        filters.pages.append([count, pageFilters])
+      return filters
+
+    return cls(schema, keys, **kwargs)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -42,6 +42,7 @@ class BufferPool:
       self.freeListLen  = len(self.freeList)
 
       self.fileMgr      = None
+      self.wal          = None
 
   def fromOther(self, other):
     self.pageSize    = other.pageSize
@@ -51,10 +52,16 @@ class BufferPool:
     self.freeList    = other.freeList
     self.freeListLen = other.freeListLen
     self.fileMgr     = other.fileMgr
+    self.wal         = other.wal
 
   def setFileManager(self, fileMgr):
     self.fileMgr = fileMgr
 
+  # With a write-ahead log, pages are only written back once the
+  # log records describing their changes are durable.
+  def setWriteAheadLog(self, wal):
+    self.wal = wal
+
 
   # Basic statistics
 
@@ -160,6 +167,8 @@ class BufferPool:
           del self.pageMap[pageId]
 
         if page.isDirty():
+          if self.wal:
+            self.wal.flush()
           self.fileMgr.writePage(page)
     else:
       raise ValueError("Uninitalized buffer pool, no file manager found")
@@ -183,7 +192,7 @@ class BufferPool:
         raise ValueError("Could not find a page to evict in the buffer pool")
 
   def clear(self):
-    for (pageId, (offset, page, _)) in self.pageMap.items():
+    for (pageId, (offset, page, _)) in list(self.pageMap.items()):
       if page.isDirty():
         self.flushPage(pageId)
 
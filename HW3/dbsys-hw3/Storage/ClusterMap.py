@@ -0,0 +1,92 @@
+import bisect, math
+
+from Storage.ZoneMap import ZoneMap
+
+class ClusterMap:
+  """
+  A sparse, in-memory map from clustering key values to pages, for
+  storage files whose tuples are kept (approximately) sorted by a key.
+
+  The map records the range of key values inserted into each page, and
+  keeps the pages sorted by the minimum of their range. The page for a
+  key is found by binary search, as the page with the greatest minimum
+  not exceeding the key.
+
+  Ranges only widen as tuples are inserted, so they remain valid (if
+  conservative) after deletions.
+
+  >>> m = ClusterMap()
+  >>> for (pageIndex, key) in [(0, 10), (0, 19), (1, 20), (1, 29), (2, 30)]:
+  ...   m.widen(pageIndex, key)
+  ...
+
+  >>> [m.lookup(k) for k in [5, 10, 25, 29, 100]]
+  [None, 0, 1, 1, 2]
+
+  >>> m.range(1)
+  [20, 29]
+
+  # A page's position changes when its minimum decreases.
+  >>> m.widen(2, 15)
+  >>> [m.lookup(k) for k in [15, 19, 25]]
+  [2, 2, 1]
+
+  >>> [m.mayMatch(i, [('key', '<', 20)], 'key') for i in range(3)]
+  [True, False, True]
+
+  >>> m.remove(2)
+  >>> m.lookup(35)
+  1
+  """
+
+  def __init__(self):
+    self.ranges  = {}
+    self.entries = []
+
+  def numPages(self):
+    return len(self.ranges)
+
+  def range(self, pageIndex):
+    return self.ranges.get(pageIndex, None)
+
+  # Widens a page's key range to include the given value.
+  def widen(self, pageIndex, value):
+    keyRange = self.ranges.get(pageIndex, None)
+    if keyRange is None:
+      self.ranges[pageIndex] = [value, value]
+      bisect.insort(self.entries, (value, pageIndex))
+
+    elif value < keyRange[0]:
+      self.entries.remove((keyRange[0], pageIndex))
+      bisect.insort(self.entries, (value, pageIndex))
+      keyRange[0] = value
+
+    elif value > keyRange[1]:
+      keyRange[1] = value
+
+  def remove(self, pageIndex):
+    keyRange = self.ranges.pop(pageIndex, None)
+    if keyRange is not None:
+      self.entries.remove((keyRange[0], pageIndex))
+
+  # Returns the index of the page with the greatest minimum key not exceeding
+  # the given value, or None if all pages start after the value.
+  def lookup(self, value):
+    i = bisect.bisect_right(self.entries, (value, math.inf))
+    return self.entries[i-1][1] if i > 0 else None
+
+  # Returns whether a page may hold tuples satisfying the given range
+  # predicates on the clustering key.
+  def mayMatch(self, pageIndex, ranges, clusterKey):
+    keyRange = self.ranges.get(pageIndex, None)
+    if keyRange is None:
+      return True
+
+    for (field, op, value) in ranges:
+      if field == clusterKey and not ZoneMap.rangeTests[op](keyRange[0], keyRange[1], value):
+        return False
+    return True
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,494 @@
+import ast, copy
+
+from Catalog.Identifiers import TupleId
+from Catalog.Schema      import Types
+from Storage.Page        import Page
+
+class ColumnExpression:
+  """
+  An expression compiled for evaluation over whole column arrays, covering
+  the arithmetic, comparison and boolean subset of Python expressions.
+  Expressions are given as strings, or as parsed 'eval' mode syntax trees.
+
+  Boolean connectives are rewritten into their elementwise forms (i.e., 'and'
+  into '&', 'or' into '|' and 'not' into '~'), and chained comparisons are
+  split into a conjunction of single comparisons. Operands of connectives must
+  be boolean arrays, since the elementwise forms act bitwise on numbers.
+
+  Expressions that cannot be evaluated over arrays, e.g., those calling string
+  methods or functions, or testing membership or identity (which apply to
+  whole arrays rather than their elements), produce no result, and callers
+  then fall back to evaluating the expression per tuple. Expressions over
+  fields must produce an array, while those without fields are constants,
+  repeated for each row.
+
+  >>> import numpy
+  >>> columns = {'price': numpy.array([10.0, 20.0, 30.0]), 'discount': numpy.array([0.1, 0.0, 0.5])}
+  >>> ColumnExpression("price * (1 - discount)").evaluate(columns, 3).tolist()
+  [9.0, 20.0, 15.0]
+  >>> ColumnExpression("2 + 3").evaluate(columns, 3).tolist()
+  [5, 5, 5]
+
+  >>> ColumnExpression("price or discount").evaluate(columns, 3) is None
+  True
+  >>> ColumnExpression("math.floor(price)").evaluate(columns, 3) is None
+  True
+  >>> [ColumnExpression(e).evaluate(columns, 3) for e in ["price in [10.0]", "discount is not None"]]
+  [None, None]
+  >>> ColumnExpression("len(price)").evaluate({'len': len, 'price': columns['price']}, 3) is None
+  True
+  """
+
+  booleanOps = {ast.And: ast.BitAnd, ast.Or: ast.BitOr}
+
+  # Comparisons applying to whole arrays, rather than elementwise.
+  arrayOps = (ast.In, ast.NotIn, ast.Is, ast.IsNot)
+
+  def __init__(self, expr, numRows=None):
+    self.expr    = expr
+    self.numRows = numRows
+    tree = copy.deepcopy(expr) if isinstance(expr, ast.Expression) else ast.parse(expr.strip(), mode='eval')
+    self.fields  = sorted(set(n.id for n in ast.walk(tree) if isinstance(n, ast.Name)))
+    try:
+      tree = ast.fix_missing_locations(ast.Expression(body=self.vectorize(tree.body)))
+      self.code  = compile(tree, '<column expression>', 'eval')
+    except ValueError:
+      self.code  = None
+
+  # Rewrites an expression node for evaluation over arrays, raising a
+  # ValueError if it has no elementwise form.
+  @classmethod
+  def vectorize(cls, node):
+    if isinstance(node, ast.Compare) and any([isinstance(op, cls.arrayOps) for op in node.ops]):
+      raise ValueError("Unsupported comparison in a column expression")
+
+    elif isinstance(node, ast.BoolOp):
+      values = [cls.boolean(cls.vectorize(v)) for v in node.values]
+      result = values[0]
+      for value in values[1:]:
+        result = ast.BinOp(left=result, op=cls.booleanOps[type(node.op)](), right=value)
+      return result
+
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+      return ast.UnaryOp(op=ast.Invert(), operand=cls.boolean(cls.vectorize(node.operand)))
+
+    elif isinstance(node, ast.Compare) and len(node.ops) > 1:
+      operands = [node.left] + node.comparators
+      pairs = [ast.Compare(left=operands[i], ops=[op], comparators=[operands[i+1]]) \
+                 for (i, op) in enumerate(node.ops)]
+      return cls.vectorize(ast.BoolOp(op=ast.And(), values=pairs))
+
+    return ast.copy_location(cls.vectorizeChildren(node), node)
+
+  # Vectorizes the subexpressions of a node.
+  @classmethod
+  def vectorizeChildren(cls, node):
+    for (field, value) in ast.iter_fields(node):
+      if isinstance(value, ast.expr):
+        setattr(node, field, cls.vectorize(value))
+      elif isinstance(value, list):
+        setattr(node, field, [cls.vectorize(v) if isinstance(v, ast.expr) else v for v in value])
+    return node
+
+  # Wraps an operand of a boolean connective in a check for a boolean value.
+  @classmethod
+  def boolean(cls, node):
+    return ast.Call(func=ast.Name(id='__boolean', ctx=ast.Load()), args=[node], keywords=[])
+
+  @staticmethod
+  def checkBoolean(value):
+    numpy = ColumnCache.numpy()
+    if numpy.asarray(value).dtype != bool:
+      raise TypeError("Non-boolean operand in a vectorized boolean connective")
+    return value
+
+  # Returns the expression's values over the first 'numRows' rows of the given
+  # columns as an array, or None if it cannot be evaluated over arrays.
+  def evaluate(self, columns, numRows=None):
+    numpy   = ColumnCache.numpy()
+    numRows = self.numRows if numRows is None else numRows
+    if self.code is None:
+      return None
+    try:
+      with numpy.errstate(all='ignore'):
+        result = numpy.asarray(eval(self.code, {'__builtins__': {}, '__boolean': ColumnExpression.checkBoolean}, columns))
+    except (TypeError, ValueError, NameError, AttributeError, ArithmeticError, IndexError):
+      return None
+
+    if result.shape == () and not self.fields:
+      return numpy.full(numRows, result.item(), dtype=result.dtype)
+    elif result.shape == (numRows,):
+      return result
+
+
+class ColumnPredicate(ColumnExpression):
+  """
+  A selection predicate compiled for evaluation over whole column arrays,
+  producing a boolean mask of the rows satisfying the predicate.
+
+  >>> import numpy
+  >>> columns = {'a': numpy.arange(6), 'b': numpy.array(['x', 'y', 'x', 'y', 'x', 'y'], dtype=object)}
+  >>> ColumnPredicate("a >= 2 and b == 'x' or not 1 < a < 5", 6).evaluate(columns).tolist()
+  [True, True, True, False, True, True]
+
+  >>> ColumnPredicate("b.startswith('x')", 6).evaluate(columns) is None
+  True
+  >>> ColumnPredicate("a + 1", 6).evaluate(columns) is None
+  True
+  """
+
+  # Returns a boolean mask over the first 'numRows' rows of the given columns,
+  # or None if the predicate cannot be evaluated over arrays.
+  def evaluate(self, columns, numRows=None):
+    mask = super().evaluate(columns, numRows)
+    if mask is not None and mask.dtype == bool:
+      return mask
+
+
+class ColumnBatch:
+  """
+  The tuples of a storage page as a batch of column arrays, for evaluating
+  expressions over a page at a time. Columns are decoded on first use, as
+  in the column cache, with dictionary-encoded fields optionally left as codes.
+
+  >>> from Catalog.Identifiers import FileId, PageId
+  >>> from Catalog.Schema      import DBSchema
+  >>> schema = DBSchema('part', [('partkey', 'int'), ('price', 'double'), ('brand', 'char(10)')])
+  >>> page   = Page(pageId=PageId(FileId(1), 0), buffer=bytes(4096), schema=schema)
+  >>> for i in range(5):
+  ...   _ = page.insertInstance(schema, schema.instantiate(i, 1.5 * i, 'Brand#' + str(i % 2)))
+  ...
+  >>> batch = ColumnBatch.fromPage(page, schema)
+  >>> mask  = ColumnPredicate("price > 2 and brand == 'Brand#0'").evaluate(batch.columns(['price', 'brand']), batch.numRows)
+  >>> [schema.unpack(tup).partkey for tup in batch.tuples(mask)]
+  [2, 4]
+  >>> ColumnExpression("partkey * 2").evaluate(batch.columns(['partkey']), batch.numRows).tolist()
+  [0, 2, 4, 6, 8]
+  """
+
+  def __init__(self, schema, array, decode=True):
+    self.schema  = schema
+    self.array   = array
+    self.numRows = len(array)
+    self.decode  = decode
+    self.decoded = {}
+
+  # Returns a batch over a page's tuples, or None if the page cannot be
+  # viewed as an array of the schema, e.g., for pages of a column cache.
+  @classmethod
+  def fromPage(cls, page, schema, decode=True):
+    if isinstance(page, Page) and page.header.tupleSize == schema.size and ColumnCache.available():
+      return cls(schema, page.asArray(schema), decode)
+
+  # Returns the arrays of the given fields, ignoring names not in the schema.
+  def columns(self, fields):
+    for f in fields:
+      if f not in self.decoded and f in self.schema.fields:
+        i = self.schema.fields.index(f)
+        self.decoded[f] = CachedColumns.decodeColumn(self.schema, i, self.array[f], self.decode)
+    return dict([(f, self.decoded[f]) for f in fields if f in self.decoded])
+
+  # Returns the packed tuples of the rows selected by a boolean mask.
+  def tuples(self, mask):
+    data = self.array[mask].tobytes()
+    size = self.schema.size
+    return [data[k:k+size] for k in range(0, len(data), size)]
+
+
+class CachedColumns:
+  """
+  The cached columns of a relation, as one array per field, with a validity
+  flag per row. Rows are located by tuple id for updates and deletions.
+  Arrays grow by doubling as rows are appended.
+  """
+
+  # Column array types by struct format, with wider types than the packed
+  # format so that arithmetic over columns behaves as over Python values.
+  dtypes = {'b': 'int64', 'B': 'int64', 'h': 'int64', 'H': 'int64', 'i': 'int64', 'I': 'int64', \
+            'q': 'int64', 'f': 'float64', 'd': 'float64'}
+
+  def __init__(self, schema, stableIds):
+    numpy          = ColumnCache.numpy()
+    self.schema    = schema
+    self.stableIds = stableIds
+    self.numRows   = 0
+    self.rowIndex  = {}
+    self.valid     = numpy.zeros(0, dtype=bool)
+    self.columns   = dict([(f, numpy.zeros(0, dtype=self.dtype(i))) for (i, f) in enumerate(schema.fields)])
+
+  def dtype(self, fieldIndex):
+    if self.schema.encoders[fieldIndex] is None:
+      if self.schema.types[fieldIndex].startswith('decimal'):
+        return 'float64'
+      return CachedColumns.dtypes.get(self.schema.formats[fieldIndex][-1], object)
+    return object
+
+  def numTuples(self):
+    return int(self.valid[:self.numRows].sum())
+
+  def reserve(self, numRows):
+    capacity = len(self.valid)
+    if numRows > capacity:
+      numpy    = ColumnCache.numpy()
+      capacity = max(numRows, 2 * capacity, 16)
+      extend   = lambda array: numpy.concatenate([array, numpy.zeros(capacity - len(array), dtype=array.dtype)])
+      self.valid   = extend(self.valid)
+      self.columns = dict([(f, extend(array)) for (f, array) in self.columns.items()])
+
+  # Appends tuples to the cache, given as lists of tuple ids and packed tuples.
+  # Tuple ids may be None for files that do not return them.
+  def append(self, tupleIds, tuples):
+    start = self.numRows
+    self.reserve(start + len(tuples))
+    values = [self.schema.unpack(tupleData) for tupleData in tuples]
+    for (i, f) in enumerate(self.schema.fields):
+      self.columns[f][start:start+len(values)] = [v[i] for v in values]
+    self.valid[start:start+len(values)] = True
+    self.indexRows(start, tupleIds)
+    self.numRows += len(tuples)
+
+  # Appends tuples given as a structured array laid out as packed tuples
+  # (see DBSchema.numpyDtype), converting each field as a whole column.
+  def appendArray(self, tupleIds, array):
+    start = self.numRows
+    end   = start + len(array)
+    self.reserve(end)
+    for (i, f) in enumerate(self.schema.fields):
+      self.columns[f][start:end] = CachedColumns.decodeColumn(self.schema, i, array[f])
+    self.valid[start:end] = True
+    self.indexRows(start, tupleIds)
+    self.numRows = end
+
+  # Converts a field of a structured array of packed tuples into an array of
+  # the field's values, leaving dictionary-encoded fields as codes if requested.
+  @classmethod
+  def decodeColumn(cls, schema, fieldIndex, values, decode=True):
+    numpy   = ColumnCache.numpy()
+    encoder = schema.encoders[fieldIndex]
+    if encoder is not None:
+      return numpy.array(encoder.values, dtype=object)[values] if decode else values.astype('int64')
+    elif values.dtype.kind == 'S':
+      return numpy.char.rstrip(numpy.char.decode(values), "\x00 \n").astype(object)
+    elif Types.isOrdered(schema.types[fieldIndex]):
+      # Ordered encodings are viewed as big-endian integers, and decoded from their bytes.
+      fromBinary  = Types.converters(schema.types[fieldIndex])[1]
+      (raw, size) = (values.tobytes(), values.dtype.itemsize)
+      dtype       = 'float64' if schema.types[fieldIndex].startswith('decimal') else object
+      return numpy.array([fromBinary(raw[k:k+size]) for k in range(0, len(raw), size)], dtype=dtype)
+    return values.astype(cls.dtypes.get(schema.formats[fieldIndex][-1], object))
+
+  def indexRows(self, start, tupleIds):
+    for (row, tupleId) in enumerate(tupleIds):
+      if tupleId is not None:
+        self.rowIndex[tupleId] = start + row
+
+  def update(self, tupleId, tupleData):
+    row = self.rowIndex[tupleId]
+    for (f, v) in zip(self.schema.fields, self.schema.unpack(tupleData)):
+      self.columns[f][row] = v
+
+  def delete(self, tupleId):
+    self.valid[self.rowIndex.pop(tupleId)] = False
+
+  # Returns the valid rows satisfying a predicate, or all valid rows if none is
+  # given, or None if the predicate cannot be evaluated over the columns.
+  def select(self, predicate=None):
+    numpy = ColumnCache.numpy()
+    valid = self.valid[:self.numRows]
+    if predicate:
+      columns = dict([(f, array[:self.numRows]) for (f, array) in self.columns.items()])
+      mask    = ColumnPredicate(predicate, self.numRows).evaluate(columns)
+      if mask is None:
+        return None
+      valid = valid & mask
+    return numpy.flatnonzero(valid)
+
+  # Returns the given rows as packed tuples of a schema over a subset of the
+  # cached fields, grouped into pages of the given size.
+  def pages(self, rows, schema, pageSize):
+    values = [self.columns[f][rows].tolist() for f in schema.fields]
+    tuples = [schema.pack(schema.instantiate(*v)) for v in zip(*values)]
+    tuplesPerPage = max(1, pageSize // schema.size)
+    return iter([(None, CachedPage(tuples[i:i+tuplesPerPage])) for i in range(0, len(tuples), tuplesPerPage)])
+
+
+class CachedPage:
+  """
+  A transient page of tuples produced from a column cache. Cached pages are
+  not backed by the buffer pool, and have no page id or header.
+  """
+
+  def __init__(self, tuples):
+    self.pageId = None
+    self.header = None
+    self.tuples = tuples
+
+  def __iter__(self):
+    return iter(self.tuples)
+
+
+class ColumnCache:
+  """
+  An in-memory column store cache, keeping NumPy column arrays for relations
+  next to their row-oriented storage files.
+
+  Relations are cached explicitly with 'cacheRelation', or automatically once
+  scanned 'hotScans' times, if they hold at most 'maxTuples' tuples. Caches
+  are built from the relation's pages, and kept consistent by the storage
+  engine on inserts, updates and deletions. Bulk loads, vacuuming, and
+  modifications of files whose tuple ids are not stable drop a relation's
+  cached columns, to be rebuilt on the next scan.
+
+  Selections over a cached relation evaluate their predicate over whole
+  columns, and column scans produce their projected tuples from the cache,
+  instead of decoding each tuple from its page. NumPy is only imported once
+  a cache is used.
+
+  >>> from Catalog.Schema import DBSchema
+  >>> from Storage.StorageEngine import StorageEngine
+  >>> import shutil
+  >>> schema = DBSchema('part', [('partkey', 'int'), ('size', 'int'), ('brand', 'char(10)')])
+  >>> storage = StorageEngine(dataDir='data/columns', cacheHotScans=2)
+  >>> storage.createRelation('part', schema)
+  >>> tupleIds = storage.bulkLoad('part', [schema.pack(schema.instantiate(i, i % 50, 'Brand#' + str(i % 5))) for i in range(1000)])
+
+  >>> storage.cacheRelation('part')
+  >>> columns = storage.columnCache.columns('part', schema)
+  >>> columns.numTuples(), columns.columns['size'][:5].tolist()
+  (1000, [0, 1, 2, 3, 4])
+  >>> len(columns.select("size < 10 and brand == 'Brand#3'"))
+  40
+
+  # Predicates without an elementwise form are left to per-tuple evaluation.
+  >>> columns.select("brand in ['Brand#3', 'Brand#4']") is None
+  True
+
+  # Modifications keep the cache consistent.
+  >>> storage.deleteTuple('part', tupleIds[3])
+  >>> storage.updateTuple('part', tupleIds[13], schema.pack(schema.instantiate(13, 99, 'Brand#3')))
+  >>> _ = storage.insertTuple('part', schema.pack(schema.instantiate(1000, 1, 'Brand#3')))
+  >>> len(columns.select("size < 10 and brand == 'Brand#3'")), columns.numTuples()
+  (40, 1000)
+
+  >>> rows = columns.select("size == 99")
+  >>> [schema.unpack(tup) for (_, page) in columns.pages(rows, schema, 4096) for tup in page]
+  [part(partkey=13, size=99, brand='Brand#3')]
+
+  # Relations are cached automatically after repeated scans.
+  >>> storage.createRelation('supplier', schema)
+  >>> _ = storage.insertTuple('supplier', schema.pack(schema.instantiate(1, 1, 'Brand#1')))
+  >>> [storage.columnCache.columns('supplier', schema) is not None for i in range(3)]
+  [False, True, True]
+
+  # Vacuuming drops the cached columns, which are rebuilt on the next scan.
+  >>> storage.vacuum('part')
+  True
+  >>> storage.columnCache.isCached('part'), 'part' in storage.columnCache.entries
+  (True, False)
+  >>> storage.columnCache.columns('part', schema).numTuples()
+  1000
+
+  >>> storage.close()
+  >>> shutil.rmtree('data/columns')
+  """
+
+  defaultMaxTuples = 1 << 20
+
+  def __init__(self, storage, **kwargs):
+    self.storage   = storage
+    self.hotScans  = kwargs.get("hotScans", 0)
+    self.maxTuples = kwargs.get("maxTuples", ColumnCache.defaultMaxTuples)
+    self.selected  = set()
+    self.scans     = {}
+    self.entries   = {}
+
+  @classmethod
+  def numpy(cls):
+    try:
+      import numpy
+    except ImportError:
+      raise ValueError("Column caches require numpy")
+    return numpy
+
+  @classmethod
+  def available(cls):
+    try:
+      cls.numpy()
+      return True
+    except ValueError:
+      return False
+
+  def isCached(self, relId):
+    return relId in self.selected
+
+  def cacheRelation(self, relId, schema=None):
+    self.numpy()
+    self.selected.add(relId)
+    self.columns(relId, schema)
+
+  def uncacheRelation(self, relId):
+    self.selected.discard(relId)
+    self.scans.pop(relId, None)
+    self.entries.pop(relId, None)
+
+  # Returns the cached columns of a relation, building them if the relation
+  # is cached or has become hot, or None otherwise. Each call counts as a scan.
+  def columns(self, relId, schema=None):
+    self.scans[relId] = self.scans.get(relId, 0) + 1
+    if relId not in self.selected and self.hotScans and self.scans[relId] >= self.hotScans \
+         and self.available() and self.storage.relationStats(relId)[2] <= self.maxTuples:
+      self.selected.add(relId)
+
+    if relId in self.selected and relId not in self.entries:
+      self.entries[relId] = self.build(relId, schema)
+    return self.entries.get(relId, None)
+
+  def build(self, relId, schema):
+    files   = self.storage.fileMgr.partitionFiles(relId)
+    schema  = schema if schema else files[0].schema()
+    entry   = CachedColumns(schema, all(rFile.stableTupleIds() for rFile in files))
+    for (pageId, page) in self.storage.pages(relId):
+      tupleIds = [TupleId(pageId, i) for i in page.header.usedSlots()] \
+                   if entry.stableIds and page.header else None
+
+      # Storage pages are decoded as a whole through an array view.
+      if isinstance(page, Page) and page.header.tupleSize == schema.size:
+        array = page.asArray(schema)
+        entry.appendArray(tupleIds if tupleIds else [], array)
+      else:
+        tuples = [bytes(tupleData) for tupleData in page]
+        entry.append(tupleIds if tupleIds else [None] * len(tuples), tuples)
+    return entry
+
+  # Cache maintenance, called by the storage engine after each modification.
+
+  def invalidate(self, relId):
+    self.entries.pop(relId, None)
+
+  def insertTuple(self, relId, tupleId, tupleData):
+    entry = self.entries.get(relId, None)
+    if entry:
+      if entry.stableIds and tupleId is not None:
+        entry.append([tupleId], [tupleData])
+      else:
+        self.invalidate(relId)
+
+  def deleteTuple(self, relId, tupleId):
+    entry = self.entries.get(relId, None)
+    if entry:
+      if entry.stableIds and tupleId in entry.rowIndex:
+        entry.delete(tupleId)
+      else:
+        self.invalidate(relId)
+
+  def updateTuple(self, relId, tupleId, tupleData):
+    entry = self.entries.get(relId, None)
+    if entry:
+      if entry.stableIds and tupleId in entry.rowIndex:
+        entry.update(tupleId, tupleData)
+      else:
+        self.invalidate(relId)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,220 @@
+import lzma, os, os.path, zlib
+from struct import Struct
+
+class PageCodec:
+  """
+  A page compression codec, wrapping a stdlib compression module.
+
+  Codecs are looked up by name with 'forName', which returns None for
+  uncompressed storage. Decompression may optionally be limited to a prefix
+  of the original data, e.g., to read only a page header.
+
+  >>> codec = PageCodec.forName('zlib')
+  >>> data  = bytes(range(16)) * 256
+  >>> packed = codec.compress(data)
+  >>> len(packed) < len(data)
+  True
+
+  >>> codec.decompress(packed) == data
+  True
+
+  >>> codec.decompress(packed, 20) == data[:20]
+  True
+
+  >>> codec = PageCodec.forName('lzma')
+  >>> codec.decompress(codec.compress(data), 20) == data[:20]
+  True
+
+  >>> PageCodec.forName(None) is None
+  True
+
+  >>> PageCodec.forName('snappy')
+  Traceback (most recent call last):
+  ...
+  ValueError: Unknown page compression codec 'snappy'
+  """
+
+  codecs = {}
+
+  def __init__(self, **kwargs):
+    self.level = kwargs.get("level", self.defaultLevel)
+
+  @classmethod
+  def register(cls, codecClass):
+    cls.codecs[codecClass.name] = codecClass
+    return codecClass
+
+  @classmethod
+  def forName(cls, name, **kwargs):
+    if name is None:
+      return None
+    elif name in cls.codecs:
+      return cls.codecs[name](**kwargs)
+    else:
+      raise ValueError("Unknown page compression codec '" + str(name) + "'")
+
+  # Returns whether this codec can be used for pages of the given class.
+  def supports(self, pageClass):
+    return True
+
+  def compress(self, data):
+    raise NotImplementedError
+
+  # Decompresses the given data, producing at most maxLength bytes if a length is given.
+  def decompress(self, data, maxLength=None):
+    raise NotImplementedError
+
+
+@PageCodec.register
+class ZlibCodec(PageCodec):
+  name         = 'zlib'
+  defaultLevel = 6
+
+  def compress(self, data):
+    return zlib.compress(data, self.level)
+
+  def decompress(self, data, maxLength=None):
+    if maxLength:
+      return zlib.decompressobj().decompress(data, maxLength)
+    return zlib.decompress(data)
+
+
+@PageCodec.register
+class LzmaCodec(PageCodec):
+  name         = 'lzma'
+  defaultLevel = 1
+
+  def compress(self, data):
+    return lzma.compress(data, preset=self.level)
+
+  def decompress(self, data, maxLength=None):
+    if maxLength:
+      return lzma.LZMADecompressor().decompress(data, max_length=maxLength)
+    return lzma.decompress(data)
+
+
+class PageMap:
+  """
+  A page map for compressed storage files, mapping each logical page
+  index to its compressed extent in the file.
+
+  Each extent is an (offset, length, capacity) triple. Rewritten pages
+  stay in place while their compressed data fits in the extent's capacity,
+  and are otherwise relocated, to a free extent if one is large enough, or
+  to the end of the file. Extents vacated by relocated pages are kept as
+  (offset, capacity) pairs in a free list, and reused by later relocations
+  and new pages.
+
+  The page map is stored in a side file next to the storage file, as a
+  page count followed by the extent of each page. Free extents are not
+  stored, but recovered as the gaps between page extents when loading.
+
+  >>> m = PageMap()
+  >>> m.setExtent(0, 100, 30, 64)
+  >>> m.setExtent(1, 164, 50, 64)
+  >>> m.numPages()
+  2
+
+  >>> m.extent(1)
+  (164, 50, 64)
+
+  >>> m.save('test.pmap')
+  >>> m2 = PageMap.load('test.pmap')
+  >>> m2.extents == m.extents
+  True
+
+  # Relocating a page frees its extent, which is reused by the next relocation.
+  >>> m.release(100, 64)
+  >>> m.setExtent(0, 228, 70, 128)
+  >>> m.allocate(40), m.free
+  ((100, 64), [])
+  >>> m.allocate(40) is None
+  True
+
+  # Free extents are recovered from the gaps between page extents.
+  >>> m3 = PageMap(extents=[(100, 30, 64), (228, 50, 64), (356, 10, 64)])
+  >>> m3.recoverFree(100)
+  >>> m3.free
+  [(164, 64), (292, 64)]
+
+  >>> os.remove('test.pmap')
+  """
+
+  countRepr  = Struct("=Q")
+  extentRepr = Struct("=QII")
+
+  # Extent capacities are rounded up to this size, giving pages
+  # some room to grow before being relocated.
+  extentAlignment = 64
+
+  def __init__(self, **kwargs):
+    self.extents = kwargs.get("extents", [])
+    self.free    = kwargs.get("free", [])
+
+  def numPages(self):
+    return len(self.extents)
+
+  def extent(self, pageIndex):
+    if pageIndex < len(self.extents):
+      return self.extents[pageIndex]
+
+  def setExtent(self, pageIndex, offset, length, capacity):
+    if pageIndex < len(self.extents):
+      self.extents[pageIndex] = (offset, length, capacity)
+    elif pageIndex == len(self.extents):
+      self.extents.append((offset, length, capacity))
+    else:
+      raise ValueError("Invalid page index for a page map extent")
+
+  @classmethod
+  def capacityFor(cls, length):
+    return -(-length // cls.extentAlignment) * cls.extentAlignment
+
+  # Returns a free (offset, capacity) extent for the given data length, taking
+  # the first large enough free extent and returning the rest of it to the free
+  # list, or None if there is no such extent.
+  def allocate(self, length):
+    capacity = PageMap.capacityFor(length)
+    for (i, (offset, free)) in enumerate(self.free):
+      if free >= capacity:
+        if free > capacity:
+          self.free[i] = (offset + capacity, free - capacity)
+        else:
+          del self.free[i]
+        return (offset, capacity)
+
+  def release(self, offset, capacity):
+    self.free.append((offset, capacity))
+
+  # Drops free extents past the given file size, e.g., after truncating the file.
+  def truncateFree(self, size):
+    self.free = [(o, c) for (o, c) in self.free if o + c <= size]
+
+  # Rebuilds the free list from the gaps between page extents, from the given
+  # start of the page data.
+  def recoverFree(self, start):
+    self.free = []
+    for (offset, _, capacity) in sorted(self.extents):
+      if offset > start:
+        self.free.append((start, offset - start))
+      start = max(start, offset + capacity)
+
+  def save(self, path):
+    with open(path, 'wb') as f:
+      f.write(PageMap.countRepr.pack(len(self.extents)))
+      f.write(b''.join([PageMap.extentRepr.pack(*e) for e in self.extents]))
+
+  @classmethod
+  def load(cls, path):
+    extents = []
+    if os.path.exists(path):
+      with open(path, 'rb') as f:
+        buffer = f.read()
+      numPages = PageMap.countRepr.unpack_from(buffer)[0]
+      extents  = [PageMap.extentRepr.unpack_from(buffer, PageMap.countRepr.size + i * PageMap.extentRepr.size) \
+                    for i in range(numPages)]
+    return cls(extents=extents)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
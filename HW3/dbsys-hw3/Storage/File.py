@@ -1,10 +1,15 @@
-import io, math, os, os.path, pickle, struct
+import io, json, math, os, os.path, pickle, struct
 from struct import Struct
 
 from Catalog.Identifiers import PageId, FileId, TupleId
 from Catalog.Schema      import DBSchema
 from Storage.Page        import PageHeader, Page
 from Storage.SlottedPage import SlottedPageHeader, SlottedPage
+from Storage.Compression import PageCodec, PageMap
+from Storage.ColumnEncoding import ColumnCodec
+from Storage.ZoneMap     import ZoneMap
+from Storage.BloomFilter import PageBloomFilters
+from Storage.ClusterMap  import ClusterMap
 
 class FileHeader:
   """
@@ -13,10 +18,14 @@ class FileHeader:
 
   Our file header object also keeps its own binary representation per instance
   rather than at the class level, since each file may have a variable length schema.
-  The binary representation is a struct, with three components in its format string:
+  The binary representation is a struct, with four components in its format string:
   i.   header length
   ii.  page size
-  iii. a JSON-serialized schema (from DBSchema.packSchema)
+  iii. a JSON-serialized schema (from DBSchema.packSchema, without dictionary contents)
+  iv.  an optional JSON-serialized dictionary of storage options (e.g., compression)
+
+  The options are stored last, and their length is derived from the header length,
+  so that files without options keep the original header layout.
 
   >>> schema = DBSchema('employee', [('id', 'int'), ('dob', 'char(10)'), ('salary', 'int')])
   >>> fh = FileHeader(pageSize=io.DEFAULT_BUFFER_SIZE, pageClass=SlottedPage, schema=schema)
@@ -41,6 +50,15 @@ class FileHeader:
   True
 
   >>> os.remove('test.header')
+
+  ## Test storage options in the file header.
+  >>> options = {'compression': 'zlib'}
+  >>> fh4 = FileHeader(pageSize=io.DEFAULT_BUFFER_SIZE, pageClass=SlottedPage, schema=schema, options=options)
+  >>> FileHeader.unpack(fh4.pack()).options
+  {'compression': 'zlib'}
+
+  >>> FileHeader.unpack(b).options
+  {}
   """
 
   def __init__(self, **kwargs):
@@ -53,11 +71,15 @@ class FileHeader:
       pageSize    = kwargs.get("pageSize", None)
       pageClass   = kwargs.get("pageClass", None)
       schema      = kwargs.get("schema", None)
+      options     = kwargs.get("options", None)
 
       if pageSize and pageClass and schema:
         pageClassLen   = len(pickle.dumps(pageClass))
-        schemaDescLen  = len(schema.packSchema())
-        self.binrepr   = Struct("HQHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
+        schemaDescLen  = len(schema.packSchema(dictionaryValues=False))
+        self.options   = options if options else {}
+        optionsLen     = len(self.packOptions())
+        self.binrepr   = Struct("HQHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s" \
+                                  + (str(optionsLen)+"s" if optionsLen else ""))
         self.size      = self.binrepr.size
         self.pageSize  = pageSize
         self.pageClass = pageClass
@@ -74,6 +96,7 @@ class FileHeader:
     self.pageClass = other.pageClass
     self.schema    = other.schema
     self.numTuples = other.numTuples
+    self.options   = other.options
 
   # File cardinality maintenance
   def insertTuple(self):
@@ -83,29 +106,37 @@ class FileHeader:
     self.numTuples -= 1
 
   # File header serialization
+  def packOptions(self):
+    return json.dumps(self.options, sort_keys=True).encode() if self.options else b''
+
   def pack(self):
     if self.binrepr and self.pageSize and self.schema:
       packedPageClass = pickle.dumps(self.pageClass)
-      packedSchema    = self.schema.packSchema()
+      packedSchema    = self.schema.packSchema(dictionaryValues=False)
+      packedOptions   = (self.packOptions(),) if self.options else ()
       return self.binrepr.pack(self.size, self.numTuples, self.pageSize, \
               len(packedPageClass), len(packedSchema), \
-              packedPageClass, packedSchema)
+              packedPageClass, packedSchema, *packedOptions)
 
   @classmethod
   def unpack(cls, buffer):
     brepr  = cls.binrepr(buffer)
     values = brepr.unpack_from(buffer)
-    if len(values) == 7:
+    if len(values) in [7, 8]:
       pageClass = pickle.loads(values[5])
       schema    = DBSchema.unpackSchema(values[6])
-      return FileHeader(numTuples=values[1], pageSize=values[2], pageClass=pageClass, schema=schema)
+      options   = json.loads(values[7].decode()) if len(values) == 8 else None
+      return FileHeader(numTuples=values[1], pageSize=values[2], pageClass=pageClass, \
+                        schema=schema, options=options)
 
   @classmethod
   def binrepr(cls, buffer):
     lenStruct = Struct("HQHHH")
     (headerLen, _, _, pageClassLen, schemaDescLen) = lenStruct.unpack_from(buffer)
     if headerLen > 0 and pageClassLen > 0 and schemaDescLen > 0:
-      return Struct("HQHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s")
+      fmt        = "HQHHH"+str(pageClassLen)+"s"+str(schemaDescLen)+"s"
+      optionsLen = headerLen - struct.calcsize(fmt)
+      return Struct(fmt + (str(optionsLen)+"s" if optionsLen > 0 else ""))
     else:
       raise ValueError("Invalid header length read from storage file header")
 
@@ -146,6 +177,32 @@ class StorageFile:
   Storage files may also serialize their metadata using the pack() and unpack(),
   allowing their metadata to be written to disk when persisting the database catalog.
 
+  Storage files can optionally compress their pages, by specifying a 'compression'
+  codec name (e.g., 'zlib' or 'lzma', or 'column' for PAX pages) when creating the file. Compressed pages are
+  stored as variable-length extents, located through a page map kept in a side file.
+  Pages are decompressed directly into buffer pool frames when read.
+
+  Storage files can also maintain a zone map, by setting 'zoneMaps' when creating
+  the file. The zone map records each page's tuple count and per-field value ranges,
+  and the page iterator can then skip pages that cannot satisfy a list of range
+  predicates, without reading them into the buffer pool.
+
+  Similarly, 'bloomKeys' lists key fields for which the file keeps a counting
+  Bloom filter per page. Equality predicates on these fields, or sets of candidate
+  key values, let the page iterator skip pages that cannot contain the keys.
+
+  Inserts are placed to touch few pages. Each file keeps the current append page
+  as a hint, filling it before moving on to the first page with room. A 'fillFactor'
+  below 1 limits how full pages become through appends, leaving space for later
+  clustered inserts. With a 'clusterKey' field, the file keeps a sparse map from key
+  values to pages, and a tuple is placed on the page whose key range starts closest
+  before its key. Bulk loads into clustered files are sorted by the clustering key,
+  and range predicates on the key skip pages using the same map.
+
+  Page scans read ahead through the file's I/O scheduler, when the file manager
+  has one (see IOScheduler). The scheduler reads pages with positional reads on
+  a thread for the file's tablespace, and hands them to the buffer pool on a miss.
+
   >>> import shutil, Storage.BufferPool, Storage.FileManager
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
   >>> bp = Storage.BufferPool.BufferPool()
@@ -229,12 +286,175 @@ class StorageFile:
   >>> (bp.numPages() - bp.numFreePages()) == 2
   True
 
+  # Create a compressed relation.
+  >>> fm.createRelation('employeeZ', schema, compression='zlib')
+  >>> (fIdZ, fZ) = fm.relationFile('employeeZ')
+  >>> for tup in [schema.pack(schema.instantiate(i, 2*i+20)) for i in range(3000)]:
+  ...    _ = fZ.insertTuple(tup)
+  ...
+
+  >>> for pId in [pId for pId in bp.pageMap if pId.fileId == fIdZ]:
+  ...    bp.flushPage(pId)
+  ...
+  >>> fZ.flush()
+  >>> fZ.numPages()
+  3
+
+  # Compressed pages take up a fraction of the uncompressed file size.
+  >>> fZ.size() < f.headerSize() + fZ.numPages() * fZ.pageSize() / 2
+  True
+
+  >>> [p[1].numTuples() for p in fZ.headers()]
+  [1007, 1007, 986]
+
+  >>> [schema.unpack(tup).id for tup in next(fZ.directPages())[1]][:5]
+  [0, 1, 2, 3, 4]
+
+  # Reopen the compressed file, reading its page map.
+  >>> fZ.close()
+  >>> fZ2 = StorageFile(bufferPool=bp, fileId=fIdZ, filePath=fZ.path, mode="update")
+  >>> fZ2.header.options
+  {'compression': 'zlib'}
+
+  >>> sum([1 for tup in next(fZ2.directPages())[1]])
+  1007
+
+  # A page outgrowing its extent is relocated, and its old extent is reused.
+  >>> import os
+  >>> (size, oldExtent) = (fZ2.size(), fZ2.pageMap.extent(0))
+  >>> fZ2.writeExtent(fZ2.pageId(0), os.urandom(fZ2.pageSize()))
+  >>> (oldExtent[0], oldExtent[2]) in fZ2.pageMap.free
+  True
+  >>> fZ2.writeExtent(fZ2.pageId(3), os.urandom(oldExtent[1]))
+  >>> fZ2.pageMap.extent(3)[0] == oldExtent[0]
+  True
+
+  # Repeatedly relocating pages does not grow the file without bound.
+  >>> for i in range(10):
+  ...   fZ2.writeExtent(fZ2.pageId(i % 4), os.urandom(fZ2.pageSize() + 64 * (i % 2)))
+  ...
+  >>> fZ2.size() <= size + 5 * (fZ2.pageSize() + 128)
+  True
+
+  >>> fZ2.close()
+
+  # PAX files may use lightweight column encodings instead.
+  >>> from Storage.PaxPage import PaxPage
+  >>> fm.createRelation('employeeC', schema, pageClass=PaxPage, compression='column')
+  >>> (fIdC, fC) = fm.relationFile('employeeC')
+  >>> for tup in [schema.pack(schema.instantiate(i, 20+i//100)) for i in range(3000)]:
+  ...    _ = fC.insertTuple(tup)
+  ...
+  >>> for pId in [pId for pId in bp.pageMap if pId.fileId == fIdC]:
+  ...    bp.flushPage(pId)
+  ...
+  >>> fC.size() < f.headerSize() + fC.numPages() * fC.pageSize() / 4
+  True
+
+  >>> [schema.unpack(tup) for tup in next(fC.directPages())[1]][100:102]
+  [employee(id=100, age=21), employee(id=101, age=21)]
+
+  >>> fm.createRelation('employeeBad', schema, compression='column')
+  Traceback (most recent call last):
+  ...
+  ValueError: Page compression codec does not support the file's page class
+
+  # Create a relation with a zone map.
+  >>> fm.createRelation('employeeM', schema, zoneMaps=True)
+  >>> (fIdM, fM) = fm.relationFile('employeeM')
+  >>> for tup in [schema.pack(schema.instantiate(i, 20+i//100)) for i in range(3000)]:
+  ...    _ = fM.insertTuple(tup)
+  ...
+
+  >>> [(pId.pageIndex, fM.zoneMap.zone(pId.pageIndex)[0]) for (pId, _) in fM.pages()]
+  [(0, 1007), (1, 1007), (2, 986)]
+
+  >>> [pId.pageIndex for (pId, _) in fM.pages(ranges=[('id', '>=', 2500)])]
+  [2]
+
+  >>> [pId.pageIndex for (pId, _) in fM.pages(ranges=[('age', '<', 20)])]
+  []
+
+  # Pages modified directly in the buffer pool are refreshed when written.
+  >>> page = bp.getPage(fM.pageId(2))
+  >>> _ = page.insertTuple(schema.pack(schema.instantiate(5000, 90)))
+  >>> bp.flushPage(page.pageId)
+  >>> [pId.pageIndex for (pId, _) in fM.pages(ranges=[('age', '==', 90)])]
+  [2]
+
+  # Create a relation with Bloom filters on its key field.
+  >>> fm.createRelation('employeeB', schema, bloomKeys=['id'])
+  >>> (fIdB, fB) = fm.relationFile('employeeB')
+  >>> tupleIds = [fB.insertTuple(schema.pack(schema.instantiate(i, 20+i%50))) for i in range(3000)]
+
+  >>> [pId.pageIndex for (pId, _) in fB.pages(ranges=[('id', '==', 2600)])]
+  [2]
+
+  >>> [pId.pageIndex for (pId, _) in fB.pages(keys={'id': [10, 1500]})]
+  [0, 1]
+
+  >>> fB.deleteTuple(tupleIds[2600]) == schema.pack(schema.instantiate(2600, 20))
+  True
+  >>> [pId.pageIndex for (pId, _) in fB.pages(ranges=[('id', '==', 2600)])]
+  []
+
+  # Inserts after deletions fill one page at a time.
+  >>> for tupleId in tupleIds[:2000:2]:
+  ...    _ = fB.deleteTuple(tupleId)
+  ...
+  >>> set([fB.insertTuple(schema.pack(schema.instantiate(5000+i, 20))).pageId.pageIndex for i in range(10)])
+  {2}
+
+  # Create a relation clustered on age, filling pages up to 60% on appends.
+  >>> fm.createRelation('employeeC2', schema, fillFactor=0.6, clusterKey='age')
+  >>> (fIdC2, fC2) = fm.relationFile('employeeC2')
+  >>> for tup in [schema.pack(schema.instantiate(i, 20 + i // 500)) for i in range(1500)]:
+  ...    _ = fC2.insertTuple(tup)
+  ...
+  >>> [(pId.pageIndex, len(list(page))) for (pId, page) in fC2.pages()]
+  [(0, 604), (1, 604), (2, 292)]
+
+  # Clustered inserts use the space left by the fill factor in pages covering their key.
+  >>> tupleIdC2 = fC2.insertTuple(schema.pack(schema.instantiate(1500, 20)))
+  >>> tupleIdC2.pageId.pageIndex
+  0
+  >>> fC2.insertTuple(schema.pack(schema.instantiate(1501, 22))).pageId.pageIndex
+  2
+
+  >>> [pId.pageIndex for (pId, _) in fC2.pages(ranges=[('age', '>=', 22)])]
+  [1, 2]
+
+  # Updates widen the key range of the tuple's page, keeping range scans complete.
+  >>> _ = fC2.updateTuple(tupleIdC2, schema.pack(schema.instantiate(1500, 30)))
+  >>> [pId.pageIndex for (pId, _) in fC2.pages(ranges=[('age', '>=', 30)])]
+  [0]
+  >>> [schema.unpack(tup).id for (_, page) in fC2.pages(ranges=[('age', '>=', 30)]) for tup in page if schema.unpack(tup).age >= 30]
+  [1500]
+
+  # Bulk loads are sorted on the clustering key.
+  >>> fm.createRelation('employeeC3', schema, clusterKey='age')
+  >>> (fIdC3, fC3) = fm.relationFile('employeeC3')
+  >>> tupleIds = fC3.bulkLoad([schema.pack(schema.instantiate(i, 20 + i % 3)) for i in range(1500)])
+  >>> [tupleId.pageId.pageIndex for tupleId in tupleIds[-3:]]
+  [0, 0, 1]
+  >>> [(pId.pageIndex, sorted(set(schema.unpack(tup).age for tup in page))) for (pId, page) in fC3.pages()]
+  [(0, [20, 21, 22]), (1, [22])]
+
+  >>> fm.createRelation('employeeBad2', schema, clusterKey='salary')
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid clustering key for storage file
+
   ## Clean up the doctest
   >>> shutil.rmtree(Storage.FileManager.FileManager.defaultDataDir)
   """
 
   defaultPageClass = SlottedPage
 
+  # Storage options that may be given when creating a file, and
+  # that are recorded in the file header.
+  fileOptions = ["compression", "zoneMaps", "bloomKeys", "fillFactor", "clusterKey"]
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -259,8 +479,9 @@ class StorageFile:
           pageSize  = kwargs.get("pageSize", io.DEFAULT_BUFFER_SIZE)
           pageClass = kwargs.get("pageClass", StorageFile.defaultPageClass)
           schema    = kwargs.get("schema", None)
+          options   = dict([(k, kwargs[k]) for k in self.fileOptions if kwargs.get(k, None)])
           if pageSize and pageClass and schema:
-            self.header   = FileHeader(pageSize=pageSize, pageClass=pageClass, schema=schema)
+            self.header   = FileHeader(pageSize=pageSize, pageClass=pageClass, schema=schema, options=options)
             initHeader    = True
             initFreePages = False
           else:
@@ -278,18 +499,74 @@ class StorageFile:
           raise ValueError("Incompatible storage file mode and on-disk file status")
 
         if self.header:
+          codecName = self.header.options.get("compression", None)
+          if codecName and not PageCodec.forName(codecName).supports(self.pageClass()):
+            raise ValueError("Page compression codec does not support the file's page class")
+
+          bloomKeys = self.header.options.get("bloomKeys", None)
+          if bloomKeys and any(k not in self.schema().fields for k in bloomKeys):
+            raise ValueError("Invalid Bloom filter key fields for storage file")
+
+          fillFactor = self.header.options.get("fillFactor", 1.0)
+          clusterKey = self.header.options.get("clusterKey", None)
+          if not 0 < fillFactor <= 1:
+            raise ValueError("Invalid fill factor for storage file")
+          if clusterKey and clusterKey not in self.schema().fields:
+            raise ValueError("Invalid clustering key for storage file")
+
           self.fileId      = fileId
           self.path        = filePath
           self.file        = io.BufferedRandom(io.FileIO(self.path, ioMode), buffer_size=pageSize)
           self.binrepr     = Struct("H"+str(FileId.binrepr.size)+"s"+str(len(self.path))+"s")
           self.freePages   = set()
 
+          # Compressed files locate their pages through a page map.
+          self.codec       = PageCodec.forName(codecName)
+          self.pageMap     = PageMap.load(self.pageMapPath()) \
+                               if self.codec and mode.lower() == "update" else PageMap()
+          if self.codec:
+            self.pageMap.recoverFree(self.headerSize())
+
+          # Zone maps are kept in a side file, and rebuilt if missing or incomplete.
+          self.zoneMap     = None
+          if self.header.options.get("zoneMaps", False):
+            self.zoneMap   = ZoneMap.load(self.zoneMapPath(), self.schema()) \
+                               if mode.lower() == "update" else ZoneMap(self.schema())
+
+          # Bloom filters on key fields are sized for the page capacity.
+          self.bloomFilters = None
+          if bloomKeys:
+            numCounters       = PageBloomFilters.countersFor(self.pageSize() // self.schema().size)
+            self.bloomFilters = PageBloomFilters.load(self.bloomFilterPath(), self.schema(), bloomKeys, \
+                                                      numCounters=numCounters) \
+                                  if mode.lower() == "update" \
+                                  else PageBloomFilters(self.schema(), bloomKeys, numCounters=numCounters)
+
+          # Insert placement state: the current append page, and the range
+          # of clustering key values inserted into each page.
+          self.fillFactor    = fillFactor
+          self.clusterKey    = clusterKey
+          self.clusterPos    = self.schema().fields.index(clusterKey) if clusterKey else None
+          self.clusterMap    = ClusterMap()
+          self.appendPage    = None
+          self.ioScheduler   = None
+          self.tablespace    = None
+
           page = self.pageClass()(pageId=self.pageId(0), buffer=bytes(self.pageSize()), schema=self.schema())
           self.pageHdrSize = page.header.headerSize()
 
           if initFreePages:
             self.initializeFreePages()
 
+          if self.zoneMap and self.zoneMap.numPages() != self.numPages():
+            self.initializeZoneMap()
+
+          if self.bloomFilters and self.bloomFilters.numPages() != self.numPages():
+            self.initializeBloomFilters()
+
+          if self.clusterKey and mode.lower() == "update":
+            self.initializeClusterMap()
+
           if initHeader:
             self.refreshFileHeader()
 
@@ -307,6 +584,34 @@ class StorageFile:
     self.binrepr     = other.binrepr
     self.freePages   = other.freePages
     self.pageHdrSize = other.pageHdrSize
+    self.codec       = other.codec
+    self.pageMap     = other.pageMap
+    self.zoneMap     = other.zoneMap
+    self.bloomFilters = other.bloomFilters
+    self.fillFactor    = other.fillFactor
+    self.clusterKey    = other.clusterKey
+    self.clusterPos    = other.clusterPos
+    self.clusterMap    = other.clusterMap
+    self.appendPage    = other.appendPage
+    self.ioScheduler   = other.ioScheduler
+    self.tablespace    = other.tablespace
+
+  # Assigns the I/O scheduler and tablespace used to read ahead pages of this file.
+  def setIOScheduler(self, ioScheduler, tablespace):
+    self.ioScheduler = ioScheduler
+    self.tablespace  = tablespace
+
+  # Replaces the schema read from the file header, e.g., with the catalog's
+  # schema holding the contents of dictionary-encoded fields' dictionaries.
+  def setSchema(self, schema):
+    if not schema.match(self.schema()):
+      raise ValueError("Incompatible schema for storage file")
+
+    self.header.schema = schema
+    if self.zoneMap:
+      self.zoneMap.schema = schema
+    if self.bloomFilters:
+      self.bloomFilters.schema = schema
 
   # Refreshes the file header on disk.
   def refreshFileHeader(self):
@@ -322,14 +627,65 @@ class StorageFile:
       if hdr.hasFreeTuple():
         self.freePages.add(pId)
 
+  # Rebuilds the zone map from the pages on disk.
+  def initializeZoneMap(self):
+    self.zoneMap = ZoneMap(self.schema())
+    for (pId, page) in self.directPages():
+      self.zoneMap.refresh(pId.pageIndex, page)
+
+  # Rebuilds the key Bloom filters from the pages on disk.
+  def initializeBloomFilters(self):
+    self.bloomFilters = PageBloomFilters(self.schema(), self.bloomFilters.keys, \
+                                         numCounters=self.bloomFilters.numCounters)
+    for (pId, page) in self.directPages():
+      self.bloomFilters.refresh(pId.pageIndex, page)
+
+  # Rebuilds the clustering key map from the pages on disk.
+  def initializeClusterMap(self):
+    self.clusterMap = ClusterMap()
+    for (pId, page) in self.directPages():
+      for tupleData in page:
+        self.clusterMap.widen(pId.pageIndex, self.clusterValue(tupleData))
+
   # File control
   def flush(self):
     self.file.flush()
+    self.flushSideFiles()
+
+  # Flushes the file and its side files, and syncs the file to disk.
+  def sync(self):
+    self.flush()
+    os.fsync(self.file.fileno())
 
   def close(self):
     if not self.file.closed:
       self.refreshFileHeader()
       self.file.close()
+      self.flushSideFiles()
+
+  # Writes out the page map, zone map and Bloom filters, if present.
+  # This happens on every flush, and thus with each storage engine checkpoint.
+  def flushSideFiles(self):
+    if self.codec:
+      self.pageMap.save(self.pageMapPath())
+    if self.zoneMap:
+      self.zoneMap.save(self.zoneMapPath())
+    if self.bloomFilters:
+      self.bloomFilters.save(self.bloomFilterPath())
+
+  # Returns the paths of all on-disk files backing this storage file.
+  def paths(self):
+    return [p for p in [self.path, self.pageMapPath(), self.zoneMapPath(), self.bloomFilterPath()] \
+              if os.path.exists(p)]
+
+  def pageMapPath(self):
+    return self.path + '.pmap'
+
+  def zoneMapPath(self):
+    return self.path + '.zmap'
+
+  def bloomFilterPath(self):
+    return self.path + '.bloom'
 
   # Storage file helpers
   def pageId(self, pageIndex):
@@ -354,16 +710,27 @@ class StorageFile:
     return self.header.pageClass
 
   def numPages(self):
+    if self.codec:
+      return self.pageMap.numPages()
     return math.floor((self.size() - self.headerSize()) / self.pageSize())
 
   def numTuples(self):
     return self.header.numTuples
 
+  # Returns whether tuple ids remain valid across deletions of other tuples,
+  # as for slotted pages.
+  def stableTupleIds(self):
+    return issubclass(self.pageClass(), SlottedPage)
+
   def pageOffset(self, pageId):
+    if self.codec:
+      return self.pageMap.extent(pageId.pageIndex)[0]
     return self.headerSize() + self.pageSize() * pageId.pageIndex
 
   def pageRange(self, pageId):
     start = self.pageOffset(pageId)
+    if self.codec:
+      return (start, start+self.pageMap.extent(pageId.pageIndex)[1])
     return (start, start+self.pageSize())
 
   def validPageId(self, pageId):
@@ -376,11 +743,16 @@ class StorageFile:
   # Page header operations
 
   # Reads a page header from disk.
+  # For compressed files, only the prefix of the page holding the header is decompressed.
   def readPageHeader(self, pageId):
     if self.validPageId(pageId):
-      self.file.seek(self.pageOffset(pageId))
-      packedHdr = bytearray(self.pageHeaderSize())
-      bytesRead = self.file.readinto(packedHdr)
+      if self.codec:
+        packedHdr = bytearray(self.codec.decompress(self.readExtent(pageId), self.pageHeaderSize()))
+        bytesRead = len(packedHdr)
+      else:
+        self.file.seek(self.pageOffset(pageId))
+        packedHdr = bytearray(self.pageHeaderSize())
+        bytesRead = self.file.readinto(packedHdr)
       if bytesRead == self.pageHeaderSize():
         return self.pageClass().headerClass.unpack(packedHdr)
       else:
@@ -391,7 +763,9 @@ class StorageFile:
   # Writes a page header to disk.
   # The page must already exist, that is we cannot extend the file with only a page header.
   def writePageHeader(self, page):
-    if isinstance(page, self.pageClass()) and self.validPageId(pageId):
+    if self.codec:
+      self.writePage(page)
+    elif isinstance(page, self.pageClass()) and self.validPageId(page.pageId):
       self.file.seek(self.pageOffset(page.pageId))
       self.file.write(page.header.pack())
     else:
@@ -400,29 +774,107 @@ class StorageFile:
 
   # Page operations
 
+  # Reads the compressed data for a page.
+  def readExtent(self, pageId):
+    (offset, length, _) = self.pageMap.extent(pageId.pageIndex)
+    self.file.seek(offset)
+    return self.file.read(length)
+
+  # Writes the compressed data for a page. A page is rewritten in place if
+  # it fits within its current extent, and otherwise written to a free extent
+  # or appended to the file. The page map is saved when a page is relocated,
+  # before its old extent is freed, so that the saved map never refers to an
+  # extent reused by another page.
+  def writeExtent(self, pageId, data):
+    extent = self.pageMap.extent(pageId.pageIndex)
+    if extent and len(data) <= extent[2]:
+      (offset, _, capacity) = extent
+    else:
+      (offset, capacity) = self.pageMap.allocate(len(data)) \
+                             or (self.file.seek(0, io.SEEK_END), PageMap.capacityFor(len(data)))
+
+    self.file.seek(offset)
+    self.file.write(data + bytes(capacity - len(data)))
+    self.pageMap.setExtent(pageId.pageIndex, offset, len(data), capacity)
+
+    if extent and extent[0] != offset:
+      self.file.flush()
+      self.pageMap.save(self.pageMapPath())
+      self.pageMap.release(extent[0], extent[2])
+
   def readPage(self, pageId, bufferForPage):
     if self.validPageId(pageId) and self.validBuffer(bufferForPage):
-      self.file.seek(self.pageOffset(pageId))
-      bytesRead = self.file.readinto(bufferForPage)
+      if self.codec:
+        data = self.codec.decompress(self.readExtent(pageId))
+        bytesRead = len(data)
+        if bytesRead == self.pageSize():
+          bufferForPage[:] = data
+      else:
+        self.file.seek(self.pageOffset(pageId))
+        bytesRead = self.file.readinto(bufferForPage)
       if bytesRead == self.pageSize():
-        page = self.pageClass().unpack(pageId, bufferForPage)
-        # Refresh the free page list based on the on-disk header contents.
-        if page.header.hasFreeTuple() and pageId not in self.freePages:
-          self.freePages.add(pageId)
-        return page
+        return self.loadedPage(pageId, bufferForPage)
       else:
         raise ValueError("Read a partial page")
     else:
       raise ValueError("Invalid page id or page buffer")
 
+  # Reads a page's data with a positional read, leaving the file position untouched.
+  # This is safe to call concurrently with other page reads, e.g., from I/O scheduler threads.
+  def readPageData(self, pageId):
+    (start, end) = self.pageRange(pageId)
+    data = os.pread(self.file.fileno(), end - start, start)
+    return self.codec.decompress(data) if self.codec else data
+
+  # Fills a page buffer with page data read earlier by the I/O scheduler.
+  def readPageFromData(self, pageId, bufferForPage, data):
+    if self.validPageId(pageId) and self.validBuffer(bufferForPage) and len(data) == self.pageSize():
+      bufferForPage[:] = data
+      return self.loadedPage(pageId, bufferForPage)
+    else:
+      raise ValueError("Invalid page id, page buffer or page data")
+
+  def loadedPage(self, pageId, bufferForPage):
+    page = self.pageClass().unpack(pageId, bufferForPage)
+    # Refresh the free page list based on the on-disk header contents.
+    if page.header.hasFreeTuple() and pageId not in self.freePages:
+      self.freePages.add(pageId)
+    return page
+
+  # Schedules reads of the given pages that are not already in the buffer pool.
+  # Buffered writes are flushed first, so that the positional reads see them.
+  def prefetch(self, pageIndexes):
+    if self.ioScheduler and pageIndexes:
+      self.file.flush()
+      for pageIndex in pageIndexes:
+        pId = self.pageId(pageIndex)
+        if not self.bufferPool.hasPage(pId):
+          self.ioScheduler.schedule(self.tablespace, self, pId)
+
+  # Drops any data read ahead for a page, which is stale once the page is
+  # written or truncated.
+  def discardReadAhead(self, pageId):
+    if self.ioScheduler:
+      self.ioScheduler.discard(pageId)
+
   def writePage(self, page):
     if isinstance(page, self.pageClass()):
-      self.file.seek(self.pageOffset(page.pageId))
-      self.file.write(page.pack())
+      self.discardReadAhead(page.pageId)
+      if self.codec:
+        self.writeExtent(page.pageId, self.codec.compress(page.pack()))
+      else:
+        self.file.seek(self.pageOffset(page.pageId))
+        self.file.write(page.pack())
       # Refresh the free page list based on the in-memory header contents.
       # This is needed if the page has been directly modified while resident in the buffer pool.
       if not page.header.hasFreeTuple():
         self.freePages.discard(page.pageId)
+
+      # Similarly, refresh the page's zone if its tuple count is out of date.
+      if self.zoneMap and self.zoneMap.count(page.pageId.pageIndex) != page.header.numTuples():
+        self.zoneMap.refresh(page.pageId.pageIndex, page)
+      if self.bloomFilters and self.bloomFilters.count(page.pageId.pageIndex) != page.header.numTuples():
+        self.bloomFilters.refresh(page.pageId.pageIndex, page)
     else:
       raise ValueError("Incompatible page type during writePage")
 
@@ -434,36 +886,101 @@ class StorageFile:
     self.file.flush()
     return page
 
-  # Returns the page id of the first page with available space.
-  def availablePage(self):
-    if not self.freePages:
-      page = self.allocatePage()
-      self.freePages.add(page.pageId)
-    return next(iter(self.freePages))
+  # Returns the page id of a page with available space for the given tuple,
+  # allocating a new page if needed. With a clustering key, this prefers the
+  # page found for the tuple's key in the clustering key map. Otherwise, this
+  # continues with the current append page, or the first page with room under
+  # the fill factor.
+  def availablePage(self, tupleData=None):
+    if self.clusterKey and tupleData:
+      pId = self.clusteredPage(self.clusterValue(tupleData))
+      if pId:
+        return pId
+
+    if self.appendPage in self.freePages and self.hasRoom(self.appendPage):
+      return self.appendPage
+
+    for pId in sorted(self.freePages, key=lambda pId: pId.pageIndex):
+      if self.hasRoom(pId):
+        return pId
+
+    page = self.allocatePage()
+    self.freePages.add(page.pageId)
+    return page.pageId
+
+  # Returns whether a page with free space may receive appended tuples
+  # under the file's fill factor.
+  def hasRoom(self, pageId):
+    if self.fillFactor >= 1.0:
+      return True
+    header   = self.cachedPageHeader(pageId)
+    capacity = header.numTuples() + header.numFreeTuples()
+    return header.numTuples() < max(1, math.floor(self.fillFactor * capacity))
+
+  # Clustered insert placement helpers.
+  def clusterValue(self, tupleData):
+    return self.schema().binrepr.unpack_from(tupleData)[self.clusterPos]
+
+  # Returns the page whose key range starts closest before the given value,
+  # if it has free space. Values at or beyond the end of the page's range
+  # extend the page as with appends, and are thus subject to the fill factor.
+  def clusteredPage(self, value):
+    pageIndex = self.clusterMap.lookup(value)
+    if pageIndex is not None:
+      pId = self.pageId(pageIndex)
+      if pId in self.freePages and (value < self.clusterMap.range(pageIndex)[1] or self.hasRoom(pId)):
+        return pId
 
 
   # Tuple operations
 
   # Inserts the given tuple to the first available page.
   def insertTuple(self, tupleData):
+    return self.insertTupleIntoPage(self.availablePage(tupleData), tupleData)
+
+  # Inserts the given tuple to a specific page, which must have free space.
+  def insertTupleIntoPage(self, pId, tupleData):
     self.header.insertTuple()
-    pId  = self.availablePage()
     page = self.bufferPool.getPage(pId)
     tupleId = page.insertTuple(tupleData)
     if not page.header.hasFreeTuple():
       self.freePages.discard(pId)
+    if self.zoneMap:
+      self.zoneMap.insertTuple(pId.pageIndex, tupleData)
+    if self.bloomFilters:
+      self.bloomFilters.insertTuple(pId.pageIndex, tupleData)
+    if self.clusterKey:
+      self.clusterMap.widen(pId.pageIndex, self.clusterValue(tupleData))
+    self.appendPage = pId
     return tupleId
 
+  # Inserts a batch of tuples, returning their tuple ids in the order given.
+  # Clustered files insert the tuples in clustering key order.
+  def bulkLoad(self, tuples):
+    tuples = list(tuples)
+    order  = range(len(tuples))
+    if self.clusterKey:
+      order = sorted(order, key=lambda i: self.clusterValue(tuples[i]))
+
+    tupleIds = [None] * len(tuples)
+    for i in order:
+      tupleIds[i] = self.insertTuple(tuples[i])
+    return tupleIds
+
   # Removes the tuple by its id, tracking if the page is now free
   # Returns the deleted tuple for further operations (e.g., index maintenance)
   def deleteTuple(self, tupleId):
     self.header.deleteTuple()
     pId       = tupleId.pageId
     page      = self.bufferPool.getPage(pId)
-    tupleData = page.getTuple(tupleId)
+    tupleData = bytes(page.getTuple(tupleId))
     page.deleteTuple(tupleId)
     if page.header.hasFreeTuple() and pId not in self.freePages:
       self.freePages.add(pId)
+    if self.zoneMap:
+      self.zoneMap.deleteTuple(pId.pageIndex)
+    if self.bloomFilters:
+      self.bloomFilters.deleteTuple(pId.pageIndex, tupleData)
     return tupleData
 
   # Updates the tuple by id
@@ -471,11 +988,139 @@ class StorageFile:
   def updateTuple(self, tupleId, tupleData):
     pId     = tupleId.pageId
     page    = self.bufferPool.getPage(pId)
-    oldData = page.getTuple(tupleId)
+    oldData = bytes(page.getTuple(tupleId))
     page.putTuple(tupleId, tupleData)
+    if self.zoneMap:
+      self.zoneMap.updateTuple(pId.pageIndex, tupleData)
+    if self.bloomFilters:
+      self.bloomFilters.updateTuple(pId.pageIndex, oldData, tupleData)
+    if self.clusterKey:
+      self.clusterMap.widen(pId.pageIndex, self.clusterValue(tupleData))
     return oldData
 
 
+  # Vacuum
+
+  # Performs one incremental vacuum step, compacting the file from its tail.
+  # A step moves all tuples from the last page into free space in earlier pages,
+  # if they fit, and truncates the emptied page from the file. Steps keep no state
+  # between calls, and may be freely interleaved with other file operations.
+  #
+  # Returns a pair of a list of (oldTupleId, newTupleId, tupleData) moves, for
+  # index maintenance, and whether the step made progress. A step makes no
+  # progress if the last page is pinned in the buffer pool, or if earlier
+  # pages do not have enough free space to hold its tuples.
+  #
+  # If given, 'beforeTruncate' is called with the moves before the emptied page
+  # is truncated, e.g., to make the moves durable in a write-ahead log.
+  def vacuumStep(self, beforeTruncate=None):
+    numPages = self.numPages()
+    if numPages == 0:
+      return ([], False)
+
+    lastId = self.pageId(numPages - 1)
+    if self.bufferPool.pagePinCount(lastId):
+      return ([], False)
+
+    lastPage   = self.bufferPool.getPage(lastId)
+    targets    = [pId for pId in self.freePages if pId.pageIndex < lastId.pageIndex]
+    freeTuples = sum([self.cachedPageHeader(pId).numFreeTuples() for pId in targets])
+    if lastPage.header.numTuples() > freeTuples:
+      return ([], False)
+
+    # Tuples are moved in decreasing index order, since deletions from
+    # contiguous pages shift any subsequent tuples.
+    moves = []
+    for tupleIndex in reversed(lastPage.header.usedSlots()):
+      oldId     = TupleId(lastId, tupleIndex)
+      tupleData = self.deleteTuple(oldId)
+      targetId  = min([pId for pId in self.freePages if pId.pageIndex < lastId.pageIndex], \
+                      key=lambda pId: pId.pageIndex)
+      moves.append((oldId, self.insertTupleIntoPage(targetId, tupleData), tupleData))
+
+    if beforeTruncate:
+      beforeTruncate(moves)
+    self.truncatePage(lastId)
+    return (moves, True)
+
+  # Returns a page's header, from the buffer pool if the page is cached.
+  def cachedPageHeader(self, pageId):
+    (_, page, _) = self.bufferPool.getCachedPage(pageId)
+    return page.header if page else self.readPageHeader(pageId)
+
+  # Removes the empty last page of the file, discarding it from the buffer pool.
+  def truncatePage(self, pageId):
+    self.bufferPool.discardPage(pageId)
+    self.discardReadAhead(pageId)
+    self.freePages.discard(pageId)
+    self.file.flush()
+
+    if self.codec:
+      for (offset, _, capacity) in self.pageMap.extents[pageId.pageIndex:]:
+        self.pageMap.release(offset, capacity)
+      del self.pageMap.extents[pageId.pageIndex:]
+      size = max([self.headerSize()] + [o + c for (o, _, c) in self.pageMap.extents])
+      self.file.truncate(size)
+      self.pageMap.truncateFree(size)
+    else:
+      self.file.truncate(self.pageOffset(pageId))
+
+    if self.zoneMap:
+      self.zoneMap.truncate(pageId.pageIndex)
+    if self.bloomFilters:
+      self.bloomFilters.truncate(pageId.pageIndex)
+    self.clusterMap.remove(pageId.pageIndex)
+
+
+  # Recovery
+
+  # Redo operations replay the physical changes of write-ahead log records.
+  # They may be applied to pages that already contain the changes, and extend
+  # the file with any pages allocated after the last checkpoint. File metadata
+  # is rebuilt once all records are replayed, with 'refreshMetadata'.
+  def redoSlot(self, pageIndex, tupleIndex, tupleData):
+    page = self.recoveryPage(pageIndex)
+    page.header.useTupleIndex(tupleIndex)
+    page.putTuple(TupleId(page.pageId, tupleIndex), tupleData)
+    page.setDirty(True)
+
+  def redoDelete(self, pageIndex, tupleIndex):
+    page = self.recoveryPage(pageIndex)
+    if tupleIndex in page.header.usedSlots():
+      page.deleteTuple(TupleId(page.pageId, tupleIndex))
+      page.setDirty(True)
+
+  def redoPage(self, pageIndex, pageData):
+    pId = self.recoveryPage(pageIndex).pageId
+    self.bufferPool.discardPage(pId)
+    self.writePage(self.pageClass().unpack(pId, bytearray(pageData)))
+
+  def recoveryPage(self, pageIndex):
+    while self.numPages() <= pageIndex:
+      self.allocatePage()
+    return self.bufferPool.getPage(self.pageId(pageIndex))
+
+  # Returns the contents of a page, as an empty page if it has been truncated.
+  def pageImage(self, pageId):
+    if pageId.pageIndex < self.numPages():
+      return bytes(self.bufferPool.getPage(pageId).pack())
+    return bytes(self.pageClass()(pageId=pageId, buffer=bytes(self.pageSize()), schema=self.schema()).pack())
+
+  # Recomputes the tuple count, free pages, and page maps from the pages on disk.
+  def refreshMetadata(self):
+    self.header.numTuples = sum([hdr.numTuples() for (_, hdr) in self.headers()])
+    self.freePages  = set()
+    self.appendPage = None
+    self.initializeFreePages()
+    if self.zoneMap:
+      self.initializeZoneMap()
+    if self.bloomFilters:
+      self.initializeBloomFilters()
+    if self.clusterKey:
+      self.initializeClusterMap()
+    self.refreshFileHeader()
+
+
   # Iterators
   # Page header iterator
   def headers(self):
@@ -483,8 +1128,30 @@ class StorageFile:
 
   # Page iterator, using the buffer pool.
   # This can optionally pin the pages in the buffer pool while accessing them.
-  def pages(self, pinned=False):
-    return self.FilePageIterator(self, pinned)
+  # Given a list of (field, operator, constant) range predicates, the iterator
+  # skips any pages that the file's zone map shows cannot contain a match.
+  # Equality predicates, and a dictionary of candidate values per key field,
+  # are also tested against the file's key Bloom filters.
+  def pages(self, pinned=False, ranges=None, keys=None):
+    return self.FilePageIterator(self, pinned, self.pageFilter(ranges or [], keys))
+
+  # Returns a page index predicate for the given ranges and key values,
+  # or None if no page can be skipped.
+  def pageFilter(self, ranges, keys):
+    tests = []
+    if ranges and self.zoneMap:
+      tests.append(lambda pageIndex: self.zoneMap.mayMatch(pageIndex, ranges))
+
+    if ranges and self.clusterKey and any(field == self.clusterKey for (field, _, _) in ranges):
+      tests.append(lambda pageIndex: self.clusterMap.mayMatch(pageIndex, ranges, self.clusterKey))
+
+    if (ranges or keys) and self.bloomFilters:
+      probes = self.bloomFilters.probes(ranges, keys)
+      if probes:
+        tests.append(lambda pageIndex: self.bloomFilters.mayMatch(pageIndex, probes))
+
+    if tests:
+      return lambda pageIndex: all(test(pageIndex) for test in tests)
 
   # Unbuffered page iterator.
   # Use with care, direct pages are not authoritative if the
@@ -543,18 +1210,39 @@ class StorageFile:
         raise StopIteration
 
   class FilePageIterator:
-    def __init__(self, storageFile, pinned=False):
+    def __init__(self, storageFile, pinned=False, pageFilter=None):
       self.currentPageIdx = 0
       self.storageFile    = storageFile
       self.pinned         = pinned
+      self.pageFilter     = pageFilter
+      self.readAheadIdx   = 0
+      self.readAhead()
 
     def __iter__(self):
       return self
 
+    # Schedules reads for the pages within the read-ahead window past the
+    # current position. The first window is scheduled on construction, so
+    # that iterators created together start reading at once.
+    def readAhead(self):
+      ioScheduler = self.storageFile.ioScheduler
+      if ioScheduler:
+        end = min(self.currentPageIdx + ioScheduler.readAhead, self.storageFile.numPages())
+        pageIndexes = [i for i in range(max(self.readAheadIdx, self.currentPageIdx), end) \
+                         if not self.pageFilter or self.pageFilter(i)]
+        self.readAheadIdx = max(self.readAheadIdx, end)
+        self.storageFile.prefetch(pageIndexes)
+
     def __next__(self):
+      if self.pageFilter:
+        while self.currentPageIdx < self.storageFile.numPages() \
+                and not self.pageFilter(self.currentPageIdx):
+          self.currentPageIdx += 1
+
       pId = self.storageFile.pageId(self.currentPageIdx)
       if self.storageFile.validPageId(pId):
         self.currentPageIdx += 1
+        self.readAhead()
         return (pId, self.storageFile.bufferPool.getPage(pId, self.pinned))
       else:
         raise StopIteration
@@ -1,8 +1,14 @@
-import json, io, os, os.path, pickle
+import itertools, json, io, os, os.path, pickle
 
 from Catalog.Schema             import DBSchema
 from Catalog.Identifiers        import FileId
 from Storage.File               import StorageFile
+from Storage.IOScheduler        import IOScheduler
+from Storage.LSMFile            import LSMStorageFile
+from Storage.MemoryFile         import MemoryStorageFile
+from Storage.Partition          import PartitionScheme
+from Storage.SlottedPage        import SlottedPage
+from Storage.WAL                import LogRecord
 from Storage.Index.IndexManager import IndexManager
 
 class FileManager:
@@ -13,6 +19,23 @@ class FileManager:
   relation name to a file identifier, and the second mapping a file
   identifier to the storage file object.
 
+  Relations may also be partitioned by range or hash on a key field, by
+  passing a 'partitionBy' scheme specification when creating the relation
+  (see PartitionScheme). Each partition is stored as its own relation file,
+  named after the relation and the partition index. Tuple operations are
+  routed to the tuple's partition, and page scans skip any partitions
+  excluded by their range predicates and key values.
+
+  Relation files may be spread over several data directories, or tablespaces,
+  e.g., one per disk. Tablespaces are given as a dictionary from names to
+  directories, with the data directory as the 'default' tablespace. A relation
+  is placed on the tablespace named by the 'tablespace' argument when created,
+  and otherwise files are striped round-robin over all tablespaces, including
+  the partitions of a partitioned relation and temporary relations created by
+  query operators. With a positive 'readAhead', the file manager runs an I/O
+  scheduler reading pages ahead of scans on one thread per tablespace, so that
+  scans over files in different tablespaces proceed in parallel.
+
   >>> import Storage.BufferPool
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
   >>> bp = Storage.BufferPool.BufferPool()
@@ -39,10 +62,86 @@ class FileManager:
   >>> bp.setFileManager(fm)
   >>> list(fm.relations())
   ['employee']
+
+  # Create a relation hash partitioned on its id
+  >>> fm.createRelation('employeeP', schema, partitionBy=('hash', 'id', 4))
+  >>> tupleIds = [fm.insertTuple('employeeP', schema.pack(schema.instantiate(i, 20 + i % 10))) for i in range(100)]
+  >>> sorted(fm.relations())
+  ['employee', 'employeeP']
+  >>> [rFile.numTuples() for rFile in fm.partitionFiles('employeeP')]
+  [25, 25, 25, 25]
+
+  >>> [schema.unpack(tup).id for (_, page) in fm.pages('employeeP', ranges=[('id', '==', 42)]) for tup in page][:3]
+  [2, 6, 10]
+
+  >>> fm.deleteTuple('employeeP', tupleIds[42]) == schema.pack(schema.instantiate(42, 22))
+  True
+  >>> len(list(fm.tuples('employeeP')))
+  99
+
+  # Partitioning schemes are restored with the file manager.
+  >>> fm.close()
+  >>> fm = FileManager(bufferPool=bp)
+  >>> bp.setFileManager(fm)
+  >>> fm.partitionScheme('employeeP').spec(), len(fm.partitionFiles('employeeP', [1, 2]))
+  (['hash', 'id', 4], 2)
+
+  >>> fm.removeRelation('employeeP')
+  >>> sorted(fm.relationFiles.keys())
+  ['employee']
+
+  # Stripe a partitioned relation over two tablespaces, and scan it with read-ahead.
+  >>> import shutil
+  >>> spaces = {'disk1': 'data/ts1', 'disk2': 'data/ts2'}
+  >>> fm = FileManager(bufferPool=bp, dataDir='data/ts0', tablespaces=spaces, readAhead=4)
+  >>> bp.setFileManager(fm)
+  >>> fm.createRelation('employeeT', schema, partitionBy=('hash', 'id', 3))
+  >>> fm.createRelation('employeeD', schema, tablespace='disk2')
+  >>> [fm.fileTablespace(rFile) for rFile in fm.partitionFiles('employeeT')]
+  ['default', 'disk1', 'disk2']
+  >>> fm.fileTablespace(fm.relationFile('employeeD')[1]), fm.relationFile('employeeD')[1].path
+  ('disk2', 'data/ts2/3.rel')
+
+  >>> _ = fm.bulkLoad('employeeT', [schema.pack(schema.instantiate(i, 20 + i % 10)) for i in range(3000)])
+  >>> bp.clear()
+  >>> sum(len(list(page)) for (_, page) in fm.pages('employeeT'))
+  3000
+  >>> all(reads > 0 for reads in fm.ioScheduler.reads.values())
+  True
+
+  # Pages read ahead are discarded when truncated or rewritten by their file.
+  >>> (fIdD, fD) = fm.relationFile('employeeD')
+  >>> _ = fm.insertTuple('employeeD', schema.pack(schema.instantiate(1, 30)))
+  >>> bp.clear()
+  >>> fD.prefetch([0])
+  >>> fD.truncatePage(fD.pageId(0))
+  >>> _ = fD.allocatePage()
+  >>> fm.ioScheduler.take(fD.pageId(0)) is None
+  True
+
+  # Tablespaces are restored with the file manager.
+  >>> fm.close()
+  >>> fm = FileManager(bufferPool=bp, dataDir='data/ts0')
+  >>> bp.setFileManager(fm)
+  >>> sorted(fm.tablespaces.items()), len(list(fm.tuples('employeeT')))
+  ([('default', 'data/ts0'), ('disk1', 'data/ts1'), ('disk2', 'data/ts2')], 3000)
+
+  >>> fm.createRelation('employeeX', schema, tablespace='disk3')
+  Traceback (most recent call last):
+  ...
+  ValueError: Unknown tablespace: disk3
+
+  >>> fm.close()
+  >>> for path in spaces.values(): shutil.rmtree(path)
+  >>> shutil.rmtree('data/ts0')
   """
 
   defaultDataDir     = "data/"
   defaultFileClass   = StorageFile
+  defaultTablespace  = "default"
+
+  # Storage file classes selected by the 'storage' argument when creating a relation.
+  storageClasses     = {'heap': StorageFile, 'lsm': LSMStorageFile, 'memory': MemoryStorageFile}
 
   checkpointEncoding = "latin1"
   checkpointFile     = "db.fm"
@@ -67,23 +166,38 @@ class FileManager:
       if not os.path.exists(self.dataDir):
         os.makedirs(self.dataDir)
 
+      self.tablespaces = {FileManager.defaultTablespace: self.dataDir}
+      self.tablespaces.update(kwargs.get("tablespaces", {}))
+      self.ioScheduler = None
+
       if restoring or not checkpointFound:
         self.fileClass     = kwargs.get("fileClass", FileManager.defaultFileClass)
         self.fileCounter   = kwargs.get("fileCounter", 0)
         self.relationFiles = kwargs.get("relationFiles", {})
         self.fileMap       = kwargs.get("fileMap", {})
-        #self.indexManager  = kwargs.get("indexManager", IndexManager(indexDir=self.indexDir))
+        self.indexManager  = kwargs.get("indexManager", None)
+        self.wal           = kwargs.get("wal", None)
+        self.partitionSchemes = dict([(relId, PartitionScheme.fromSpec(spec)) \
+                                        for (relId, spec) in kwargs.get("partitionSchemes", {}).items()])
 
         if restoring:
           self.relationFiles = dict([(i[0], FileId(i[1])) for i in kwargs["restore"][0]])
           for i in kwargs["restore"][1]:
             fId   = FileId(i[0])
             fPath = i[1]
+            fClass = FileManager.unpackFileClass(i[2]) if len(i) > 2 else self.fileClass
             self.fileMap[fId] = \
-              self.fileClass(bufferPool=self.bufferPool, fileId=fId, filePath=fPath, mode="update")
+              fClass(bufferPool=self.bufferPool, fileId=fId, filePath=fPath, mode="update")
 
       else:
+        tablespaces = self.tablespaces
         self.restore()
+        self.tablespaces.update(tablespaces)
+
+      for path in self.tablespaces.values():
+        os.makedirs(path, exist_ok=True)
+
+      self.setReadAhead(kwargs.get("readAhead", 0))
 
   def fromOther(self, other):
     self.bufferPool      = other.bufferPool
@@ -94,7 +208,27 @@ class FileManager:
     self.relationFiles   = other.relationFiles
     self.fileMap         = other.fileMap
     self.indexDir        = other.indexDir
-    #self.indexManager    = other.indexManager
+    self.indexManager    = other.indexManager
+    self.wal             = other.wal
+    self.partitionSchemes = other.partitionSchemes
+    self.tablespaces     = other.tablespaces
+    self.ioScheduler     = other.ioScheduler
+
+  def setWriteAheadLog(self, wal):
+    self.wal = wal
+
+  # Starts an I/O scheduler reading the given number of pages ahead of scans,
+  # or stops read-ahead if the number is not positive.
+  def setReadAhead(self, readAhead):
+    if self.ioScheduler:
+      self.ioScheduler.close()
+      self.ioScheduler = None
+
+    if readAhead > 0:
+      self.ioScheduler = IOScheduler(self.tablespaces.keys(), readAhead=readAhead)
+
+    for storageFile in self.fileMap.values():
+      storageFile.setIOScheduler(self.ioScheduler, self.fileTablespace(storageFile))
 
   # Closes and flushes all storage files in the file manager.
   # This includes flushing all pages held in the buffer pool.
@@ -109,8 +243,19 @@ class FileManager:
     #if self.indexManager:
       #self.indexManager.close()
 
+    if self.ioScheduler:
+      self.ioScheduler.close()
+      self.ioScheduler = None
+
     self.checkpoint()
 
+  # Writes back the headers and side files of all storage files, and syncs them to disk.
+  # The caller must first flush the buffer pool.
+  def sync(self):
+    for storageFile in self.fileMap.values():
+      storageFile.refreshFileHeader()
+      storageFile.sync()
+
   # Save the file manager internals to the data directory.
   # The index manager is responsible for checkpointing itself.
   def checkpoint(self):
@@ -126,36 +271,77 @@ class FileManager:
       self.fromOther(other)
 
   # Return the relation ids present in the file manager.
+  # Partitioned relations are listed in place of their partitions.
   def relations(self):
-    return self.relationFiles.keys()
+    partitions = set([p for relId in self.partitionSchemes for p in self.partitionIds(relId)])
+    return [relId for relId in self.relationFiles if relId not in partitions] + list(self.partitionSchemes.keys())
 
   def hasRelation(self, relId):
-    return relId in self.relationFiles
+    return relId in self.relationFiles or relId in self.partitionSchemes
+
+  # Creates a storage file for a new relation. A 'fileClass' may be given to use
+  # another storage file implementation for this relation, e.g., an LSMStorageFile,
+  # or equivalently a 'storage' kind ('heap', 'lsm' or 'memory'), and a 'tablespace'
+  # to place its file, rather than striping files over tablespaces.
+  # Any additional keyword arguments, such as a 'pageClass', are passed along to
+  # the file class constructor.
+  def createRelation(self, relId, schema, **kwargs):
+    if "partitionBy" in kwargs:
+      self.createPartitionedRelation(relId, schema, PartitionScheme.fromSpec(kwargs.pop("partitionBy")), **kwargs)
+
+    elif not self.hasRelation(relId):
+      fClass     = kwargs.pop("fileClass", self.fileClass)
+      tablespace = kwargs.pop("tablespace", None) or self.stripeTablespace()
+      if "storage" in kwargs:
+        storage = kwargs.pop("storage")
+        if storage not in FileManager.storageClasses:
+          raise ValueError("Unknown storage kind: " + str(storage))
+        fClass = FileManager.storageClasses[storage]
+
+      if tablespace not in self.tablespaces:
+        raise ValueError("Unknown tablespace: " + str(tablespace))
 
-  def createRelation(self, relId, schema):
-    if relId not in self.relationFiles:
       fId = FileId(self.fileCounter)
-      path = os.path.join(self.dataDir, str(self.fileCounter)+'.rel')
+      path = os.path.join(self.tablespaces[tablespace], str(self.fileCounter)+'.rel')
       self.fileCounter += 1
-      self.relationFiles[relId] = fId
       self.fileMap[fId] = \
-        self.fileClass(bufferPool=self.bufferPool, \
+        fClass(bufferPool=self.bufferPool, \
                        fileId=fId, filePath=path, mode="create", \
-                       pageSize=self.defaultPageSize, schema=schema)
+                       pageSize=self.defaultPageSize, schema=schema, **kwargs)
+      self.fileMap[fId].setIOScheduler(self.ioScheduler, tablespace)
+      self.relationFiles[relId] = fId
 
       self.checkpoint()
 
+  def createPartitionedRelation(self, relId, schema, scheme, **kwargs):
+    if scheme.key not in schema.fields:
+      raise ValueError("Invalid partition key for relation " + relId)
+
+    if not self.hasRelation(relId):
+      for p in range(scheme.numPartitions()):
+        self.createRelation(PartitionScheme.partitionRelationId(relId, p), schema, **kwargs)
+      self.partitionSchemes[relId] = scheme
+      self.checkpoint()
+
   def addRelation(self, relId, fileId, storageFile):
     if relId not in self.relationFiles and fileId not in self.fileMap:
       self.fileCounter          = max(self.fileCounter, fileId.fileIndex+1)
       self.relationFiles[relId] = fileId
       self.fileMap[fileId]      = storageFile
+      storageFile.setIOScheduler(self.ioScheduler, self.fileTablespace(storageFile))
       self.checkpoint()
 
   # Removes or detaches a relation from the file manager.
   # When detaching, we do not delete the backing heap file from the file system.
   # This method also removes or detaches any indexes associated with the delation.
   def removeRelation(self, relId, detach=False):
+    if relId in self.partitionSchemes:
+      for partId in self.partitionIds(relId):
+        self.removeRelation(partId, detach)
+      del self.partitionSchemes[relId]
+      self.checkpoint()
+      return
+
     fId   = self.relationFiles.pop(relId, None)
     rFile = self.fileMap.pop(fId, None) if fId else None
     if rFile:
@@ -164,19 +350,81 @@ class FileManager:
 
       if not detach:
         rFile.close()
-        os.remove(rFile.path)
+        for path in rFile.paths():
+          os.remove(path)
 
       self.checkpoint()
 
+  # Assigns a schema to the files of a relation, e.g., the catalog's schema
+  # with dictionary contents, in place of the schema in their file headers.
+  def setRelationSchema(self, relId, schema):
+    for rFile in self.partitionFiles(relId):
+      rFile.setSchema(schema)
+
   def relationFile(self, relId):
     fId = self.relationFiles.get(relId, None) if relId else None
     return (fId, self.fileMap.get(fId, None)) if fId else (None, None)
 
 
+  # Tablespaces
+
+  # Returns the tablespace for the next new file, striping files round-robin.
+  def stripeTablespace(self):
+    names = sorted(self.tablespaces.keys())
+    return names[self.fileCounter % len(names)]
+
+  # Returns the tablespace holding a storage file, based on the file's directory.
+  def fileTablespace(self, storageFile):
+    fileDir = os.path.abspath(os.path.dirname(storageFile.path))
+    for (name, path) in sorted(self.tablespaces.items()):
+      if os.path.abspath(path) == fileDir:
+        return name
+    return FileManager.defaultTablespace
+
+
+  # Partitioned relations
+
+  def partitionScheme(self, relId):
+    return self.partitionSchemes.get(relId, None)
+
+  # Returns the relation ids of the given partitions of a relation, or of all its
+  # partitions if none are given. An unpartitioned relation is its only partition.
+  def partitionIds(self, relId, partitions=None):
+    scheme = self.partitionSchemes.get(relId, None)
+    if scheme is None:
+      return [relId]
+    partitions = range(scheme.numPartitions()) if partitions is None else partitions
+    return [PartitionScheme.partitionRelationId(relId, p) for p in partitions]
+
+  def partitionFiles(self, relId, partitions=None):
+    return [rFile for rFile in [self.relationFile(partId)[1] for partId in self.partitionIds(relId, partitions)] if rFile]
+
+  # Returns the id of the partition that holds the given tuple.
+  def tuplePartition(self, relId, tupleData):
+    scheme = self.partitionSchemes.get(relId, None)
+    if scheme:
+      schema = self.partitionFiles(relId, [0])[0].schema()
+      value  = schema.unpack(tupleData)[schema.fields.index(scheme.key)]
+      return PartitionScheme.partitionRelationId(relId, scheme.partitionOf(value))
+    return relId
+
+  # Returns the id of the partition whose file holds the given tuple id.
+  def tupleIdPartition(self, relId, tupleId):
+    for partId in self.partitionIds(relId):
+      if self.relationFiles.get(partId, None) == tupleId.pageId.fileId:
+        return partId
+    return relId
+
+
   # Page operations
+  # Reads use any page data already read ahead by the I/O scheduler. Storage
+  # files discard a page's read-ahead data when writing or truncating it.
   def readPage(self, pageId, pageBuffer):
     rFile = self.fileMap.get(pageId.fileId, None) if pageId else None
     if rFile:
+      data = self.ioScheduler.take(pageId) if self.ioScheduler else None
+      if data is not None:
+        return rFile.readPageFromData(pageId, pageBuffer, data)
       return rFile.readPage(pageId, pageBuffer)
 
   def writePage(self, page):
@@ -210,23 +458,123 @@ class FileManager:
 
   # Returns a tuple id for the newly inserted data.
   def insertTuple(self, relId, tupleData):
-    (_, rFile) = self.relationFile(relId)
+    (_, rFile) = self.relationFile(self.tuplePartition(relId, tupleData))
     if rFile:# and self.indexManager:
       tupleId = rFile.insertTuple(tupleData)
+      self.logTuple(LogRecord.INSERT, tupleId, tupleData)
       #self.indexManager.insertTuple(relId, tupleData, tupleId)
       return tupleId
 
+  # Inserts a batch of tuples, returning their tuple ids.
+  # Partitioned relations load each partition's tuples as a batch.
+  def bulkLoad(self, relId, tuples):
+    if relId in self.partitionSchemes:
+      tuples   = list(tuples)
+      tupleIds = [None] * len(tuples)
+      batches  = {}
+      for (i, tupleData) in enumerate(tuples):
+        batches.setdefault(self.tuplePartition(relId, tupleData), []).append(i)
+      for (partId, batch) in batches.items():
+        for (i, tupleId) in zip(batch, self.bulkLoad(partId, [tuples[i] for i in batch])):
+          tupleIds[i] = tupleId
+      return tupleIds
+
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      tuples   = list(tuples)
+      tupleIds = rFile.bulkLoad(tuples)
+      for (tupleData, tupleId) in zip(tuples, tupleIds):
+        self.logTuple(LogRecord.INSERT, tupleId, tupleData)
+      if self.indexManager:
+        for (tupleData, tupleId) in zip(tuples, tupleIds):
+          self.indexManager.insertTuple(relId, tupleData, tupleId)
+      return tupleIds
+
   def deleteTuple(self, relId, tupleId):
-    rFile = self.fileMap.get(tupleId.pageId.fileIndex, None)
-    if rFile and self.indexManager:
+    (_, rFile) = self.relationFile(self.tupleIdPartition(relId, tupleId))
+    if rFile:
       tupleData = rFile.deleteTuple(tupleId)
-      self.indexManager.deleteTuple(relId, tupleData, tupleId)
+      self.logDelete(rFile, tupleId)
+      if self.indexManager:
+        self.indexManager.deleteTuple(relId, tupleData, tupleId)
+      return tupleData
 
   def updateTuple(self, relId, tupleId, tupleData):
-    rFile = self.fileMap.get(tupleId.pageId.fileIndex, None)
-    if rFile and self.indexManager:
+    (_, rFile) = self.relationFile(self.tupleIdPartition(relId, tupleId))
+    if rFile:
       oldData = rFile.updateTuple(tupleId, tupleData)
-      self.indexManager.updateTuple(relId, oldData, tupleData, tupleId)
+      self.logTuple(LogRecord.UPDATE, tupleId, tupleData)
+      if self.indexManager:
+        self.indexManager.updateTuple(relId, oldData, tupleData, tupleId)
+      return oldData
+
+  # Incrementally vacuums a relation, performing at most 'maxSteps' steps
+  # (or running to completion if not given), and updating any indexes
+  # on the relation for tuples moved by the vacuum.
+  # Returns whether the vacuum completed, i.e., no further step made progress.
+  def vacuum(self, relId, maxSteps=None):
+    if relId in self.partitionSchemes:
+      return all([self.vacuum(partId, maxSteps) for partId in self.partitionIds(relId)])
+
+    # Moves are logged durably before the file is truncated, since the
+    # moved tuples may otherwise only exist in the buffer pool.
+    def logMoves(moves):
+      for (oldId, newId, tupleData) in moves:
+        self.logDelete(rFile, oldId)
+        self.logTuple(LogRecord.INSERT, newId, tupleData)
+      if self.wal:
+        self.wal.flush()
+
+    (_, rFile) = self.relationFile(relId)
+    if rFile:
+      steps = 0
+      while maxSteps is None or steps < maxSteps:
+        (moves, progress) = rFile.vacuumStep(beforeTruncate=logMoves)
+        if self.indexManager:
+          for (oldId, newId, tupleData) in moves:
+            self.indexManager.updateTuple(relId, tupleData, tupleData, oldId, newId)
+        if not progress:
+          return True
+        steps += 1
+      return False
+
+
+  # Write-ahead logging.
+
+  # Tuple operations are logged as physical redo records for their slot, when the
+  # file manager has a write-ahead log. The caller commits the log for durability.
+  def logTuple(self, op, tupleId, tupleData=b''):
+    if self.wal and tupleId:
+      pId = tupleId.pageId
+      return self.wal.append(LogRecord(op, pId.fileId.fileIndex, pId.pageIndex, tupleId.tupleIndex, tupleData))
+
+  # Deletions from pages that shift their tuples are logged as the page's contents after the deletion.
+  def logDelete(self, rFile, tupleId):
+    if self.wal:
+      pId = tupleId.pageId
+      if issubclass(rFile.pageClass(), SlottedPage):
+        return self.logTuple(LogRecord.DELETE, tupleId)
+      return self.wal.append(LogRecord(LogRecord.PAGE, pId.fileId.fileIndex, pId.pageIndex, 0, rFile.pageImage(pId)))
+
+  # Replays log records into the storage files, after which all replayed pages
+  # are written back and the metadata of the affected files is rebuilt.
+  # Records for files that no longer exist are skipped.
+  def redo(self, records):
+    replayed = {}
+    for record in records:
+      rFile = self.fileMap.get(FileId(record.fileIndex), None)
+      if rFile:
+        replayed[rFile.fileId] = rFile
+        if record.op in [LogRecord.INSERT, LogRecord.UPDATE]:
+          rFile.redoSlot(record.pageIndex, record.tupleIndex, record.data)
+        elif record.op == LogRecord.DELETE:
+          rFile.redoDelete(record.pageIndex, record.tupleIndex)
+        elif record.op == LogRecord.PAGE:
+          rFile.redoPage(record.pageIndex, record.data)
+
+    self.bufferPool.clear()
+    for rFile in replayed.values():
+      rFile.refreshMetadata()
 
 
   # Index-based tuple operations.
@@ -287,15 +635,27 @@ class FileManager:
 
   # Tuple-based table scan
   def tuples(self, relId):
+    if relId in self.partitionSchemes:
+      return itertools.chain(*[rFile.tuples() for rFile in self.partitionFiles(relId)])
+
     (_, rFile) = self.relationFile(relId)
     if rFile:
       return rFile.tuples()
 
   # Page-based table scan
-  def pages(self, relId):
+  # Scans of partitioned relations may be restricted to a list of 'partitions',
+  # and skip partitions excluded by the scan's range predicates and key values.
+  def pages(self, relId, **kwargs):
+    partitions = kwargs.pop("partitions", None)
+    scheme     = self.partitionSchemes.get(relId, None)
+    if scheme:
+      pruned = scheme.prune(kwargs.get("ranges", None) or [], kwargs.get("keys", None))
+      pruned = [p for p in pruned if partitions is None or p in partitions]
+      return itertools.chain(*[rFile.pages(**kwargs) for rFile in self.partitionFiles(relId, pruned)])
+
     (_, rFile) = self.relationFile(relId)
     if rFile:
-      return rFile.pages()
+      return rFile.pages(**kwargs)
 
 
   # File manager serialization
@@ -303,16 +663,30 @@ class FileManager:
     if self.relationFiles is not None and self.fileMap is not None:
       pfileClass     = pickle.dumps(self.fileClass).decode(encoding=FileManager.checkpointEncoding)
       prelationFiles = list(map(lambda entry: (entry[0], entry[1].fileIndex), self.relationFiles.items()))
-      pfileMap       = list(map(lambda entry: (entry[0].fileIndex, entry[1].path), self.fileMap.items()))
-      return json.dumps((self.dataDir, self.indexDir, pfileClass, self.fileCounter, prelationFiles, pfileMap))
+      pfileMap       = list(map(lambda entry: (entry[0].fileIndex, entry[1].path, \
+                                               FileManager.packFileClass(type(entry[1]))), self.fileMap.items()))
+      pschemes       = dict([(relId, scheme.spec()) for (relId, scheme) in self.partitionSchemes.items()])
+      return json.dumps((self.dataDir, self.indexDir, pfileClass, self.fileCounter, \
+                         prelationFiles, pfileMap, pschemes, self.tablespaces))
+
+  # Storage file classes are recorded per relation.
+  @classmethod
+  def packFileClass(cls, fileClass):
+    return pickle.dumps(fileClass).decode(encoding=FileManager.checkpointEncoding)
+
+  @classmethod
+  def unpackFileClass(cls, packedFileClass):
+    return pickle.loads(packedFileClass.encode(encoding=FileManager.checkpointEncoding))
 
   @classmethod
   def unpack(cls, bufferPool, strBuffer):
     args = json.loads(strBuffer)
-    if len(args) == 6:
+    if len(args) in [6, 7, 8]:
       unfileClass = pickle.loads(args[2].encode(encoding=FileManager.checkpointEncoding))
       return cls(bufferPool=bufferPool, dataDir=args[0], indexDir=args[1], \
-                 fileClass=unfileClass, fileCounter=args[3], restore=(args[4], args[5]))
+                 fileClass=unfileClass, fileCounter=args[3], restore=(args[4], args[5]), \
+                 partitionSchemes=args[6] if len(args) > 6 else {}, \
+                 tablespaces=args[7] if len(args) > 7 else {})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+import collections, threading
+
+class IOScheduler:
+  """
+  An I/O scheduler issuing page reads to each tablespace in parallel.
+
+  The scheduler runs one reader thread per tablespace, each with its own
+  queue of page read requests. Scans schedule reads for the pages ahead of
+  their position, and the buffer pool then picks up the page data when it
+  faults the page in, waiting for any read still in flight. Scans over files
+  in different tablespaces thus keep all devices busy at once.
+
+  Prefetched data is discarded whenever its page is written, and only a
+  bounded number of unconsumed pages are kept.
+
+  >>> class DataFile:
+  ...   def readPageData(self, pageId):
+  ...     return bytes([pageId % 256]) * 4
+  ...
+  >>> s = IOScheduler(['ts0', 'ts1'], readAhead=4)
+  >>> f = DataFile()
+  >>> for pageId in range(10):
+  ...   s.schedule('ts' + str(pageId % 2), f, pageId)
+  ...
+  >>> [s.take(pageId) for pageId in [3, 4]]
+  [b'\\x03\\x03\\x03\\x03', b'\\x04\\x04\\x04\\x04']
+
+  # Pages are only taken once, and written pages are discarded.
+  >>> s.take(3) is None
+  True
+  >>> s.take(5) is not None
+  True
+  >>> s.discard(6)
+  >>> s.take(6) is None
+  True
+
+  >>> s.reads
+  {'ts0': 5, 'ts1': 5}
+  >>> s.close()
+  """
+
+  defaultReadAhead = 8
+  defaultMaxPages  = 1024
+
+  def __init__(self, tablespaces, **kwargs):
+    self.readAhead = kwargs.get("readAhead", IOScheduler.defaultReadAhead)
+    self.maxPages  = kwargs.get("maxPages", IOScheduler.defaultMaxPages)
+    self.condition = threading.Condition()
+    self.queues    = dict([(ts, collections.deque()) for ts in tablespaces])
+    self.reads     = dict([(ts, 0) for ts in tablespaces])
+
+    # Pages with a read in flight, mapped to whether the read is still
+    # valid, and pages read but not yet taken, in read order.
+    self.pending   = {}
+    self.ready     = collections.OrderedDict()
+    self.running   = True
+    self.workers   = [threading.Thread(target=self.work, args=(ts,), daemon=True) for ts in tablespaces]
+    for worker in self.workers:
+      worker.start()
+
+  def close(self):
+    with self.condition:
+      self.running = False
+      self.condition.notify_all()
+    for worker in self.workers:
+      worker.join()
+
+  # Requests a read of a page from the given storage file, on the file's tablespace.
+  def schedule(self, tablespace, storageFile, pageId):
+    with self.condition:
+      if pageId not in self.pending and pageId not in self.ready:
+        self.pending[pageId] = True
+        self.queues[tablespace].append((storageFile, pageId))
+        self.condition.notify_all()
+
+  # Returns the prefetched data for a page, waiting for a read in flight,
+  # or None if the page has not been prefetched.
+  def take(self, pageId):
+    with self.condition:
+      while pageId in self.pending:
+        self.condition.wait()
+      return self.ready.pop(pageId, None)
+
+  # Drops any prefetched data for a page, e.g., when the page is written.
+  def discard(self, pageId):
+    with self.condition:
+      self.ready.pop(pageId, None)
+      if pageId in self.pending:
+        self.pending[pageId] = False
+
+  # Reader thread for a tablespace. Reads are performed without holding
+  # the scheduler's lock, so that tablespaces proceed in parallel.
+  def work(self, tablespace):
+    queue = self.queues[tablespace]
+    while True:
+      with self.condition:
+        while self.running and not queue:
+          self.condition.wait()
+        if not self.running:
+          return
+        (storageFile, pageId) = queue.popleft()
+
+      try:
+        data = storageFile.readPageData(pageId)
+      except (OSError, ValueError):
+        data = None
+
+      with self.condition:
+        if self.pending.pop(pageId, False) and data is not None:
+          self.ready[pageId] = data
+          self.reads[tablespace] += 1
+          while len(self.ready) > self.maxPages:
+            self.ready.popitem(last=False)
+        self.condition.notify_all()
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -454,8 +454,10 @@ class IndexManager:
   # The old and new keys for each index should be extracted from the full tuples.
   # For each index, based on whether the key is changing, this method should issue
   # the appropriate DB delete+insert calls.
-  # Note: since our storage engine uses heap files only, the tuple id itself should not change.
-  def updateTuple(self, relId, oldData, newData, tupleId):
+  # The tuple id only changes when a tuple is moved between pages, e.g., by a vacuum,
+  # in which case the new tuple id is given and all index entries are rewritten.
+  def updateTuple(self, relId, oldData, newData, tupleId, newTupleId=None):
+    newTupleId = tupleId if newTupleId is None else newTupleId
     if self.hasIndexes(relId):
       schema, _, _ = self.relationIndexes[relId]
       indexes      = self.indexes(relId)
@@ -466,24 +468,22 @@ class IndexManager:
             oldKey  = schema.projectBinary(oldData, keySchema)
             newKey  = schema.projectBinary(newData, keySchema)
 
-            # If the keys are the same, we do not need to perform any operations.
-            # That is, we assume the tuple id argument is the same as the existing
-            # entry (since this is a tuple id), and we do not check this.
-            if oldKey == newKey:
+            # If the keys and tuple ids are the same, we do not need to perform any operations.
+            if oldKey == newKey and tupleId == newTupleId:
               pass
 
-            # Insert a new index entry if the key has changed.
+            # Insert a new index entry if the key or tuple id has changed.
             else:
               if primary:
                 indexDb.delete(oldKey)
-                indexDb.put(newKey, tupleId.pack(), flags=db.DB_NOOVERWRITE)
+                indexDb.put(newKey, newTupleId.pack(), flags=db.DB_NOOVERWRITE)
               else:
                 # Update only the tuple matching the given tuple id.
                 crsr = indexDb.cursor()
                 found = crsr.get_both(oldKey, tupleId.pack())
                 if found:
                   crsr.delete()
-                  crsr.put(newKey, tupleId.pack(), flags=db.DB_KEYLAST)
+                  crsr.put(newKey, newTupleId.pack(), flags=db.DB_KEYLAST)
                     # TODO: flags based on whether the secondary index is unique?
                 crsr.close()
 
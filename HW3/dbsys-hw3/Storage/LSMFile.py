@@ -0,0 +1,521 @@
+import bisect, heapq, io, json, os, os.path, threading, weakref
+
+from Catalog.Identifiers import PageId
+from Storage.File        import StorageFile
+from Storage.ZoneMap     import ZoneMap
+
+class SortedRun:
+  """
+  An immutable run of tuples sorted by a key, stored as a sequence of full
+  pages in its own file.
+
+  Each run owns a range of page indexes in its storage file, starting at
+  'firstPage', which is never reused by later runs. Pages of a run can thus
+  be cached in the buffer pool without ever being confused with pages of
+  the runs replacing it after a compaction.
+
+  Runs record the key range of each page, to skip pages on range predicates
+  over the key.
+  """
+
+  def __init__(self, **kwargs):
+    self.runId     = kwargs.get("runId", None)
+    self.path      = kwargs.get("path", None)
+    self.firstPage = kwargs.get("firstPage", 0)
+    self.numTuples = kwargs.get("numTuples", 0)
+    self.keys      = kwargs.get("keys", [])
+    self.file      = io.FileIO(self.path, 'rb') if os.path.exists(self.path) else None
+
+  def numPages(self):
+    return len(self.keys)
+
+  def containsPage(self, pageIndex):
+    return self.firstPage <= pageIndex < self.firstPage + self.numPages()
+
+  def minKey(self):
+    return self.keys[0][0] if self.keys else None
+
+  def maxKey(self):
+    return self.keys[-1][1] if self.keys else None
+
+  # Returns whether a page of the run may hold tuples satisfying the given
+  # range predicates on the key field.
+  def mayMatch(self, pageIndex, ranges, sortKey):
+    (lo, hi) = self.keys[pageIndex - self.firstPage]
+    return all(ZoneMap.rangeTests[op](lo, hi, value) for (field, op, value) in ranges if field == sortKey)
+
+  # Reads a page with a positional read, so that concurrent scans and
+  # compactions may share the run's file handle.
+  def readPage(self, pageIndex, pageSize, buffer):
+    data = os.pread(self.file.fileno(), pageSize, (pageIndex - self.firstPage) * pageSize)
+    buffer[:len(data)] = data
+    return len(data)
+
+  def close(self):
+    if self.file and not self.file.closed:
+      self.file.close()
+
+  # Run metadata, as stored in the storage file's run list.
+  def describe(self):
+    return {'runId': self.runId, 'firstPage': self.firstPage, 'numTuples': self.numTuples, 'keys': self.keys}
+
+
+class LSMStorageFile(StorageFile):
+  """
+  A log-structured storage file, for relations with write-heavy workloads.
+
+  Inserts are buffered in an in-memory memtable kept sorted by a 'sortKey'
+  field (by default the first field). Once the memtable holds 'memtableSize'
+  tuples, it is written out sequentially as an immutable sorted run. When
+  the file has 'compactionThreshold' runs, a background thread merges them
+  into a single run, replacing them once the merge is complete.
+
+  The file itself only holds the file header, with runs kept in side files
+  listed in a run list. Run pages are read through the buffer pool like
+  other storage files. The page iterator returns the pages of each run,
+  followed by the memtable's tuples as transient pages, and skips pages
+  whose key range cannot satisfy range predicates on the sort key. The tuple
+  iterator returns all tuples in sort key order.
+
+  Tuples are addressed by key rather than location, so inserts do not return
+  tuple ids, and tuples cannot be deleted or updated by id. Buffered tuples
+  are durable once their memtable is written out, which happens at the
+  latest when the file is synced or closed. Since they have no tuple ids,
+  they are not recorded in the storage engine's write-ahead log.
+
+  LSM files are created by passing this class as the 'fileClass' when
+  creating a relation in the file manager.
+
+  >>> import shutil, Storage.BufferPool, Storage.FileManager
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('events', [('ts', 'int'), ('kind', 'char(8)')])
+  >>> bp = Storage.BufferPool.BufferPool(poolSize=1 << 20)
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='data/lsm')
+  >>> bp.setFileManager(fm)
+
+  >>> fm.createRelation('events', schema, fileClass=LSMStorageFile, memtableSize=500, compactionThreshold=3)
+  >>> (fId, f) = fm.relationFile('events')
+  >>> for i in range(1200):
+  ...   _ = f.insertTuple(schema.pack(schema.instantiate((i * 7919) % 1200, 'k' + str(i % 3))))
+  ...
+
+  # Two full memtables have been written out as runs.
+  >>> [run.numTuples for run in f.runs]
+  [500, 500]
+  >>> f.numTuples(), len(f.memtable)
+  (1200, 200)
+
+  >>> [schema.unpack(tup).ts for tup in f.tuples()] == list(range(1200))
+  True
+  >>> sum([len(list(page)) for (_, page) in f.pages()])
+  1200
+
+  # A third run triggers a compaction, merging all runs into one.
+  >>> for i in range(300):
+  ...   _ = f.insertTuple(schema.pack(schema.instantiate(2000 + i, 'late')))
+  ...
+  >>> f.waitForCompaction()
+  >>> [(run.numTuples, run.minKey(), run.maxKey()) for run in f.runs]
+  [(1500, 0, 2299)]
+
+  # Pages of the replaced runs are discarded from the buffer pool by the next scan.
+  >>> len(f.discarded) > 0
+  True
+
+  # Range predicates on the sort key skip pages.
+  >>> [schema.unpack(tup).ts for (_, page) in f.pages(ranges=[('ts', '>=', 2290)]) for tup in page][-3:]
+  [2297, 2298, 2299]
+  >>> len(list(f.pages(ranges=[('ts', '>=', 2290)]))) < len(list(f.pages()))
+  True
+  >>> f.discarded
+  []
+
+  # Bulk loads are written directly as sorted runs.
+  >>> _ = f.bulkLoad([schema.pack(schema.instantiate(5000 - i, 'bulk')) for i in range(100)])
+  >>> [run.numTuples for run in f.runs]
+  [1500, 100]
+
+  # Runs written concurrently, e.g., by a compaction and a memtable flush, use disjoint pages.
+  >>> flushed = []
+  >>> def merging(run):
+  ...   flushed.append(f.writeRun([schema.pack(schema.instantiate(6000 + i, 'flush')) for i in range(100)]))
+  ...   yield from f.runTuples(run)
+  ...
+  >>> merged = f.writeRun(merging(f.runs[0]), numTuples=f.runs[0].numTuples)
+  >>> [(r.firstPage, r.numPages()) for r in [merged] + flushed]
+  [(7, 3), (10, 1)]
+
+  # Runs survive closing and reopening the file manager.
+  >>> fm.close()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='data/lsm')
+  >>> bp.setFileManager(fm)
+  >>> (fId, f) = fm.relationFile('events')
+  >>> type(f).__name__, f.numTuples(), [run.numTuples for run in f.runs]
+  ('LSMStorageFile', 1600, [1500, 100])
+  >>> [schema.unpack(tup).ts for tup in f.tuples()][-2:]
+  [4999, 5000]
+
+  >>> fm.createRelation('eventsBad', schema, fileClass=LSMStorageFile, zoneMaps=True)
+  Traceback (most recent call last):
+  ...
+  ValueError: Unsupported storage options for an LSM storage file: zoneMaps
+
+  >>> fm.close()
+  >>> shutil.rmtree('data/lsm')
+  """
+
+  fileOptions = ["sortKey", "memtableSize", "compactionThreshold"]
+
+  defaultMemtablePages      = 4
+  defaultCompactionThreshold = 4
+
+  def __init__(self, **kwargs):
+    unsupported = [k for k in StorageFile.fileOptions if kwargs.get(k, None)]
+    if unsupported:
+      raise ValueError("Unsupported storage options for an LSM storage file: " + ', '.join(unsupported))
+
+    super().__init__(**kwargs)
+    if kwargs.get("other", None) is None:
+      options = self.header.options
+      self.sortKey = options.get("sortKey", self.schema().fields[0])
+      if self.sortKey not in self.schema().fields:
+        raise ValueError("Invalid sort key for LSM storage file")
+
+      page = self.pageClass()(pageId=self.pageId(0), buffer=bytes(self.pageSize()), schema=self.schema())
+      self.tuplesPerPage       = page.header.numFreeTuples()
+      self.sortPos             = self.schema().fields.index(self.sortKey)
+      self.memtableSize        = options.get("memtableSize", LSMStorageFile.defaultMemtablePages * self.tuplesPerPage)
+      self.compactionThreshold = options.get("compactionThreshold", LSMStorageFile.defaultCompactionThreshold)
+
+      # The memtable is a sorted list of (key, sequence number, tuple) entries,
+      # where sequence numbers keep tuples with equal keys in insertion order.
+      self.memtable   = []
+      self.sequence   = 0
+      self.lock       = threading.RLock()
+      self.compactor  = None
+      self.discarded  = []
+      self.nextRun    = 0
+      self.nextPage   = 0
+      self.runs       = []
+
+      # All runs that may still be read, including runs replaced by a compaction
+      # while a scan over them is in progress.
+      self.openRuns   = weakref.WeakValueDictionary()
+      self.loadRuns()
+
+  def fromOther(self, other):
+    super().fromOther(other)
+    for attr in ["sortKey", "tuplesPerPage", "sortPos", "memtableSize", "compactionThreshold", "memtable", \
+                 "sequence", "lock", "compactor", "discarded", "nextRun", "nextPage", "runs", "openRuns"]:
+      setattr(self, attr, getattr(other, attr))
+
+  # LSM files do not track free pages.
+  def initializeFreePages(self):
+    pass
+
+  # File control
+
+  # Writes out the memtable, making all tuples durable.
+  def flush(self):
+    with self.lock:
+      if self.memtable:
+        self.flushMemtable()
+    super().flush()
+
+  def sync(self):
+    self.flush()
+    os.fsync(self.file.fileno())
+
+  def close(self):
+    if not self.file.closed:
+      self.flush()
+      self.waitForCompaction()
+      self.discardReplacedPages()
+      super().close()
+      for run in self.runs:
+        run.close()
+
+  def paths(self):
+    runPaths = [self.runPath(run.runId) for run in self.runs] + [self.runListPath()]
+    return super().paths() + [p for p in runPaths if os.path.exists(p)]
+
+  def runPath(self, runId):
+    return self.path + '.run' + str(runId)
+
+  def runListPath(self):
+    return self.path + '.runs'
+
+  # Loads the run list, removing any run files left behind by an interrupted flush or compaction.
+  def loadRuns(self):
+    if os.path.exists(self.runListPath()):
+      with open(self.runListPath(), 'r') as f:
+        runList = json.load(f)
+      self.nextRun  = runList['nextRun']
+      self.nextPage = runList['nextPage']
+      self.runs     = [self.openRun(SortedRun(path=self.runPath(r['runId']), **r)) for r in runList['runs']]
+
+    live = set([self.runPath(run.runId) for run in self.runs])
+    (directory, prefix) = os.path.split(self.path + '.run')
+    for name in os.listdir(directory or '.'):
+      path = os.path.join(directory, name)
+      if name.startswith(prefix) and name[len(prefix):].isdigit() and path not in live:
+        os.remove(path)
+
+  # Atomically replaces the run list on disk.
+  def saveRuns(self):
+    runList = {'nextRun': self.nextRun, 'nextPage': self.nextPage, 'runs': [run.describe() for run in self.runs]}
+    tmpPath = self.runListPath() + '.tmp'
+    with open(tmpPath, 'w') as f:
+      json.dump(runList, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmpPath, self.runListPath())
+
+  def openRun(self, run):
+    self.openRuns[run.firstPage] = run
+    return run
+
+
+  # Storage file helpers
+  def numPages(self):
+    return sum([run.numPages() for run in self.runs])
+
+  # LSM files do not return tuple ids.
+  def stableTupleIds(self):
+    return False
+
+  def validPageId(self, pageId):
+    return pageId.fileId == self.fileId and self.findRun(pageId.pageIndex) is not None
+
+  def findRun(self, pageIndex):
+    for run in list(self.openRuns.values()):
+      if run.containsPage(pageIndex):
+        return run
+
+  def sortValue(self, tupleData):
+    return self.schema().unpack(tupleData, decode=False)[self.sortPos]
+
+
+  # Page operations
+  def readPage(self, pageId, bufferForPage):
+    run = self.findRun(pageId.pageIndex) if pageId.fileId == self.fileId else None
+    if run and self.validBuffer(bufferForPage):
+      if run.readPage(pageId.pageIndex, self.pageSize(), bufferForPage) == self.pageSize():
+        return self.pageClass().unpack(pageId, bufferForPage)
+      else:
+        raise ValueError("Read a partial page")
+    else:
+      raise ValueError("Invalid page id or page buffer")
+
+  def writePage(self, page):
+    raise ValueError("Pages of an LSM storage file are immutable")
+
+  # Writes a sorted sequence of tuples as a new run, returning the run.
+  # The run's pages are reserved before writing, so that runs written
+  # concurrently (e.g., by a compaction and a memtable flush) never share
+  # page indexes. Sequences without a length must give their 'numTuples'.
+  def writeRun(self, tuples, numTuples=None):
+    numPages = -(-(len(tuples) if numTuples is None else numTuples) // self.tuplesPerPage)
+    with self.lock:
+      (runId, firstPage) = (self.nextRun, self.nextPage)
+      self.nextRun  += 1
+      self.nextPage += numPages
+
+    keys = []
+    numTuples = 0
+    with open(self.runPath(runId), 'wb') as f:
+      page = None
+      for tupleData in tuples:
+        if page is None or not page.header.hasFreeTuple():
+          if page is not None:
+            f.write(self.packRunPage(page))
+          page = self.pageClass()(pageId=self.pageId(firstPage + len(keys)), \
+                                  buffer=bytes(self.pageSize()), schema=self.schema())
+          keys.append([self.sortValue(tupleData)] * 2)
+        page.insertTuple(tupleData)
+        keys[-1][1] = self.sortValue(tupleData)
+        numTuples += 1
+      if page is not None:
+        f.write(self.packRunPage(page))
+      f.flush()
+      os.fsync(f.fileno())
+
+    if len(keys) > numPages:
+      raise ValueError("Run exceeds its reserved pages")
+    return self.openRun(SortedRun(runId=runId, path=self.runPath(runId), firstPage=firstPage, \
+                                  numTuples=numTuples, keys=keys))
+
+  # Run pages are written clean, since they are never written back.
+  def packRunPage(self, page):
+    page.setDirty(False)
+    return page.pack()
+
+  # Writes the memtable out as a run, and schedules a compaction if needed.
+  def flushMemtable(self):
+    (entries, self.memtable) = (self.memtable, [])
+    run = self.writeRun([tupleData for (_, _, tupleData) in entries])
+    self.runs.append(run)
+    self.saveRuns()
+    self.refreshFileHeader()
+    if len(self.runs) >= self.compactionThreshold:
+      self.startCompaction()
+
+
+  # Compaction
+
+  def startCompaction(self):
+    with self.lock:
+      if self.compactor is None or not self.compactor.is_alive():
+        self.compactor = threading.Thread(target=self.compact, daemon=True)
+        self.compactor.start()
+
+  def waitForCompaction(self):
+    compactor = self.compactor
+    if compactor is not None:
+      compactor.join()
+
+  # Merges the current runs into a single run. Runs written during the
+  # merge are kept after the merged run, preserving insertion order.
+  # Compactions run in the background, so the pages of replaced runs are
+  # queued for the foreground to discard from the buffer pool. Page indexes
+  # are never reused, so pages discarded later are never read again.
+  def compact(self):
+    with self.lock:
+      merging = list(self.runs)
+    if len(merging) < 2:
+      return
+
+    merged = self.writeRun(heapq.merge(*[self.runTuples(run) for run in merging], key=self.sortValue), \
+                           numTuples=sum([run.numTuples for run in merging]))
+    with self.lock:
+      self.runs = [merged] + self.runs[len(merging):]
+      self.saveRuns()
+
+    # Replaced runs are unlinked, but remain readable by scans still holding them.
+    for run in merging:
+      with self.lock:
+        self.discarded.extend([self.pageId(i) for i in range(run.firstPage, run.firstPage + run.numPages())])
+      os.remove(self.runPath(run.runId))
+
+  # Discards the pages of runs replaced by compactions from the buffer pool.
+  # Called from foreground file operations, which need not hold the storage
+  # engine's latch (e.g., scans), so the queue is claimed under the file's lock.
+  def discardReplacedPages(self):
+    with self.lock:
+      (discarded, self.discarded) = (self.discarded, [])
+    for pageId in discarded:
+      self.bufferPool.discardPage(pageId)
+
+  # Reads the tuples of a run directly from its file, bypassing the buffer pool.
+  def runTuples(self, run):
+    buffer = bytearray(self.pageSize())
+    for pageIndex in range(run.firstPage, run.firstPage + run.numPages()):
+      run.readPage(pageIndex, self.pageSize(), buffer)
+      for tupleData in self.pageClass().unpack(self.pageId(pageIndex), buffer):
+        yield bytes(tupleData)
+
+  # Compaction is the LSM counterpart of vacuuming.
+  def vacuumStep(self, beforeTruncate=None):
+    self.waitForCompaction()
+    self.compact()
+    self.discardReplacedPages()
+    return ([], False)
+
+
+  # Tuple operations
+
+  # Inserts a tuple into the memtable. LSM files do not return tuple ids.
+  def insertTuple(self, tupleData):
+    self.discardReplacedPages()
+    with self.lock:
+      self.header.insertTuple()
+      bisect.insort(self.memtable, (self.sortValue(tupleData), self.sequence, bytes(tupleData)))
+      self.sequence += 1
+      if len(self.memtable) >= self.memtableSize:
+        self.flushMemtable()
+
+  # Writes a batch of tuples directly as a sorted run.
+  def bulkLoad(self, tuples):
+    self.discardReplacedPages()
+    tuples = sorted([bytes(t) for t in tuples], key=self.sortValue)
+    if tuples:
+      with self.lock:
+        run = self.writeRun(tuples)
+        self.runs.append(run)
+        self.header.numTuples += len(tuples)
+        self.saveRuns()
+        self.refreshFileHeader()
+        if len(self.runs) >= self.compactionThreshold:
+          self.startCompaction()
+    return [None] * len(tuples)
+
+  def deleteTuple(self, tupleId):
+    raise ValueError("LSM storage files do not support deleting tuples by id")
+
+  def updateTuple(self, tupleId, tupleData):
+    raise ValueError("LSM storage files do not support updating tuples by id")
+
+
+  # Iterators
+
+  # Page iterator, over the pages of a snapshot of the runs, followed by the
+  # memtable as transient pages.
+  def pages(self, pinned=False, ranges=None, keys=None):
+    self.discardReplacedPages()
+    return self.LSMPageIterator(self, pinned, [r for r in (ranges or []) if r[0] == self.sortKey])
+
+  # Returns the memtable's tuples packed into pages, numbered after all run pages.
+  def memtablePages(self):
+    with self.lock:
+      tuples    = [tupleData for (_, _, tupleData) in self.memtable]
+      firstPage = self.nextPage
+
+    pages = []
+    for start in range(0, len(tuples), self.tuplesPerPage):
+      page = self.pageClass()(pageId=self.pageId(firstPage + len(pages)), \
+                              buffer=bytes(self.pageSize()), schema=self.schema())
+      for tupleData in tuples[start:start + self.tuplesPerPage]:
+        page.insertTuple(tupleData)
+      pages.append(page)
+    return pages
+
+  # Tuple iterator, returning tuples in sort key order.
+  def tuples(self, pinned=False):
+    with self.lock:
+      runs     = list(self.runs)
+      memtable = [tupleData for (_, _, tupleData) in self.memtable]
+    return heapq.merge(*([self.runTuples(run) for run in runs] + [iter(memtable)]), key=self.sortValue)
+
+  def directPages(self):
+    return self.pages()
+
+  class LSMPageIterator:
+    def __init__(self, storageFile, pinned=False, ranges=None):
+      self.storageFile = storageFile
+      self.pinned      = pinned
+      self.ranges      = ranges
+      with storageFile.lock:
+        self.runs      = list(storageFile.runs)
+      self.pageIds     = iter([pId for run in self.runs for pId in self.runPages(run)])
+      self.memtable    = None
+
+    def runPages(self, run):
+      return [self.storageFile.pageId(i) for i in range(run.firstPage, run.firstPage + run.numPages()) \
+                if not self.ranges or run.mayMatch(i, self.ranges, self.storageFile.sortKey)]
+
+    def __iter__(self):
+      return self
+
+    def __next__(self):
+      pId = next(self.pageIds, None)
+      if pId is not None:
+        return (pId, self.storageFile.bufferPool.getPage(pId, self.pinned))
+
+      if self.memtable is None:
+        self.memtable = iter(self.storageFile.memtablePages())
+      page = next(self.memtable)
+      return (page.pageId, page)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
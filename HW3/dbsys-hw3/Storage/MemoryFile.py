@@ -0,0 +1,413 @@
+import heapq, io, math, os, os.path
+from struct import Struct
+
+from Catalog.Identifiers import TupleId
+from Storage.File        import StorageFile
+from Storage.SlottedPage import SlottedPage
+
+class MemoryPage:
+  """
+  A transient, read-only page of a memory storage file, holding the packed
+  tuples of a range of the file's slots. Memory pages are never placed in
+  the buffer pool, and iterate their tuples without any page decoding.
+  """
+
+  def __init__(self, storageFile, pageId, tuples):
+    self.storageFile = storageFile
+    self.pageId      = pageId
+    self.header      = None
+    self.tuples      = tuples
+
+  def __iter__(self):
+    return iter(self.tuples)
+
+  def isDirty(self):
+    return False
+
+  def getTuple(self, tupleId):
+    return self.storageFile.getTuple(tupleId)
+
+
+class MemoryStorageFile(StorageFile):
+  """
+  A memory-resident storage file, for small and frequently accessed relations
+  such as dimension tables.
+
+  Tuples are kept in a compact array of fixed-size slots, with a live flag per
+  slot, rather than in pages read through the buffer pool. Tuple ids address
+  slots as virtual pages of the same capacity as the file's page size allows.
+  Deleted slots are reused by later inserts, lowest first, and vacuuming moves
+  tuples out of the last virtual page to truncate the array.
+
+  The file keeps an in-memory hash index on its 'indexKey' field (by default
+  the first field). Scans with equality predicates or candidate key values on
+  the index key only return the matching tuples, without scanning the array.
+
+  The on-disk file only holds the file header. The slot array is snapshotted
+  to a side file whenever the file is flushed, e.g., on checkpoints, and loaded
+  when the file is reopened, unless the file is created as 'volatile'.
+
+  >>> import shutil, Storage.BufferPool, Storage.FileManager
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('nation', [('nationkey', 'int'), ('regionkey', 'int')])
+  >>> bp = Storage.BufferPool.BufferPool()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='data/memory')
+  >>> bp.setFileManager(fm)
+
+  >>> fm.createRelation('nation', schema, storage='memory')
+  >>> (fId, f) = fm.relationFile('nation')
+  >>> tupleIds = [fm.insertTuple('nation', schema.pack(schema.instantiate(i, i % 5))) for i in range(25)]
+  >>> type(f).__name__, f.numTuples(), f.numPages(), bp.numFreePages() == bp.numPages()
+  ('MemoryStorageFile', 25, 1, True)
+
+  # Lookups on the index key only return matching tuples.
+  >>> [schema.unpack(tup) for (_, page) in fm.pages('nation', ranges=[('nationkey', '==', 7)]) for tup in page]
+  [nation(nationkey=7, regionkey=2)]
+  >>> [schema.unpack(tup).nationkey for (_, page) in fm.pages('nation', keys={'nationkey': [3, 30, 4]}) for tup in page]
+  [3, 4]
+  >>> [schema.unpack(tup).nationkey for tup in f.lookup(12)]
+  [12]
+
+  # Deleted slots are reused, and updates maintain the index.
+  >>> schema.unpack(fm.deleteTuple('nation', tupleIds[3])).nationkey
+  3
+  >>> fm.insertTuple('nation', schema.pack(schema.instantiate(100, 0))) == tupleIds[3]
+  True
+  >>> _ = fm.updateTuple('nation', tupleIds[12], schema.pack(schema.instantiate(112, 2)))
+  >>> f.lookup(12), [schema.unpack(tup).regionkey for tup in f.lookup(112)]
+  ([], [2])
+
+  # Snapshots restore the relation's tuples, while volatile relations start empty.
+  >>> fm.createRelation('scratch', schema, storage='memory', volatile=True)
+  >>> _ = fm.bulkLoad('scratch', [schema.pack(schema.instantiate(i, 0)) for i in range(10)])
+  >>> fm.close()
+  >>> fm = Storage.FileManager.FileManager(bufferPool=bp, dataDir='data/memory')
+  >>> bp.setFileManager(fm)
+  >>> (fId, f) = fm.relationFile('nation')
+  >>> f.numTuples(), sorted([schema.unpack(tup).nationkey for tup in fm.tuples('nation')])[-3:]
+  (25, [24, 100, 112])
+  >>> fm.relationFile('scratch')[1].numTuples(), len(list(fm.tuples('scratch')))
+  (0, 0)
+
+  # Vacuuming moves tuples out of the last virtual page.
+  >>> _ = fm.bulkLoad('nation', [schema.pack(schema.instantiate(1000 + i, 0)) for i in range(f.tuplesPerPage - 10)])
+  >>> for tupleId in tupleIds[:20]:
+  ...   _ = fm.deleteTuple('nation', tupleId)
+  ...
+  >>> f.numPages()
+  2
+  >>> fm.vacuum('nation')
+  True
+  >>> f.numPages(), f.numTuples() == f.tuplesPerPage - 5, len(f.lookup(1000 + f.tuplesPerPage - 11))
+  (1, True, 1)
+
+  >>> fm.createRelation('nationBad', schema, storage='memory', zoneMaps=True)
+  Traceback (most recent call last):
+  ...
+  ValueError: Unsupported storage options for a memory storage file: zoneMaps
+
+  >>> fm.close()
+  >>> shutil.rmtree('data/memory')
+  """
+
+  fileOptions  = ["indexKey", "volatile"]
+  snapshotRepr = Struct("=I")
+
+  def __init__(self, **kwargs):
+    unsupported = [k for k in StorageFile.fileOptions if kwargs.get(k, None)]
+    if unsupported:
+      raise ValueError("Unsupported storage options for a memory storage file: " + ', '.join(unsupported))
+
+    # Memory files log deletions per slot, as for slotted pages.
+    kwargs["pageClass"] = SlottedPage
+    super().__init__(**kwargs)
+    if kwargs.get("other", None) is None:
+      options = self.header.options
+      self.indexKey = options.get("indexKey", self.schema().fields[0])
+      if self.indexKey not in self.schema().fields:
+        raise ValueError("Invalid index key for memory storage file")
+
+      self.volatile      = options.get("volatile", False)
+      self.indexPos      = self.schema().fields.index(self.indexKey)
+      self.tupleSize     = self.schema().size
+      self.tuplesPerPage = max(1, self.pageSize() // self.tupleSize)
+
+      # The slot array, as the packed tuples of all slots, and a live flag per slot.
+      self.data      = bytearray()
+      self.live      = bytearray()
+      self.freeSlots = []
+      self.index     = {}
+      self.modified  = False
+
+      if kwargs.get("mode", "").lower() == "update" and not self.volatile:
+        self.loadSnapshot()
+      self.refreshMetadata()
+
+  def fromOther(self, other):
+    super().fromOther(other)
+    for attr in ["indexKey", "volatile", "indexPos", "tupleSize", "tuplesPerPage", \
+                 "data", "live", "freeSlots", "index", "modified"]:
+      setattr(self, attr, getattr(other, attr))
+
+  # Memory files do not track free pages.
+  def initializeFreePages(self):
+    pass
+
+  # File control
+
+  def flush(self):
+    super().flush()
+    if self.modified and not self.volatile:
+      self.saveSnapshot()
+
+  def close(self):
+    if not self.file.closed:
+      self.flush()
+      super().close()
+
+  def paths(self):
+    return super().paths() + [p for p in [self.snapshotPath()] if os.path.exists(p)]
+
+  def snapshotPath(self):
+    return self.path + '.snapshot'
+
+  # Atomically replaces the snapshot with the current slot array.
+  def saveSnapshot(self):
+    tmpPath = self.snapshotPath() + '.tmp'
+    with open(tmpPath, 'wb') as f:
+      f.write(MemoryStorageFile.snapshotRepr.pack(self.numSlots()))
+      f.write(self.live)
+      f.write(self.data)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmpPath, self.snapshotPath())
+    self.modified = False
+
+  def loadSnapshot(self):
+    if os.path.exists(self.snapshotPath()):
+      with open(self.snapshotPath(), 'rb') as f:
+        buffer = f.read()
+      numSlots  = MemoryStorageFile.snapshotRepr.unpack_from(buffer)[0]
+      start     = MemoryStorageFile.snapshotRepr.size
+      self.live = bytearray(buffer[start:start+numSlots])
+      self.data = bytearray(buffer[start+numSlots:start+numSlots+numSlots*self.tupleSize])
+
+  # Rebuilds the free slots, index and tuple count from the slot array.
+  def refreshMetadata(self):
+    self.freeSlots = [slot for slot in range(self.numSlots()) if not self.live[slot]]
+    heapq.heapify(self.freeSlots)
+    self.index = {}
+    for slot in range(self.numSlots()):
+      if self.live[slot]:
+        self.indexSlot(slot)
+    self.header.numTuples = self.numSlots() - len(self.freeSlots)
+    self.refreshFileHeader()
+
+
+  # Storage file helpers
+  def numSlots(self):
+    return len(self.live)
+
+  def numPages(self):
+    return math.ceil(self.numSlots() / self.tuplesPerPage)
+
+  # Memory pages do not expose their slots.
+  def stableTupleIds(self):
+    return False
+
+  def slotId(self, slot):
+    return TupleId(self.pageId(slot // self.tuplesPerPage), slot % self.tuplesPerPage)
+
+  # Returns the slot of a live tuple id.
+  def slotOf(self, tupleId):
+    if tupleId and tupleId.pageId.fileId == self.fileId:
+      slot = tupleId.pageId.pageIndex * self.tuplesPerPage + tupleId.tupleIndex
+      if slot < self.numSlots() and self.live[slot]:
+        return slot
+    raise ValueError("Invalid tuple id for memory storage file")
+
+  def slotData(self, slot):
+    return bytes(self.data[slot*self.tupleSize:(slot+1)*self.tupleSize])
+
+  def indexValue(self, tupleData):
+    return self.schema().unpack(tupleData)[self.indexPos]
+
+  def indexSlot(self, slot):
+    self.index.setdefault(self.indexValue(self.slotData(slot)), set()).add(slot)
+
+  def unindexSlot(self, slot):
+    value = self.indexValue(self.slotData(slot))
+    slots = self.index.get(value, set())
+    slots.discard(slot)
+    if not slots:
+      self.index.pop(value, None)
+
+  # Fills a slot, extending the slot array as needed.
+  def putSlot(self, slot, tupleData):
+    if len(tupleData) != self.tupleSize:
+      raise ValueError("Invalid tuple size for memory storage file")
+
+    while self.numSlots() <= slot:
+      if self.numSlots() < slot:
+        heapq.heappush(self.freeSlots, self.numSlots())
+      self.live.append(0)
+      self.data.extend(bytes(self.tupleSize))
+
+    if self.live[slot]:
+      self.unindexSlot(slot)
+    else:
+      self.header.insertTuple()
+    self.data[slot*self.tupleSize:(slot+1)*self.tupleSize] = tupleData
+    self.live[slot] = 1
+    self.indexSlot(slot)
+    self.modified = True
+
+  def clearSlot(self, slot):
+    tupleData = self.slotData(slot)
+    self.unindexSlot(slot)
+    self.live[slot] = 0
+    heapq.heappush(self.freeSlots, slot)
+    self.header.deleteTuple()
+    self.modified = True
+    return tupleData
+
+  # Drops free slots at the end of the slot array.
+  def truncateSlots(self):
+    numSlots = self.numSlots()
+    while numSlots > 0 and not self.live[numSlots-1]:
+      numSlots -= 1
+    if numSlots < self.numSlots():
+      del self.live[numSlots:]
+      del self.data[numSlots*self.tupleSize:]
+      self.freeSlots = [slot for slot in self.freeSlots if slot < numSlots]
+      heapq.heapify(self.freeSlots)
+      self.modified = True
+
+
+  # Page operations
+  # Memory files have no stored pages.
+  def readPage(self, pageId, bufferForPage):
+    raise ValueError("Memory storage files have no pages to read")
+
+  def writePage(self, page):
+    raise ValueError("Memory storage files have no pages to write")
+
+
+  # Tuple operations
+
+  def insertTuple(self, tupleData):
+    slot = heapq.heappop(self.freeSlots) if self.freeSlots else self.numSlots()
+    self.putSlot(slot, bytes(tupleData))
+    return self.slotId(slot)
+
+  def bulkLoad(self, tuples):
+    return [self.insertTuple(tupleData) for tupleData in tuples]
+
+  def getTuple(self, tupleId):
+    return self.slotData(self.slotOf(tupleId))
+
+  def deleteTuple(self, tupleId):
+    return self.clearSlot(self.slotOf(tupleId))
+
+  def updateTuple(self, tupleId, tupleData):
+    slot    = self.slotOf(tupleId)
+    oldData = self.slotData(slot)
+    self.putSlot(slot, bytes(tupleData))
+    return oldData
+
+  # Returns the tuples whose index key equals the given value.
+  def lookup(self, value):
+    return [self.slotData(slot) for slot in sorted(self.index.get(value, []))]
+
+  # Moves the tuples of the last virtual page into free slots before it,
+  # and truncates the slot array, after calling 'beforeTruncate' with the moves.
+  def vacuumStep(self, beforeTruncate=None):
+    self.truncateSlots()
+    lastPage = max(0, self.numPages() - 1) * self.tuplesPerPage
+    moves    = []
+    for slot in range(self.numSlots() - 1, lastPage - 1, -1):
+      if self.live[slot] and self.freeSlots and self.freeSlots[0] < lastPage:
+        target    = heapq.heappop(self.freeSlots)
+        tupleData = self.clearSlot(slot)
+        self.putSlot(target, tupleData)
+        moves.append((self.slotId(slot), self.slotId(target), tupleData))
+    if beforeTruncate:
+      beforeTruncate(moves)
+    self.truncateSlots()
+    return (moves, bool(moves))
+
+
+  # Recovery
+  # Volatile files are not recovered, since their contents are lost on restart.
+  # Free slots and the index are rebuilt once replay completes (see refreshMetadata).
+
+  def redoSlot(self, pageIndex, tupleIndex, tupleData):
+    if not self.volatile:
+      self.putSlot(pageIndex * self.tuplesPerPage + tupleIndex, tupleData)
+
+  def redoDelete(self, pageIndex, tupleIndex):
+    slot = pageIndex * self.tuplesPerPage + tupleIndex
+    if not self.volatile and slot < self.numSlots() and self.live[slot]:
+      self.clearSlot(slot)
+
+  def redoPage(self, pageIndex, pageData):
+    pass
+
+
+  # Iterators
+
+  # Page iterator over virtual pages of live tuples. Equality predicates and
+  # candidate values on the index key restrict the scan to matching tuples.
+  def pages(self, pinned=False, ranges=None, keys=None):
+    return self.MemoryPageIterator(self, self.indexSlots(ranges or [], keys))
+
+  # Returns the sorted slots matching index key predicates, or None for a full scan.
+  def indexSlots(self, ranges, keys):
+    candidates = [[value] for (field, op, value) in ranges if field == self.indexKey and op == '==']
+    if keys and self.indexKey in keys:
+      candidates.append(keys[self.indexKey])
+    if not candidates:
+      return None
+
+    slots = None
+    for values in candidates:
+      matches = set([slot for value in values for slot in self.index.get(value, [])])
+      slots   = matches if slots is None else slots & matches
+    return sorted(slots)
+
+  def tuples(self, pinned=False):
+    return (self.slotData(slot) for slot in range(self.numSlots()) if self.live[slot])
+
+  def directPages(self):
+    return self.pages()
+
+  class MemoryPageIterator:
+    def __init__(self, storageFile, slots=None):
+      self.storageFile    = storageFile
+      self.slots          = slots
+      self.currentPageIdx = 0
+
+    def __iter__(self):
+      return self
+
+    # Returns the next non-empty virtual page, holding either the page's live
+    # tuples or only its slots among the index matches.
+    def __next__(self):
+      f = self.storageFile
+      while self.currentPageIdx < f.numPages():
+        pageIndex = self.currentPageIdx
+        self.currentPageIdx += 1
+        start = pageIndex * f.tuplesPerPage
+        end   = min(start + f.tuplesPerPage, f.numSlots())
+        if self.slots is None:
+          slots = [slot for slot in range(start, end) if f.live[slot]]
+        else:
+          slots = [slot for slot in self.slots if start <= slot < end]
+        if slots:
+          pId = f.pageId(pageIndex)
+          return (pId, MemoryPage(f, pId, [f.slotData(slot) for slot in slots]))
+      raise StopIteration
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -2,6 +2,7 @@ from io import BytesIO
 import copy, math, struct
 
 from Catalog.Identifiers import TupleId
+from Catalog.Schema      import Types
 
 class PageHeader:
   """
@@ -181,6 +182,15 @@ class PageHeader:
   def numTuples(self):
     return int(self.usedSpace() / self.tupleSize)
 
+  # Returns the number of additional tuples that fit in the page.
+  def numFreeTuples(self):
+    return self.freeSpace() // self.tupleSize
+
+  # Returns the tuple indexes of all tuples in the page, which are
+  # contiguous for this page layout.
+  def usedSlots(self):
+    return list(range(self.numTuples()))
+
   # Tuple index for a given offset
   def tupleIndex(self, offset):
     return math.floor((offset - self.dataOffset()) / self.tupleSize)
@@ -407,6 +417,16 @@ class Page(BytesIO):
   >>> p.header.usedSpace() == (sizeBeforeRemove - p.header.tupleSize)
   True
 
+  # Tuples may be packed directly into the page, and unpacked in one pass.
+  >>> tId = p.insertInstance(schema, schema.instantiate(11, 40))
+  >>> p.unpackTuples(schema)[-2:]
+  [employee(id=9, age=38), employee(id=11, age=40)]
+  >>> _ = p.deleteTuple(tId)
+
+  # Pages may be viewed as NumPy structured arrays of their tuples.
+  >>> p.asArray(schema)['age'].tolist()
+  [20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
   """
 
   headerClass = PageHeader
@@ -449,6 +469,23 @@ class Page(BytesIO):
   def __iter__(self):
     return PageTupleIterator(self)
 
+  # Returns a read-only NumPy structured array of the given schema over the
+  # first 'numTuples' tuple positions of the page's data region, without copying.
+  # The view is only valid while the page remains in memory.
+  def arrayView(self, schema, numTuples):
+    if schema.size != self.header.tupleSize:
+      raise ValueError("Schema does not match the tuple size of the page")
+    numpy = Types.numpy()
+    view  = numpy.frombuffer(self.getbuffer(), dtype=schema.numpyDtype(), \
+                             count=numTuples, offset=self.header.dataOffset())
+    view.flags.writeable = False
+    return view
+
+  # Returns the page's tuples as a NumPy structured array of the given schema.
+  # Tuples are contiguous in this page layout, so this is a zero-copy view.
+  def asArray(self, schema):
+    return self.arrayView(schema, self.header.numTuples())
+
   # Dirty bit accessors
   def isDirty(self):
     return self.header.isDirty()
@@ -478,6 +515,23 @@ class Page(BytesIO):
         self.getbuffer()[start:end] = tupleData
         return TupleId(self.pageId, tupleIndex)
 
+  # Packs an instance of the given schema directly into a new tuple in the page.
+  def insertInstance(self, schema, instance):
+    if self.header and schema.size == self.header.tupleSize:
+      (tupleIndex, start, end) = self.header.nextTupleRange()
+      if start and end:
+        self.setDirty(True)
+        schema.packInto(self.getbuffer(), start, instance)
+        return TupleId(self.pageId, tupleIndex)
+
+  # Returns a list of the page's tuples unpacked as instances of the given schema.
+  # Tuples are contiguous in this page layout, and are unpacked in a single pass.
+  def unpackTuples(self, schema):
+    start = self.header.dataOffset()
+    end   = start + self.header.numTuples() * schema.size
+    with self.getbuffer() as buffer:
+      return schema.unpackMany(buffer[start:end])
+
   def clearTuple(self, tupleId):
     if self.header and tupleId:
       (start, end) = self.header.tupleRange(tupleId)
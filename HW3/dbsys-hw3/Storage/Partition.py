@@ -0,0 +1,127 @@
+import bisect, zlib
+
+from Storage.BloomFilter import BloomFilter
+
+class PartitionScheme:
+  """
+  A partitioning scheme for a relation, assigning each tuple to one of the
+  relation's partitions by the value of a partition key field.
+
+  Schemes are declared as a (kind, key, parameter) specification:
+  i.  ('range', key, bounds), with a sorted list of bounds. Partition i holds
+      the keys between bounds i-1 (inclusive) and i (exclusive), giving
+      len(bounds)+1 partitions.
+  ii. ('hash', key, numPartitions), hashing keys to a fixed number of partitions.
+
+  Partitions may be pruned with (field, operator, constant) range predicates,
+  and with sets of candidate key values.
+
+  >>> byDate = PartitionScheme.fromSpec(('range', 'shipdate', [19940101, 19950101]))
+  >>> byDate.numPartitions(), [byDate.partitionOf(d) for d in [19931231, 19940101, 19960101]]
+  (3, [0, 1, 2])
+
+  >>> byDate.prune([('shipdate', '>=', 19940601)])
+  [1, 2]
+  >>> byDate.prune([('shipdate', '<', 19940101), ('orderkey', '==', 1)])
+  [0]
+  >>> byDate.prune([('shipdate', '==', 19950101)])
+  [2]
+
+  >>> byKey = PartitionScheme.fromSpec(['hash', 'orderkey', 4])
+  >>> [byKey.partitionOf(k) for k in range(6)]
+  [0, 1, 2, 3, 0, 1]
+  >>> byKey.prune([('orderkey', '==', 6)]), byKey.prune([], {'orderkey': [1, 5, 7]})
+  ([2], [1, 3])
+  >>> byKey.prune([('orderkey', '>', 6)])
+  [0, 1, 2, 3]
+
+  >>> byKey.compatible(PartitionScheme.fromSpec(('hash', 'custkey', 4)))
+  True
+  >>> byKey.spec()
+  ['hash', 'orderkey', 4]
+
+  >>> PartitionScheme.fromSpec(('list', 'orderkey', 4))
+  Traceback (most recent call last):
+  ...
+  ValueError: Invalid partitioning scheme: ('list', 'orderkey', 4)
+  """
+
+  kinds = ['range', 'hash']
+
+  def __init__(self, kind, key, **kwargs):
+    self.kind   = kind
+    self.key    = key
+    self.bounds = sorted(kwargs.get("bounds", []))
+    self.count  = kwargs.get("numPartitions", len(self.bounds) + 1)
+
+  @classmethod
+  def fromSpec(cls, spec):
+    if len(spec) == 3 and spec[0] == 'range' and list(spec[2]):
+      return cls('range', spec[1], bounds=list(spec[2]))
+    elif len(spec) == 3 and spec[0] == 'hash' and int(spec[2]) > 0:
+      return cls('hash', spec[1], numPartitions=int(spec[2]))
+    raise ValueError("Invalid partitioning scheme: " + str(spec))
+
+  def spec(self):
+    return [self.kind, self.key, self.bounds if self.kind == 'range' else self.count]
+
+  def numPartitions(self):
+    return self.count
+
+  # Returns the name of a partition's underlying relation.
+  @classmethod
+  def partitionRelationId(cls, relId, partition):
+    return relId + '#' + str(partition)
+
+  # Returns whether two relations partitioned with these schemes place equal
+  # keys in partitions with the same index.
+  def compatible(self, other):
+    return other is not None and self.kind == other.kind \
+             and self.count == other.count and self.bounds == other.bounds
+
+  @classmethod
+  def hashValue(cls, value):
+    if isinstance(value, float) and value.is_integer():
+      value = int(value)
+    return value if isinstance(value, int) else zlib.crc32(BloomFilter.keyBytes(value))
+
+  def partitionOf(self, value):
+    if self.kind == 'range':
+      return bisect.bisect_right(self.bounds, value)
+    return PartitionScheme.hashValue(value) % self.count
+
+  # Returns whether a range partition may hold keys satisfying a predicate.
+  def rangeTest(self, partition, op, value):
+    lo = self.bounds[partition-1] if partition > 0 else None
+    hi = self.bounds[partition] if partition < len(self.bounds) else None
+    tests = {
+        '<'  : lambda: lo is None or lo < value,
+        '<=' : lambda: lo is None or lo <= value,
+        '>'  : lambda: hi is None or hi > value,
+        '>=' : lambda: hi is None or hi > value,
+        '==' : lambda: (lo is None or lo <= value) and (hi is None or value < hi),
+        '!=' : lambda: True
+      }
+    return tests[op]()
+
+  # Returns the partitions that may hold tuples satisfying all given range
+  # predicates, and whose key is among any given candidate key values.
+  def prune(self, ranges, keyValues=None):
+    keyRanges  = [(op, value) for (field, op, value) in ranges if field == self.key]
+    candidates = set(range(self.count))
+
+    if self.kind == 'range':
+      candidates = set([p for p in candidates if all(self.rangeTest(p, op, v) for (op, v) in keyRanges)])
+    else:
+      for (op, value) in keyRanges:
+        if op == '==':
+          candidates &= set([self.partitionOf(value)])
+
+    if keyValues and self.key in keyValues:
+      candidates &= set([self.partitionOf(v) for v in keyValues[self.key]])
+
+    return sorted(candidates)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,403 @@
+import math, struct
+from struct import Struct
+
+from Catalog.Identifiers import PageId, FileId, TupleId
+from Catalog.Schema      import Types, DBSchema
+from Storage.Page        import PageHeader, Page, PageTupleIterator
+from Storage.SlottedPage import SlottedPageHeader, SlottedPage
+
+class PaxPageHeader(SlottedPageHeader):
+  """
+  A PAX (Partition Attributes Across) page header implementation.
+
+  This extends the slotted page header with a field layout describing
+  how a tuple is split into per-column minipages. Each field entry records
+  the field's offset within a packed tuple, its size, and its struct format
+  character. The data area of the page is then divided into one minipage
+  per field, each holding numSlots values of that field contiguously.
+
+  The binary representation of this header object is:
+    (numSlots, slotBuffer, numFields, [(fieldOffset, fieldSize, fieldFormat)])
+
+  >>> import io
+  >>> buffer = io.BytesIO(bytes(4096))
+  >>> fields = [(0, 4, 'i'), (4, 10, 's'), (16, 4, 'i')]
+  >>> ph     = PaxPageHeader(buffer=buffer.getbuffer(), tupleSize=20, fields=fields)
+  >>> ph2    = PaxPageHeader.unpack(buffer.getbuffer())
+  >>> ph == ph2
+  True
+
+  >>> ph2.fields == fields
+  True
+
+  # Minipages are laid out back to back after the header.
+  >>> ph.columnOffsets[0] == ph.dataOffset()
+  True
+
+  >>> ph.columnOffsets[1] == ph.dataOffset() + ph.numSlots * 4
+  True
+
+  >>> ph.fieldOffset(9, 2) == ph.dataOffset() + ph.numSlots * 14 + 9 * 4
+  True
+
+  # PAX pages do not store alignment padding, so they fit more tuples.
+  >>> ph.numSlots > math.floor((4096 - ph.headerSize()) / 20)
+  True
+
+  ## Tuple count tests
+  >>> ph.hasFreeTuple()
+  True
+
+  >>> [ph.nextFreeTuple() for i in range(0, 5)]
+  [0, 1, 2, 3, 4]
+
+  >>> ph.numTuples()
+  5
+
+  >>> remainingTuples = ph.numSlots - ph.numTuples()
+  >>> [ph.nextFreeTuple() for i in range(0, remainingTuples)] # doctest:+ELLIPSIS
+  [5, 6, ...]
+
+  >>> ph.hasFreeTuple()
+  False
+
+  >>> ph.nextFreeTuple() == None
+  True
+  """
+
+  fieldCountRepr = Struct("=H")
+  fieldRepr      = Struct("=HHc")
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.fields = kwargs.get("fields", None)
+      if not self.fields:
+        raise ValueError("No field layout supplied for PaxPageHeader")
+
+      self.rowSize = sum([size for (_, size, _) in self.fields])
+      super().__init__(**kwargs)
+      self.initializeColumns()
+
+  def __eq__(self, other):
+    return super().__eq__(other) and self.fields == other.fields
+
+  def postHeaderInitialize(self, **kwargs):
+    super().postHeaderInitialize(**kwargs)
+
+    # Push the field layout into the buffer following the slot array.
+    fresh  = kwargs.get("unpacked", None) is None
+    buffer = kwargs.get("buffer", None)
+    if hasattr(self, "reprSize") and fresh and buffer:
+      buffer[self.reprSize:self.headerSize()] = self.packFields()
+
+  def fromOther(self, other):
+    super().fromOther(other)
+    if isinstance(other, PaxPageHeader):
+      self.fields        = other.fields
+      self.rowSize       = other.rowSize
+      self.columnOffsets = other.columnOffsets
+
+  # Computes the page offset at which each field's minipage begins.
+  def initializeColumns(self):
+    self.columnOffsets = []
+    offset = self.dataOffset()
+    for (_, size, _) in self.fields:
+      self.columnOffsets.append(offset)
+      offset += size * self.numSlots
+
+  # Returns the size of the field layout stored in the header.
+  def fieldsSize(self):
+    return PaxPageHeader.fieldCountRepr.size + PaxPageHeader.fieldRepr.size * len(self.fields)
+
+  # Parent method overrides
+  def headerSize(self):
+    return self.reprSize + self.fieldsSize()
+
+  # Slots are sized by the sum of the field sizes, since minipages omit padding.
+  def maxTuples(self):
+    headerSize = PageHeader.size + SlottedPageHeader.prefixRepr.size + self.fieldsSize()
+    headerPerTuple = 0.125
+    return math.floor((self.pageCapacity - headerSize) / (self.rowSize + headerPerTuple))
+
+  def usedSpace(self):
+    return self.numTuples() * self.rowSize
+
+  # PAX pages do not use a free space offset, the slot array alone tracks tuples.
+  def useTupleIndex(self, tupleIndex):
+    self.setSlot(tupleIndex, True)
+
+  # Returns the page offset of the given field for the tuple in a slot.
+  def fieldOffset(self, slotIndex, fieldIndex):
+    return self.columnOffsets[fieldIndex] + slotIndex * self.fields[fieldIndex][1]
+
+  def packFields(self):
+    return PaxPageHeader.fieldCountRepr.pack(len(self.fields)) \
+            + b''.join([PaxPageHeader.fieldRepr.pack(offset, size, fmt.encode()) \
+                          for (offset, size, fmt) in self.fields])
+
+  @classmethod
+  def unpackFields(cls, buffer, offset):
+    numFields = PaxPageHeader.fieldCountRepr.unpack_from(buffer, offset=offset)[0]
+    offset   += PaxPageHeader.fieldCountRepr.size
+    fields    = []
+    for i in range(numFields):
+      (fOffset, fSize, fFormat) = PaxPageHeader.fieldRepr.unpack_from(buffer, offset=offset)
+      fields.append((fOffset, fSize, fFormat.decode()))
+      offset += PaxPageHeader.fieldRepr.size
+    return fields
+
+  def pack(self):
+    if self.numSlots and self.slots:
+      return super().pack() + self.packFields()
+
+  @classmethod
+  def unpack(cls, buffer):
+    parent = PageHeader.unpack(buffer)
+    brepr  = cls.binrepr(buffer)
+    (numSlots, slotBuffer) = brepr.unpack_from(buffer, offset=PageHeader.size)
+    fields = cls.unpackFields(buffer, PageHeader.size + brepr.size)
+    return cls(parent=parent, buffer=buffer, fields=fields, \
+               numSlots=numSlots, slots=slotBuffer, unpacked=True)
+
+
+class PaxPage(SlottedPage):
+  """
+  A PAX page implementation, storing tuples in per-column minipages.
+
+  PAX pages present the same tuple-oriented interface as slotted pages,
+  gathering and scattering packed tuples across minipages on access.
+  Additionally, a PAX page supports reading a single column with 'column',
+  and reading a subset of columns with 'projectTuples'. The latter only
+  touches the minipages of the requested fields.
+
+  >>> from Catalog.Identifiers import FileId, PageId, TupleId
+  >>> from Catalog.Schema      import DBSchema
+
+  # Test harness setup.
+  >>> schema = DBSchema('employee', [('id', 'int'), ('dob', 'char(10)'), ('age', 'int')])
+  >>> pId    = PageId(FileId(1), 100)
+  >>> p      = PaxPage(pageId=pId, buffer=bytes(4096), schema=schema)
+
+  # Validate header initialization
+  >>> p.header.numTuples() == 0 and p.header.usedSpace() == 0
+  True
+
+  # Create and insert a tuple
+  >>> e1 = schema.instantiate(1, '1990-01-01', 25)
+  >>> tId = p.insertTuple(schema.pack(e1))
+
+  >>> tId.tupleIndex
+  0
+
+  >>> schema.unpack(p.getTuple(tId))
+  employee(id=1, dob='1990-01-01', age=25)
+
+  # Update the tuple.
+  >>> e1 = schema.instantiate(1, '1990-01-01', 28)
+  >>> p.putTuple(tId, schema.pack(e1))
+  >>> schema.unpack(p.getTuple(tId))
+  employee(id=1, dob='1990-01-01', age=28)
+
+  # Add some more tuples
+  >>> for tup in [schema.pack(schema.instantiate(i, '2000-01-01', 2*i+20)) for i in range(10)]:
+  ...    _ = p.insertTuple(tup)
+  ...
+
+  >>> p.header.numTuples()
+  11
+
+  # Test iterator
+  >>> [schema.unpack(tup).age for tup in p]
+  [28, 20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  # Test column access
+  >>> list(p.column(2, schema))
+  [28, 20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  >>> list(p.column(1, schema))[0]
+  '1990-01-01'
+
+  # Columns are decoded as their field's type.
+  >>> from Catalog.Dictionary import ColumnDictionary
+  >>> tschema = DBSchema('lineitem', [('shipdate', 'date'), ('price', 'decimal(12,2)'), ('mode', 'char(10)')], \
+                         {'mode': ColumnDictionary()})
+  >>> tp = PaxPage(pageId=pId, buffer=bytes(4096), schema=tschema)
+  >>> _ = tp.insertTuple(tschema.pack(tschema.instantiate('1994-01-01', 1234.56, 'RAIL')))
+  >>> [list(tp.column(i, tschema)) for i in range(3)]
+  [['1994-01-01'], [1234.56], ['RAIL']]
+
+  >>> list(tp.column(2, tschema, decode=False))
+  [0]
+
+  # Test projected access
+  >>> ageSchema = DBSchema('employeeAge', [('id', 'int'), ('age', 'int')])
+  >>> [ageSchema.unpack(tup) for tup in p.projectTuples([0, 2], ageSchema)][:2]
+  [employeeAge(id=1, age=28), employeeAge(id=0, age=20)]
+
+  # Test array access
+  >>> p.asArray(schema)[['id', 'age']][:2].tolist()
+  [(1, 28), (0, 20)]
+
+  # Test clearing and removal of the first tuple
+  >>> tId = TupleId(p.pageId, 0)
+  >>> p.clearTuple(tId)
+  >>> schema.unpack(p.getTuple(tId))
+  employee(id=0, dob='', age=0)
+
+  >>> p.deleteTuple(tId)
+  >>> [schema.unpack(tup).age for tup in p]
+  [20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  >>> p.header.numTuples()
+  10
+
+  # Test page packing and unpacking
+  >>> p2 = PaxPage.unpack(pId, bytearray(p.pack()))
+  >>> p.header == p2.header
+  True
+
+  >>> [schema.unpack(tup).id for tup in p2]
+  [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+  """
+
+  headerClass = PaxPageHeader
+
+  # Header constructor override for PAX pages.
+  def initializeHeader(self, **kwargs):
+    schema = kwargs.get("schema", None)
+    if schema:
+      fields = [(offset, size, fmt[-1]) \
+                  for ((offset, size), fmt) in zip(schema.fieldLayout(), schema.formats)]
+      return PaxPageHeader(buffer=self.getbuffer(), tupleSize=schema.size, fields=fields)
+    else:
+      raise ValueError("No schema provided when constructing a PAX page.")
+
+  # Tuple iterator
+  def __iter__(self):
+    return PaxPageTupleIterator(self)
+
+  def hasTuple(self, tupleId):
+    return self.header.hasSlot(tupleId.tupleIndex) and self.header.getSlot(tupleId.tupleIndex)
+
+  # Assembles the given fields of a slot into a packed tuple with the given layout.
+  def gatherTuple(self, slotIndex, fieldPositions, layout, tupleSize):
+    buffer    = self.getbuffer()
+    tupleData = bytearray(tupleSize)
+    for (fieldIndex, (offset, size)) in zip(fieldPositions, layout):
+      start = self.header.fieldOffset(slotIndex, fieldIndex)
+      tupleData[offset:offset+size] = buffer[start:start+size]
+    return bytes(tupleData)
+
+  # Splits a packed tuple across the minipages for the given slot.
+  def scatterTuple(self, slotIndex, tupleData):
+    buffer = self.getbuffer()
+    for (fieldIndex, (offset, size, _)) in enumerate(self.header.fields):
+      start = self.header.fieldOffset(slotIndex, fieldIndex)
+      buffer[start:start+size] = tupleData[offset:offset+size]
+
+  # Tuple accessor methods
+  def getTuple(self, tupleId):
+    if self.header and tupleId and self.hasTuple(tupleId):
+      fields = self.header.fields
+      return self.gatherTuple(tupleId.tupleIndex, range(len(fields)), \
+                              [(offset, size) for (offset, size, _) in fields], \
+                              self.header.tupleSize)
+
+  def putTuple(self, tupleId, tupleData):
+    if self.header and tupleId and tupleData \
+        and self.header.validTuple(tupleData) and self.hasTuple(tupleId):
+      self.setDirty(True)
+      self.scatterTuple(tupleId.tupleIndex, tupleData)
+
+  def insertTuple(self, tupleData):
+    if self.header and tupleData and self.header.validTuple(tupleData):
+      slotIndex = self.header.nextFreeTuple()
+      if slotIndex is not None:
+        self.setDirty(True)
+        self.scatterTuple(slotIndex, tupleData)
+        return TupleId(self.pageId, slotIndex)
+
+  def clearTuple(self, tupleId):
+    if self.header and tupleId and self.hasTuple(tupleId):
+      self.setDirty(True)
+      self.scatterTuple(tupleId.tupleIndex, bytes(self.header.tupleSize))
+
+  def clear(self):
+    if self.header:
+      start = self.header.dataOffset()
+      end   = self.header.pageCapacity
+      self.setDirty(True)
+      self.getbuffer()[start:end] = b'\x00' * (end-start)
+
+  # Column access methods
+
+  # Returns an iterator over the values of a single field for all tuples in the page.
+  # Values are converted as when unpacking tuples of the given schema, with
+  # dictionary-encoded fields returned as codes if 'decode' is false.
+  def column(self, fieldPosition, schema, decode=True):
+    (_, size, fmt) = self.header.fields[fieldPosition]
+    start = self.header.columnOffsets[fieldPosition]
+    end   = start + size * self.header.numSlots
+    used  = set(self.header.usedSlots())
+    valueRepr = Struct(str(size) + fmt if fmt == 's' else fmt)
+    converter = dict(schema.unpackers if decode else schema.codeUnpackers).get(fieldPosition, None)
+
+    values = valueRepr.iter_unpack(self.getbuffer()[start:end])
+    return ((converter(v[0]) if converter else v[0]) for (i, v) in enumerate(values) if i in used)
+
+  # PAX pages gather tuples from their minipages for packing and unpacking.
+  def insertInstance(self, schema, instance):
+    return self.insertTuple(schema.pack(instance))
+
+  def unpackTuples(self, schema):
+    return [schema.unpack(tupleData) for tupleData in self]
+
+  # Returns the tuples in used slots as a NumPy structured array of the given
+  # schema. Each field is gathered from a zero-copy view of its minipage, so
+  # the result is a new array assembled one column at a time.
+  def asArray(self, schema):
+    if schema.size != self.header.tupleSize:
+      raise ValueError("Schema does not match the tuple size of the page")
+    numpy  = Types.numpy()
+    dtype  = schema.numpyDtype()
+    used   = numpy.flatnonzero(self.header.slotMask())
+    array  = numpy.zeros(len(used), dtype=dtype)
+    buffer = self.getbuffer()
+    for (fieldIndex, field) in enumerate(schema.fields):
+      column = numpy.frombuffer(buffer, dtype=dtype.fields[field][0], \
+                                count=self.header.numSlots, offset=self.header.columnOffsets[fieldIndex])
+      array[field] = column[used]
+    return array
+
+  # Returns an iterator over packed tuples of the given projected schema,
+  # whose fields are taken from the given field positions of this page.
+  def projectTuples(self, fieldPositions, projectSchema):
+    layout = projectSchema.fieldLayout()
+    return (self.gatherTuple(i, fieldPositions, layout, projectSchema.size) \
+              for i in self.header.usedSlots())
+
+
+class PaxPageTupleIterator(PageTupleIterator):
+  """
+  Iteration over the tuples in a PAX page.
+  """
+  def __init__(self, page):
+    if not isinstance(page, PaxPage):
+      raise ValueError("Invalid PAX page instance for a PAX page iterator")
+    super().__init__(page)
+    self.slotIterator = iter(page.header.usedSlots())
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    slotIndex = next(self.slotIterator)
+    return self.page.getTuple(TupleId(self.page.pageId, slotIndex))
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -3,7 +3,7 @@ from struct import Struct
 from io     import BytesIO
 
 from Catalog.Identifiers import PageId, FileId, TupleId
-from Catalog.Schema import DBSchema
+from Catalog.Schema import Types, DBSchema
 from Storage.Page import PageHeader, Page, PageTupleIterator
 
 class SlottedPageHeader(PageHeader):
@@ -16,6 +16,11 @@ class SlottedPageHeader(PageHeader):
 
   The binary representation of this header object is: (numSlots, nextSlot, slotBuffer)
 
+  The header caches the number of used slots, and a hint of the first slot
+  that may be free, so that tuple counts and space checks need not scan the
+  slot array. Slot array scans operate on whole words via integer conversions
+  of the bitvector, or on whole bytes via per-byte lookup tables.
+
   >>> import io
   >>> buffer = io.BytesIO(bytes(4096))
   >>> ph     = SlottedPageHeader(buffer=buffer.getbuffer(), tupleSize=16)
@@ -75,6 +80,23 @@ class SlottedPageHeader(PageHeader):
 
   >>> ph.freeSpace() < ph.tupleSize
   True
+
+  # Freed slots are reused first, and counts track slot changes.
+  >>> ph.resetTupleIndex(5); ph.resetTupleIndex(3)
+  >>> ph.numFreeTuples(), ph.freeSlots()
+  (2, [3, 5])
+  >>> ph.usedSlots()[:5]
+  [0, 1, 2, 4, 6]
+  >>> ph.nextFreeTuple(), ph.nextFreeTuple(), ph.nextFreeTuple()
+  (3, 5, None)
+
+  # Unpacked headers recompute their counts.
+  >>> ph.resetTupleIndex(7)
+  >>> ph3 = SlottedPageHeader.unpack(bytearray(buffer.getvalue()))
+  >>> ph3.numTuples() == ph.numTuples() == ph.numSlots - 1
+  True
+  >>> ph3.tupleIndex(ph3.slotOffset(8) + 1), ph3.tupleIndex(ph3.slotOffset(7))
+  (8, None)
   """
 
   # # Slots are two unsigned shorts: slot offset and slot data length
@@ -84,6 +106,12 @@ class SlottedPageHeader(PageHeader):
   prefixFmt   = "H"
   prefixRepr  = struct.Struct(prefixFmt)
 
+  # Binary representations of slot arrays, by number of slots.
+  slotReprs   = {}
+
+  # The slot indexes within a byte of the slot array, for every byte value.
+  byteSlots   = [tuple(j for j in range(8) if b & (0b1 << (7 - j))) for b in range(256)]
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -100,7 +128,7 @@ class SlottedPageHeader(PageHeader):
 
         self.numSlots = kwargs.get("numSlots", self.maxTuples())
         self.slots    = self.initializeSlots(buffer)
-        self.binrepr  = Struct(SlottedPageHeader.prefixFmt+str(self.slotBufferSize())+"s")
+        self.binrepr  = SlottedPageHeader.slotRepr(self.numSlots)
         self.reprSize = PageHeader.size + self.binrepr.size
 
         # Call postHeaderInitialize now that we've initialized our local attributes
@@ -135,6 +163,8 @@ class SlottedPageHeader(PageHeader):
       else:
         self.slots[:] = kwargs.get("slots", b'\x00' * self.slotBufferSize())
 
+      self.refreshSlots()
+
   def fromOther(self, other):
     super().fromOther(other)
     if isinstance(other, SlottedPageHeader):
@@ -142,13 +172,18 @@ class SlottedPageHeader(PageHeader):
       self.slots    = other.slots
       self.binrepr  = other.binrepr
       self.reprSize = other.reprSize
+      self.usedCount = other.usedCount
+      self.freeHint  = other.freeHint
 
   # Parent method overrides
   def headerSize(self):
     return self.reprSize
 
   def numTuples(self):
-    return len(self.usedSlots())
+    return self.usedCount
+
+  def numFreeTuples(self):
+    return self.numSlots - self.numTuples()
 
   # Returns the maximum number of tuples that can be held in this page.
   def maxTuples(self):
@@ -176,6 +211,26 @@ class SlottedPageHeader(PageHeader):
 
   # Slotted page specific methods
 
+  # Recomputes the cached used slot count from the slot array.
+  def refreshSlots(self):
+    self.usedCount = bin(self.slotBits()).count("1")
+    self.freeHint  = 0
+
+  # Returns the slot array from the given byte onwards as an integer, where
+  # the highest bit is the earliest slot, dropping bits past the last slot.
+  def slotBits(self, startByte=0):
+    padding = (self.slots.nbytes << 3) - self.numSlots
+    return int.from_bytes(self.slots[startByte:], 'big') >> padding
+
+  # Returns the slot indexes whose bit matches the given byte mask,
+  # i.e., used slots for a zero mask and free slots for an all-ones mask.
+  def slotIndexes(self, mask):
+    byteSlots = SlottedPageHeader.byteSlots
+    indexes   = [(i << 3) + j for (i, b) in enumerate(self.slots) for j in byteSlots[b ^ mask]]
+    while indexes and indexes[-1] >= self.numSlots:
+      indexes.pop()
+    return indexes
+
   # Returns the byte offset of the given slot in the bitvector.
   def slotBufferByteOffset(self, slotIndex):
     return slotIndex >> 3
@@ -198,10 +253,14 @@ class SlottedPageHeader(PageHeader):
   def setSlot(self, slotIndex, used):
     if self.hasSlot(slotIndex):
       (byteIdx, bitIdx) = self.slotBufferOffset(slotIndex)
-      if used:
-        self.slots[byteIdx] = self.slots[byteIdx] | (0b1 << bitIdx)
-      else:
-        self.slots[byteIdx] = self.slots[byteIdx] & ~(0b1 << bitIdx)
+      current = self.slots[byteIdx]
+      updated = (current | (0b1 << bitIdx)) if used else (current & ~(0b1 << bitIdx))
+      if current != updated:
+        self.slots[byteIdx] = updated
+        if slotIndex < self.numSlots:
+          self.usedCount += 1 if used else -1
+          if not used:
+            self.freeHint = min(self.freeHint, slotIndex)
     else:
       raise ValueError("Invalid set slot index or slot value")
 
@@ -209,51 +268,31 @@ class SlottedPageHeader(PageHeader):
   def resetSlot(self, slotIndex):
     self.setSlot(slotIndex, False)
 
+  # Returns the slot array as a NumPy boolean array, with one entry per slot.
+  def slotMask(self):
+    numpy = Types.numpy()
+    bits  = numpy.unpackbits(numpy.frombuffer(self.slots, dtype=numpy.uint8))
+    return bits[:self.numSlots].astype(bool)
+
   # Returns the slot indexes for all of the unused slots.
   def freeSlots(self):
-    freeIndexes = []
-    for i in range(self.slots.nbytes-1):
-      for j in range(8):
-        if not ( self.slots[i] & (0b1 << (7 - j)) ):
-          freeIndexes.append((i << 3) + j)
-
-    # Special handling of the final byte to only consider up to numSlots.
-    i = self.slots.nbytes-1
-    j = 0
-    while (i << 3) + j < self.numSlots:
-      if not ( self.slots[i] & (0b1 << (7 - j)) ):
-        freeIndexes.append((i << 3) + j)
-      j += 1
-
-    return freeIndexes
+    if self.usedCount == self.numSlots:
+      return []
+    return self.slotIndexes(0xff)
 
   # Returns the slot indexes for all used slots.
   def usedSlots(self):
-    usedIndexes = []
-    for i in range(self.slots.nbytes-1):
-      for j in range(8):
-        if self.slots[i] & (0b1 << (7 - j)):
-          usedIndexes.append((i << 3) + j)
-
-    # Special handling of the final byte to only consider up to numSlots.
-    i = self.slots.nbytes-1
-    j = 0
-    while (i << 3) + j < self.numSlots:
-      if self.slots[i] & (0b1 << (7 - j)):
-        usedIndexes.append((i << 3) + j)
-      j += 1
-
-    return usedIndexes
-
-  # Converts an absolute page offset into a slot index.
+    if self.usedCount == 0:
+      return []
+    return self.slotIndexes(0)
+
+  # Converts an absolute page offset into the index of the used slot holding it.
   def tupleIndex(self, offset):
     tupleIdx = None
-    for i in self.usedSlots():
-      start = self.slotTupleOffset(i)
-      end   = start + self.tupleSize
-      if start <= offset and offset < end:
-        tupleIdx = i
-        break
+    if self.tupleSize and offset >= self.dataOffset():
+      slotIndex = (offset - self.dataOffset()) // self.tupleSize
+      if slotIndex < self.numSlots and self.getSlot(slotIndex):
+        tupleIdx = slotIndex
     return tupleIdx
 
   # Returns the offset within the page for the tuple corresponding to a slot.
@@ -288,44 +327,28 @@ class SlottedPageHeader(PageHeader):
 
   # Returns the space used in the page associated with this header.
   def usedSpace(self):
-    usage = sum([self.tupleSize for i in self.usedSlots()])
-    return usage if isinstance(usage, int) else 0
+    return self.usedCount * self.tupleSize if self.tupleSize else 0
 
   # Returns whether the page has any free space for a tuple.
   def hasFreeTuple(self):
-    fullSlots = bytearray(b'\xff' * self.slots.nbytes)
-    if self.numSlots % 8 != 0:
-      b = 0
-      for i in range(self.numSlots % 8):
-        b = b | (0b1 << (7 - i))
-      fullSlots[self.slots.nbytes-1] = b
-
-    return self.slots != fullSlots
+    return self.usedCount < self.numSlots
 
   # Returns the tupleIndex of the next free tuple.
   # This should also "allocate" the tuple, such that any subsequent call
   # does not yield the same tupleIndex.
   def nextFreeTuple(self):
     index = None
-    for i in range(self.slots.nbytes-1):
-      # Compute the first free slot by:
-      # i. xor'ing with all bits set to determine the free bit mask
+    if self.usedCount < self.numSlots:
+      # Compute the first free slot from the hint onwards by:
+      # i. complementing the slot bits to determine the free bit mask
       # ii. differencing against the bit length (i.e., the # of bits to represent the free mask)
-      slotInByte = 8 - ( (self.slots[i] ^ 0xff).bit_length() )
-      if slotInByte < 8:
-        index = (i << 3) + slotInByte
+      startByte = self.freeHint >> 3
+      numBits   = self.numSlots - (startByte << 3)
+      freeBits  = ~self.slotBits(startByte) & ((0b1 << numBits) - 1)
+      if freeBits:
+        index = (startByte << 3) + numBits - freeBits.bit_length()
         self.useTupleIndex(index)
-        break
-
-    # Special handling of the final byte to only consider up to numSlots.
-    if index is None:
-      i = self.slots.nbytes-1
-      j = 0
-      while index is None and (i << 3) + j < self.numSlots:
-        if not ( self.slots[i] & (0b1 << (7 - j)) ):
-          index = (i << 3) + j
-          self.useTupleIndex(index)
-        j += 1
+        self.freeHint = index + 1
 
     return index
 
@@ -352,15 +375,24 @@ class SlottedPageHeader(PageHeader):
     if self.numSlots and self.slots:
       return super().pack() + self.binrepr.pack(self.numSlots, self.slots.tobytes())
 
+  # Returns the binary representation for a given number of slots, shared
+  # across all headers with the same slot count.
+  @classmethod
+  def slotRepr(cls, numSlots):
+    brepr = SlottedPageHeader.slotReprs.get(numSlots, None)
+    if brepr is None:
+      slotArrayLen = numSlots >> 3
+      if numSlots % 8 != 0:
+        slotArrayLen += 1
+      brepr = Struct(SlottedPageHeader.prefixFmt+str(slotArrayLen)+"s")
+      SlottedPageHeader.slotReprs[numSlots] = brepr
+    return brepr
+
   @classmethod
   def binrepr(cls, buffer):
-    lenStruct    = Struct("H")
-    numSlots     = lenStruct.unpack_from(buffer, offset=PageHeader.size)[0]
-    slotArrayLen = numSlots >> 3
-    if numSlots % 8 != 0:
-      slotArrayLen += 1
+    numSlots = SlottedPageHeader.prefixRepr.unpack_from(buffer, offset=PageHeader.size)[0]
     if numSlots > 0:
-      return Struct(SlottedPageHeader.prefixFmt+str(slotArrayLen)+"s")
+      return cls.slotRepr(numSlots)
     else:
       raise ValueError("Invalid number of slots in slotted page header")
 
@@ -469,6 +501,21 @@ class SlottedPage(Page):
   >>> p.header.usedSpace() == (sizeBeforeRemove - p.header.tupleSize)
   True
 
+  # Array views skip free slots, and share memory with the page when the
+  # used slots are contiguous.
+  >>> p.asArray(schema)['age'].tolist()
+  [20, 22, 24, 26, 28, 30, 32, 34, 36, 38]
+
+  >>> p.unpackTuples(schema)[:2]
+  [employee(id=0, age=20), employee(id=1, age=22)]
+
+  >>> tId = p.insertInstance(schema, schema.instantiate(11, 40))
+  >>> p.unpackTuples(schema)[:2]
+  [employee(id=11, age=40), employee(id=0, age=20)]
+  >>> array = p.asArray(schema)
+  >>> array[['id', 'age']][:2].tolist(), array.base is not None
+  ([(11, 40), (0, 20)], True)
+
   """
 
   headerClass = SlottedPageHeader
@@ -500,6 +547,27 @@ class SlottedPage(Page):
   def __iter__(self):
     return SlottedPageTupleIterator(self)
 
+  # Returns a list of the tuples in used slots, unpacked as instances of the
+  # given schema. Pages whose used slots form a prefix are unpacked in one pass.
+  def unpackTuples(self, schema):
+    numTuples = self.header.numTuples()
+    if self.header.freeHint >= numTuples:
+      return super().unpackTuples(schema)
+    with self.getbuffer() as buffer:
+      return [schema.unpackFrom(buffer, self.header.slotOffset(i)) for i in self.header.usedSlots()]
+
+  # Returns the tuples in used slots as a NumPy structured array of the given
+  # schema. When the used slots form a prefix of the slot array, this is a
+  # zero-copy view over the data region, otherwise the view is compacted
+  # by the slot bitmap into a new array.
+  def asArray(self, schema):
+    numTuples = self.header.numTuples()
+    view      = self.arrayView(schema, self.header.numSlots)
+    if self.header.freeHint >= numTuples:
+      return view[:numTuples]
+    mask = self.header.slotMask()
+    return view[:numTuples] if mask[:numTuples].all() else view[mask]
+
   # Override contiguous page's deleteTuple to prevent it shifting data.
   def deleteTuple(self, tupleId):
     if self.header and tupleId:
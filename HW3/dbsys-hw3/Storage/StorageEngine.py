@@ -1,6 +1,10 @@
+import os.path, threading
+
 from Catalog.Schema      import DBSchema
+from Storage.ColumnCache import ColumnCache
 from Storage.FileManager import FileManager
 from Storage.BufferPool  import BufferPool
+from Storage.WAL         import WriteAheadLog
 
 class StorageEngine:
   """
@@ -10,6 +14,20 @@ class StorageEngine:
   based on the functionality provided by the buffer pool, file manager and
   the remaining components of the storage engine.
 
+  With 'wal' set, the storage engine keeps a write-ahead redo log in its data
+  directory. Each insert, delete and update is logged, and is durable once the
+  operation returns. Concurrent writers commit in groups sharing a single log
+  fsync, while dirty pages are written back lazily by the buffer pool. On startup,
+  the engine replays the log into its storage files, and then checkpoints, i.e.,
+  writes back all pages and truncates the log. Checkpoints also occur when the log
+  grows past its 'checkpointSize', and when the engine is closed.
+
+  Relation files may be spread over multiple 'tablespaces', with scans reading
+  ahead 'readAhead' pages from each tablespace in parallel (see FileManager).
+
+  The engine also keeps a column cache of selected relations, and of relations
+  scanned more than 'cacheHotScans' times (see ColumnCache).
+
   >>> schema = DBSchema('employee', [('id', 'int'), ('age', 'int')])
 
   >>> storage = StorageEngine()
@@ -28,8 +46,84 @@ class StorageEngine:
   >>> [schema.unpack(tup).id for tup in storage.tuples(schema.name)] == list(range(20))
   True
 
+  # Vacuum a relation after deleting most of its tuples
+  >>> storage.createRelation('orders', schema)
+  >>> tupleIds = [storage.insertTuple('orders', schema.pack(schema.instantiate(i, i % 50))) for i in range(3000)]
+  >>> for tupleId in [t for (i, t) in enumerate(tupleIds) if i % 3]:
+  ...    storage.deleteTuple('orders', tupleId)
+  ...
+  >>> storage.relationStats('orders')[1:]
+  (3, 1000)
+
+  # Vacuum steps may be interleaved with other operations.
+  >>> storage.vacuum('orders', maxSteps=1)
+  False
+  >>> _ = storage.insertTuple('orders', schema.pack(schema.instantiate(3000, 0)))
+  >>> storage.vacuum('orders')
+  True
+  >>> storage.relationStats('orders')[1:]
+  (1, 1001)
+
+  >>> sorted([schema.unpack(tup).id for tup in storage.tuples('orders')]) == list(range(0, 3001, 3))
+  True
+
+  # Logged operations survive a crash, here an engine whose dirty pages are never written back.
+  >>> import shutil
+  >>> storage = StorageEngine(dataDir='data/wal', poolSize=1 << 20, wal=True)
+  >>> storage.createRelation('orders', schema)
+  >>> tupleIds = [storage.insertTuple('orders', schema.pack(schema.instantiate(i, 20))) for i in range(1500)]
+  >>> storage.deleteTuple('orders', tupleIds[0])
+  >>> storage.updateTuple('orders', tupleIds[1], schema.pack(schema.instantiate(1, 30)))
+
+  >>> recovered = StorageEngine(dataDir='data/wal', poolSize=1 << 20, wal=True)
+  >>> recovered.relationStats('orders')[1:]
+  (2, 1499)
+  >>> [schema.unpack(tup) for tup in recovered.tuples('orders')][:2]
+  [employee(id=1, age=30), employee(id=2, age=20)]
+
+  # Concurrent writers share log fsyncs.
+  >>> def writer(w):
+  ...   for i in range(100):
+  ...     recovered.insertTuple('orders', schema.pack(schema.instantiate(10000 + 100 * w + i, w)))
+  ...
+  >>> threads = [threading.Thread(target=writer, args=(w,)) for w in range(8)]
+  >>> for t in threads: t.start()
+  >>> for t in threads: t.join()
+  >>> recovered.relationStats('orders')[2], recovered.wal.syncs < 800
+  (2299, True)
+
+  >>> recovered.close()
+
+  # Tuples moved by a vacuum survive a crash right after the vacuum truncates the file.
+  >>> storage = StorageEngine(dataDir='data/wal', poolSize=1 << 20, wal=True)
+  >>> storage.createRelation('moved', schema)
+  >>> tupleIds = [storage.insertTuple('moved', schema.pack(schema.instantiate(i, 20))) for i in range(1500)]
+  >>> for tupleId in tupleIds[:1000]:
+  ...    storage.deleteTuple('moved', tupleId)
+  ...
+  >>> storage.checkpoint()
+  >>> rFile = storage.fileMgr.relationFile('moved')[1]
+  >>> def crashingTruncate(pageId, truncate=rFile.truncatePage):
+  ...    truncate(pageId)
+  ...    raise RuntimeError("Crash")
+  ...
+  >>> rFile.truncatePage = crashingTruncate
+  >>> storage.vacuum('moved')
+  Traceback (most recent call last):
+  ...
+  RuntimeError: Crash
+
+  >>> recovered = StorageEngine(dataDir='data/wal', poolSize=1 << 20, wal=True)
+  >>> sorted([schema.unpack(tup).id for tup in recovered.tuples('moved')]) == list(range(1000, 1500))
+  True
+
+  >>> recovered.close()
+  >>> shutil.rmtree('data/wal')
+
   """
 
+  logFile = "db.wal"
+
   def __init__(self, **kwargs):
     other = kwargs.get("other", None)
     if other:
@@ -37,20 +131,66 @@ class StorageEngine:
 
     else:
       bpArgs          = {k:v for (k,v) in kwargs.items() if k in ["pageSize", "poolSize"]}
-      fmArgs          = {k:v for (k,v) in kwargs.items() if k in ["pageSize", "dataDir", "indexDir"]}
+      fmArgs          = {k:v for (k,v) in kwargs.items() if k in ["pageSize", "dataDir", "indexDir", "tablespaces", "readAhead"]}
+      walArgs         = {k:v for (k,v) in kwargs.items() if k in ["groupCommitDelay", "checkpointSize"]}
       self.bufferPool = BufferPool(**bpArgs)
       self.fileMgr    = FileManager(bufferPool=self.bufferPool, **fmArgs)
+      self.latch      = threading.RLock()
+      self.wal        = None
+      self.columnCache = ColumnCache(self, hotScans=kwargs.get("cacheHotScans", 0), \
+                                     maxTuples=kwargs.get("cacheMaxTuples", ColumnCache.defaultMaxTuples))
 
       if self.fileMgr:
         self.bufferPool.setFileManager(self.fileMgr)
 
+        if kwargs.get("wal", False):
+          self.wal = WriteAheadLog(path=os.path.join(self.fileMgr.dataDir, StorageEngine.logFile), **walArgs)
+          self.bufferPool.setWriteAheadLog(self.wal)
+          self.fileMgr.setWriteAheadLog(self.wal)
+          self.recover()
+
   def fromOther(self, other):
     self.bufferPool = other.bufferPool
     self.fileMgr    = other.fileMgr
+    self.latch      = other.latch
+    self.wal        = other.wal
+    self.columnCache = other.columnCache
 
   def close(self):
     if self.fileMgr:
+      self.checkpoint()
       self.fileMgr.close()
+    if self.wal:
+      self.wal.close()
+
+
+  # Write-ahead logging
+
+  # Replays the write-ahead log from the last checkpoint.
+  def recover(self):
+    if self.wal:
+      with self.latch:
+        records = self.wal.recover()
+        if records:
+          self.fileMgr.redo(records)
+          self.checkpoint()
+
+  # Writes back all dirty pages and storage file metadata, after which the log can be truncated.
+  def checkpoint(self):
+    if self.wal:
+      with self.latch:
+        self.wal.flush()
+        self.bufferPool.clear()
+        self.fileMgr.sync()
+        self.wal.truncate()
+
+  # Waits for all operations logged so far to become durable.
+  # Writers wait outside the engine's latch, so that their commits are grouped.
+  def commit(self):
+    if self.wal:
+      self.wal.commit()
+      if self.wal.needsCheckpoint():
+        self.checkpoint()
 
   # Data definition operations
 
@@ -62,28 +202,49 @@ class StorageEngine:
     if self.fileMgr:
       return self.fileMgr.hasRelation(relId)
 
-  def createRelation(self, relId, schema):
+  def createRelation(self, relId, schema, **kwargs):
     if self.fileMgr:
-      self.fileMgr.createRelation(relId, schema)
+      self.fileMgr.createRelation(relId, schema, **kwargs)
     else:
       raise ValueError("Could not create relation, no file manager found")
 
   def removeRelation(self, relId):
     if self.fileMgr:
       self.fileMgr.removeRelation(relId)
+      self.columnCache.uncacheRelation(relId)
     else:
       raise ValueError("Could not remove relation, no file manager found")
 
+  # Returns the page size, and the number of pages and tuples of a relation,
+  # summed over its partitions for partitioned relations.
   def relationStats(self, relId):
     if self.fileMgr:
-      (_, rf) = self.fileMgr.relationFile(relId)
-      if rf:
-        return (rf.pageSize(), rf.numPages(), rf.numTuples())
+      rfs = self.fileMgr.partitionFiles(relId)
+      if rfs:
+        return (rfs[0].pageSize(), sum([rf.numPages() for rf in rfs]), sum([rf.numTuples() for rf in rfs]))
       else:
         raise ValueError("Could not find relation " + relId + " in file manager")
     else:
       raise ValueError("Could not find relation stats, no file manager found")
 
+  def setRelationSchema(self, relId, schema):
+    if self.fileMgr:
+      with self.latch:
+        self.fileMgr.setRelationSchema(relId, schema)
+
+  def partitionScheme(self, relId):
+    if self.fileMgr:
+      return self.fileMgr.partitionScheme(relId)
+
+  # Keeps a relation's columns in the column cache, or drops them.
+  def cacheRelation(self, relId, schema=None):
+    with self.latch:
+      self.columnCache.cacheRelation(relId, schema)
+
+  def uncacheRelation(self, relId):
+    with self.latch:
+      self.columnCache.uncacheRelation(relId)
+
   def hasIndex(self, relId, keySchema):
     if self.fileMgr:
       return self.fileMgr.hasIndex(relId, keySchema)
@@ -110,31 +271,67 @@ class StorageEngine:
   # Returns a tuple id for the newly inserted data.
   def insertTuple(self, relId, tupleData):
     if self.fileMgr:
-      return self.fileMgr.insertTuple(relId, tupleData)
+      with self.latch:
+        tupleId = self.fileMgr.insertTuple(relId, tupleData)
+        self.columnCache.insertTuple(relId, tupleId, tupleData)
+      self.commit()
+      return tupleId
     else:
       raise ValueError("Could not insert tuple, no file manager found")
 
+  # Inserts a batch of tuples, returning their tuple ids. For relations with a
+  # clustering key, the batch is stored in clustering key order.
+  def bulkLoad(self, relId, tuples):
+    if self.fileMgr:
+      with self.latch:
+        tupleIds = self.fileMgr.bulkLoad(relId, tuples)
+        self.columnCache.invalidate(relId)
+      self.commit()
+      return tupleIds
+    else:
+      raise ValueError("Could not load tuples, no file manager found")
+
   def deleteTuple(self, relId, tupleId):
     if self.fileMgr:
-      self.fileMgr.deleteTuple(relId, tupleId)
+      with self.latch:
+        self.fileMgr.deleteTuple(relId, tupleId)
+        self.columnCache.deleteTuple(relId, tupleId)
+      self.commit()
     else:
       raise ValueError("Could not delete tuple, no file manager found")
 
   def updateTuple(self, relId, tupleId, tupleData):
     if self.fileMgr:
-      self.fileMgr.updateTuple(relId, tupleId, tupleData)
+      with self.latch:
+        self.fileMgr.updateTuple(relId, tupleId, tupleData)
+        self.columnCache.updateTuple(relId, tupleId, tupleData)
+      self.commit()
     else:
       raise ValueError("Could not update tuple, no file manager found")
 
+  # Compacts a relation by moving tuples out of its sparse tail pages and truncating
+  # the file. The vacuum runs incrementally, with at most 'maxSteps' pages moved per
+  # call, so that it can be interleaved with other operations on the relation.
+  # Returns whether the vacuum completed.
+  def vacuum(self, relId, maxSteps=None):
+    if self.fileMgr:
+      with self.latch:
+        completed = self.fileMgr.vacuum(relId, maxSteps)
+        self.columnCache.invalidate(relId)
+      self.commit()
+      return completed
+    else:
+      raise ValueError("Could not vacuum relation, no file manager found")
+
   # Tuple-based table scan
   def tuples(self, relId):
     if self.fileMgr:
       return self.fileMgr.tuples(relId)
 
   # Page-based table scan
-  def pages(self, relId):
+  def pages(self, relId, **kwargs):
     if self.fileMgr:
-      return self.fileMgr.pages(relId)
+      return self.fileMgr.pages(relId, **kwargs)
 
 
 if __name__ == "__main__":
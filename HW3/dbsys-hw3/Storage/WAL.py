@@ -0,0 +1,270 @@
+import io, os, os.path, threading, time, zlib
+from struct import Struct
+
+class LogRecord:
+  """
+  A redo log record, describing a physical change to a single slot of a page.
+
+  Records hold the log sequence number (LSN) assigned when appended, an
+  operation type, the file, page and tuple index of the slot, and any
+  tuple data. Slot operations are idempotent: an insert or update sets
+  the slot's contents, and a delete resets the slot. Pages that shift their
+  tuples on deletion (i.e., contiguous pages) are logged instead as a
+  full page image.
+
+  Records are stored with a CRC, so that a record torn by a crash
+  is detected and ends the log.
+
+  >>> r = LogRecord(LogRecord.INSERT, 1, 2, 3, b'abcd', lsn=7)
+  >>> buffer = r.pack()
+  >>> (r2, offset) = LogRecord.unpack(buffer, 0)
+  >>> (r2.lsn, r2.op, r2.fileIndex, r2.pageIndex, r2.tupleIndex, r2.data, offset == len(buffer))
+  (7, 1, 1, 2, 3, b'abcd', True)
+
+  >>> LogRecord.unpack(buffer[:-1], 0)
+  (None, 0)
+
+  # File, page and tuple indexes are stored as 32-bit values.
+  >>> (r3, _) = LogRecord.unpack(LogRecord(LogRecord.INSERT, 0, 70000, 1, b'x', lsn=1).pack(), 0)
+  >>> r3.pageIndex
+  70000
+  """
+
+  INSERT, UPDATE, DELETE, PAGE = range(1, 5)
+  names = {INSERT: 'insert', UPDATE: 'update', DELETE: 'delete', PAGE: 'page'}
+
+  headerRepr = Struct("=QBIIII")
+  crcRepr    = Struct("=I")
+
+  def __init__(self, op, fileIndex, pageIndex, tupleIndex, data=b'', **kwargs):
+    self.lsn        = kwargs.get("lsn", None)
+    self.op         = op
+    self.fileIndex  = fileIndex
+    self.pageIndex  = pageIndex
+    self.tupleIndex = tupleIndex
+    self.data       = bytes(data)
+
+  def __repr__(self):
+    return "LogRecord[" + ','.join([str(self.lsn), LogRecord.names[self.op], \
+              str(self.fileIndex), str(self.pageIndex), str(self.tupleIndex)]) + "]"
+
+  def size(self):
+    return LogRecord.headerRepr.size + len(self.data) + LogRecord.crcRepr.size
+
+  def pack(self):
+    body = LogRecord.headerRepr.pack(self.lsn, self.op, self.fileIndex, \
+                                     self.pageIndex, self.tupleIndex, len(self.data)) + self.data
+    return body + LogRecord.crcRepr.pack(zlib.crc32(body))
+
+  # Reads a record at the given offset, returning the record and the offset
+  # following it, or (None, offset) if no complete and valid record is found.
+  @classmethod
+  def unpack(cls, buffer, offset):
+    end = offset + LogRecord.headerRepr.size
+    if end <= len(buffer):
+      (lsn, op, fileIndex, pageIndex, tupleIndex, length) = LogRecord.headerRepr.unpack_from(buffer, offset)
+      end += length + LogRecord.crcRepr.size
+      if end <= len(buffer) and op in LogRecord.names:
+        body = buffer[offset:end-LogRecord.crcRepr.size]
+        if LogRecord.crcRepr.unpack_from(buffer, end-LogRecord.crcRepr.size)[0] == zlib.crc32(body):
+          data = body[LogRecord.headerRepr.size:]
+          return (cls(op, fileIndex, pageIndex, tupleIndex, data, lsn=lsn), end)
+    return (None, offset)
+
+
+class WriteAheadLog:
+  """
+  A write-ahead redo log with group commit.
+
+  Writers append log records to an in-memory tail, receiving each record's
+  LSN, and then wait for the log to become durable with 'commit'. The
+  first waiting writer becomes the group leader: it writes out all records
+  appended so far with a single write and fsync, while the others wait for
+  the leader to finish. Writers appending during a flush are then flushed
+  together by the next leader, so that many concurrent writers share each
+  fsync. A leader may also wait for a short 'groupCommitDelay' (in seconds)
+  before flushing, to gather larger groups.
+
+  The buffer pool flushes the log before writing any dirty page, so that no
+  page reaches the disk ahead of the records describing its changes.
+
+  On startup, 'recover' reads the valid prefix of the log, for replay into
+  the storage files. A checkpoint, after all pages are written back and
+  synced, truncates the log.
+
+  >>> import shutil, threading
+  >>> os.makedirs('data/wal', exist_ok=True)
+  >>> wal = WriteAheadLog(path='data/wal/test.wal')
+  >>> lsns = [wal.append(LogRecord(LogRecord.INSERT, 0, 0, i, bytes([i]) * 4)) for i in range(10)]
+  >>> lsns[:3], wal.durableLSN
+  ([1, 2, 3], 0)
+
+  >>> wal.commit(lsns[4])
+  >>> wal.durableLSN, wal.syncs
+  (10, 1)
+
+  # Concurrent writers share fsyncs.
+  >>> def writer(w):
+  ...   for i in range(50):
+  ...     wal.commit(wal.append(LogRecord(LogRecord.UPDATE, 1, w, i, b'x')))
+  ...
+  >>> threads = [threading.Thread(target=writer, args=(w,)) for w in range(8)]
+  >>> for t in threads: t.start()
+  >>> for t in threads: t.join()
+  >>> wal.durableLSN, wal.syncs < 1 + 8 * 50
+  (410, True)
+
+  # Reopening the log reads back its records, and continues their LSNs.
+  >>> wal.close()
+  >>> wal = WriteAheadLog(path='data/wal/test.wal')
+  >>> records = wal.recover()
+  >>> len(records), records[0], wal.nextLSN
+  (410, LogRecord[1,insert,0,0,0], 411)
+
+  # A torn record at the end of the log is ignored.
+  >>> wal.close()
+  >>> with open('data/wal/test.wal', 'ab') as f:
+  ...   _ = f.write(LogRecord(LogRecord.DELETE, 0, 0, 0, lsn=411).pack()[:-2])
+  ...
+  >>> wal = WriteAheadLog(path='data/wal/test.wal')
+  >>> len(wal.recover())
+  410
+
+  >>> wal.truncate()
+  >>> wal.size(), wal.recover()
+  (0, [])
+
+  >>> wal.close()
+  >>> shutil.rmtree('data/wal')
+  """
+
+  defaultCheckpointSize = 64 * (1 << 20)
+
+  def __init__(self, **kwargs):
+    other = kwargs.get("other", None)
+    if other:
+      self.fromOther(other)
+
+    else:
+      self.path             = kwargs.get("path", None)
+      self.groupCommitDelay = kwargs.get("groupCommitDelay", 0)
+      self.checkpointSize   = kwargs.get("checkpointSize", WriteAheadLog.defaultCheckpointSize)
+
+      if self.path is None:
+        raise ValueError("No path specified for a write-ahead log")
+
+      self.file       = io.FileIO(self.path, 'a+b')
+      self.condition  = threading.Condition()
+      self.pending    = []
+      self.flushing   = False
+      self.nextLSN    = 1
+      self.durableLSN = 0
+      self.syncs      = 0
+
+  def fromOther(self, other):
+    self.path             = other.path
+    self.groupCommitDelay = other.groupCommitDelay
+    self.checkpointSize   = other.checkpointSize
+    self.file             = other.file
+    self.condition        = other.condition
+    self.pending          = other.pending
+    self.flushing         = other.flushing
+    self.nextLSN          = other.nextLSN
+    self.durableLSN       = other.durableLSN
+    self.syncs            = other.syncs
+
+  def close(self):
+    self.flush()
+    self.file.close()
+
+  def size(self):
+    return os.path.getsize(self.path)
+
+  # Returns whether the log has grown enough to warrant a checkpoint.
+  def needsCheckpoint(self):
+    return self.size() >= self.checkpointSize
+
+  # Appends a record to the log tail, returning its LSN.
+  # The record is not durable until a commit covering its LSN.
+  def append(self, record):
+    with self.condition:
+      record.lsn    = self.nextLSN
+      self.nextLSN += 1
+      self.pending.append(record.pack())
+      return record.lsn
+
+  # Waits until all records up to the given LSN, or all records appended
+  # so far if none is given, are durable on disk.
+  def commit(self, lsn=None):
+    with self.condition:
+      lsn = self.nextLSN - 1 if lsn is None else lsn
+      while self.durableLSN < lsn:
+        if self.flushing:
+          self.condition.wait()
+        else:
+          self.flushGroup()
+
+  def flush(self):
+    self.commit()
+
+  # Writes and syncs the pending records as the group leader.
+  # This must be called while holding the log's condition, which is
+  # released during the write so that other writers may keep appending.
+  def flushGroup(self):
+    self.flushing = True
+    try:
+      if self.groupCommitDelay:
+        self.condition.wait(self.groupCommitDelay)
+
+      (group, self.pending) = (self.pending, [])
+      groupLSN = self.nextLSN - 1
+
+      self.condition.release()
+      try:
+        if group:
+          self.file.write(b''.join(group))
+          os.fsync(self.file.fileno())
+      finally:
+        self.condition.acquire()
+
+      if group:
+        self.syncs += 1
+      self.durableLSN = max(self.durableLSN, groupLSN)
+
+    finally:
+      self.flushing = False
+      self.condition.notify_all()
+
+  # Returns the records in the valid prefix of the log, in LSN order,
+  # and continues numbering new records after them.
+  def recover(self):
+    with self.condition:
+      self.file.seek(0)
+      buffer  = self.file.readall()
+      records = []
+      offset  = 0
+      while True:
+        (record, offset) = LogRecord.unpack(buffer, offset)
+        if record is None:
+          break
+        records.append(record)
+
+      # Drop any torn record following the valid prefix.
+      if offset < len(buffer):
+        self.file.truncate(offset)
+
+      if records:
+        self.nextLSN    = max(self.nextLSN, records[-1].lsn + 1)
+        self.durableLSN = max(self.durableLSN, records[-1].lsn)
+      return records
+
+  # Discards all records, once their changes are durable in the storage files.
+  def truncate(self):
+    self.flush()
+    with self.condition:
+      self.file.truncate(0)
+      os.fsync(self.file.fileno())
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
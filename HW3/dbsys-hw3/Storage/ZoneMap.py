@@ -0,0 +1,240 @@
+import ast, os, os.path
+from struct import Struct
+
+from Catalog.Schema import Types
+
+class ZoneMap:
+  """
+  A zone map for a storage file, recording the tuple count and the minimum
+  and maximum value of each numeric field for every page in the file.
+  Fields whose types are encoded to order as raw bytes (i.e., dates and
+  decimals) are tracked by their packed bytes, and predicate constants on
+  them are encoded before comparison.
+
+  Zone maps are conservative: deletions only decrement the page's tuple
+  count, and updates only widen the value ranges. A page's zone can also be
+  recomputed from the page contents with 'refresh'.
+
+  Pages may be tested against a list of range predicates, each given
+  as a (field, operator, constant) triple. A page is skipped when its zone
+  proves that no tuple satisfies all the predicates.
+
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('lineitem', [('orderkey', 'int'), ('shipdate', 'int'), ('comment', 'char(8)')])
+  >>> zm = ZoneMap(schema)
+  >>> zm.fields
+  ['orderkey', 'shipdate']
+
+  >>> for i in range(10):
+  ...   zm.insertTuple(i // 5, schema.pack(schema.instantiate(i, 19940101 + i, 'x')))
+  ...
+
+  >>> zm.zone(1)
+  [5, [5, 19940106], [9, 19940110]]
+
+  >>> [zm.mayMatch(i, [('shipdate', '>=', 19940107)]) for i in range(3)]
+  [False, True, True]
+
+  >>> [zm.mayMatch(i, [('orderkey', '<', 5), ('shipdate', '<', 19940103)]) for i in range(2)]
+  [True, False]
+
+  # Fields without zone map entries do not restrict pages.
+  >>> zm.mayMatch(0, [('comment', '==', 'y')])
+  True
+
+  # Pages without tuples never match.
+  >>> for i in range(5):
+  ...   zm.deleteTuple(1)
+  ...
+  >>> zm.mayMatch(1, [])
+  False
+
+  >>> zm.save('test.zmap')
+  >>> ZoneMap.load('test.zmap', schema).zones == zm.zones
+  True
+
+  >>> os.remove('test.zmap')
+
+  # Range predicates may be extracted from a conjunctive selection predicate.
+  >>> ZoneMap.rangesFromPredicate("shipdate >= 19940101 and 19950101 > shipdate and comment == 'x'", schema)
+  [('shipdate', '>=', 19940101), ('shipdate', '<', 19950101), ('comment', '==', 'x')]
+
+  >>> ZoneMap.rangesFromPredicate("shipdate == 'x' and comment < 5", schema)
+  []
+
+  >>> ZoneMap.rangesFromPredicate("shipdate >= 19940101 or orderkey == 1", schema)
+  []
+
+  >>> dschema = DBSchema('orders', [('orderdate', 'date'), ('price', 'decimal(10,2)')])
+  >>> zm = ZoneMap(dschema)
+  >>> for (i, d) in enumerate(['1994-01-05', '1994-02-01', '1995-03-01', '1995-06-30']):
+  ...   zm.insertTuple(i // 2, dschema.pack(dschema.instantiate(d, i * 10.5)))
+  ...
+  >>> ranges = ZoneMap.rangesFromPredicate("orderdate >= '1995-01-01' and price < 30", dschema)
+  >>> ranges, [zm.mayMatch(i, ranges) for i in range(2)]
+  ([('orderdate', '>=', '1995-01-01'), ('price', '<', 30)], [False, True])
+
+  >>> zm.save('test.zmap')
+  >>> ZoneMap.load('test.zmap', dschema).zones == zm.zones
+  True
+  >>> os.remove('test.zmap')
+  """
+
+  numericFormats = 'bBhHiIqQfd'
+
+  countRepr = Struct("=I")
+
+  # Operators supported in range predicates, and their mirrored forms.
+  comparisons = {
+      ast.Lt: ('<', '>'), ast.LtE: ('<=', '>='), ast.Gt: ('>', '<'),
+      ast.GtE: ('>=', '<='), ast.Eq: ('==', '=='), ast.NotEq: ('!=', '!=')
+    }
+
+  # Tests whether a zone with the given minimum and maximum may contain
+  # a value satisfying a predicate with each operator.
+  rangeTests = {
+      '<'  : lambda lo, hi, v: lo < v,
+      '<=' : lambda lo, hi, v: lo <= v,
+      '>'  : lambda lo, hi, v: hi > v,
+      '>=' : lambda lo, hi, v: hi >= v,
+      '==' : lambda lo, hi, v: lo <= v <= hi,
+      '!=' : lambda lo, hi, v: not (lo == hi == v)
+    }
+
+  def __init__(self, schema, **kwargs):
+    self.schema    = schema
+    self.positions = [i for (i, (fmt, t, d)) in enumerate(zip(schema.formats, schema.types, schema.encoders)) \
+                        if d is None and (fmt[-1] in ZoneMap.numericFormats or Types.isOrdered(t))]
+    self.fields    = [schema.fields[i] for i in self.positions]
+    self.fieldMap  = dict([(f, i) for (i, f) in enumerate(self.fields)])
+    self.encoders  = [Types.converters(schema.types[i])[0] for i in self.positions]
+    self.entryRepr = Struct("=I" + ''.join([schema.formats[i] for i in self.positions]) * 2)
+    self.zones     = kwargs.get("zones", [])
+
+  def numPages(self):
+    return len(self.zones)
+
+  def zone(self, pageIndex):
+    self.ensure(pageIndex)
+    return self.zones[pageIndex]
+
+  def count(self, pageIndex):
+    return self.zone(pageIndex)[0]
+
+  # Extends the zone map with empty zones up to the given page.
+  def ensure(self, pageIndex):
+    while len(self.zones) <= pageIndex:
+      self.zones.append([0, None, None])
+
+  # Drops the zones of pages truncated from the file.
+  def truncate(self, numPages):
+    del self.zones[numPages:]
+
+  def values(self, tupleData):
+    values = self.schema.binrepr.unpack(tupleData)
+    return [values[i] for i in self.positions]
+
+  # Widens the value ranges of a page's zone to include the given tuple.
+  def widen(self, pageIndex, tupleData):
+    zone   = self.zone(pageIndex)
+    values = self.values(tupleData)
+    if zone[1] is None:
+      zone[1], zone[2] = values, list(values)
+    else:
+      zone[1] = [min(a, b) for (a, b) in zip(zone[1], values)]
+      zone[2] = [max(a, b) for (a, b) in zip(zone[2], values)]
+
+  # Zone maintenance
+  def insertTuple(self, pageIndex, tupleData):
+    self.widen(pageIndex, tupleData)
+    self.zone(pageIndex)[0] += 1
+
+  def updateTuple(self, pageIndex, tupleData):
+    self.widen(pageIndex, tupleData)
+
+  def deleteTuple(self, pageIndex):
+    zone = self.zone(pageIndex)
+    zone[0] = max(0, zone[0] - 1)
+    if zone[0] == 0:
+      zone[1], zone[2] = None, None
+
+  # Recomputes a page's zone from its contents.
+  def refresh(self, pageIndex, page):
+    self.zone(pageIndex)
+    self.zones[pageIndex] = [0, None, None]
+    for tupleData in page:
+      self.insertTuple(pageIndex, tupleData)
+
+  # Returns whether any tuple in the page may satisfy all the given range predicates.
+  def mayMatch(self, pageIndex, ranges):
+    if pageIndex >= len(self.zones):
+      return True
+
+    (count, mins, maxs) = self.zones[pageIndex]
+    if count == 0:
+      return False
+
+    for (field, op, value) in ranges:
+      i = self.fieldMap.get(field, None)
+      if i is not None:
+        try:
+          value = self.encoders[i](value) if self.encoders[i] else value
+        except (ValueError, TypeError, ArithmeticError):
+          continue
+        if not ZoneMap.rangeTests[op](mins[i], maxs[i], value):
+          return False
+    return True
+
+  # Zone map serialization
+  def save(self, path):
+    empty = [b'' if self.schema.formats[i].endswith('s') else 0 for i in self.positions]
+    with open(path, 'wb') as f:
+      f.write(ZoneMap.countRepr.pack(len(self.zones)))
+      for (count, mins, maxs) in self.zones:
+        f.write(self.entryRepr.pack(count, *((mins or empty) + (maxs or empty))))
+
+  @classmethod
+  def load(cls, path, schema):
+    zoneMap = cls(schema)
+    if os.path.exists(path):
+      with open(path, 'rb') as f:
+        buffer = f.read()
+      numPages = ZoneMap.countRepr.unpack_from(buffer)[0]
+      offset   = ZoneMap.countRepr.size
+      width    = len(zoneMap.positions)
+      for i in range(numPages):
+        values = list(zoneMap.entryRepr.unpack_from(buffer, offset))
+        offset += zoneMap.entryRepr.size
+        if values[0]:
+          zoneMap.zones.append([values[0], values[1:1+width], values[1+width:]])
+        else:
+          zoneMap.zones.append([0, None, None])
+    return zoneMap
+
+  # Extracts (field, operator, constant) range predicates from the conjuncts
+  # of a selection predicate that compare a schema field to a constant of the
+  # field's type, i.e., a number for numeric fields, or a string for character and date fields.
+  @classmethod
+  def rangesFromPredicate(cls, expr, schema):
+    tree = ast.parse(expr, mode='eval').body
+    conjuncts = tree.values if isinstance(tree, ast.BoolOp) and isinstance(tree.op, ast.And) else [tree]
+
+    ranges = []
+    for c in conjuncts:
+      if isinstance(c, ast.Compare) and len(c.ops) == 1 and type(c.ops[0]) in ZoneMap.comparisons:
+        (op, mirrored) = ZoneMap.comparisons[type(c.ops[0])]
+        (lhs, rhs) = (c.left, c.comparators[0])
+        if isinstance(rhs, ast.Name) and isinstance(lhs, ast.Constant):
+          (lhs, rhs, op) = (rhs, lhs, mirrored)
+        if isinstance(lhs, ast.Name) and lhs.id in schema.fields and cls.isFieldConstant(rhs, schema, lhs.id):
+          ranges.append((lhs.id, op, rhs.value))
+    return ranges
+
+  @classmethod
+  def isFieldConstant(cls, node, schema, field):
+    isChar = schema.types[schema.fields.index(field)].startswith(Types.charPrefixes + ('date',))
+    return isinstance(node, ast.Constant) and type(node.value) in ((str,) if isChar else (int, float))
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
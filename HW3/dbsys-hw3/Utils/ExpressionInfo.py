@@ -1,7 +1,10 @@
 import ast
+import copy
 import io
 import Utils.unparse as unparse
 
+from Catalog.Schema import DBSchema
+
 # Extract information from an eval'able expression
 class ExpressionInfo(ast.NodeVisitor):
   def __init__(self, expr):
@@ -41,3 +44,385 @@ class ExpressionInfo(ast.NodeVisitor):
 
   def isAttribute(self):
     return self.onlyNames
+
+
+class CompiledExpression:
+  """
+  An expression compiled once into a function over the raw struct values of
+  packed tuples, i.e., as produced by the 'binrepr.unpack' of their schemas.
+  Expressions are given as strings, or as parsed 'eval' mode syntax trees.
+
+  Field references are bound to positions in the tuples of the given input
+  schemas, with later schemas taking precedence for repeated names. Only the
+  referenced fields are converted (e.g., character fields are decoded), and
+  evaluation needs no environment dictionary. Other names are looked up in
+  the given global environment, as with eval. With 'decode' false,
+  dictionary-encoded fields are bound to their codes.
+
+  Expressions that bind names of their own (e.g., comprehensions or lambdas)
+  are instead evaluated over a dictionary of all fields.
+
+  The optional 'rowNames' keyword argument names the tuple arguments, and
+  with 'raw' false, tuples hold field values rather than struct values, and
+  are used without conversion. Compiled expressions may be inlined into
+  generated code with 'inline', as a syntax tree over the named tuples.
+
+  >>> from Catalog.Schema import DBSchema
+  >>> schema = DBSchema('employee', [('id', 'int'), ('name', 'char(10)'), ('age', 'int')])
+  >>> e1 = schema.pack(schema.instantiate(1, 'alice', 25))
+  >>> e = CompiledExpression("age > 20 and name.startswith('a')", [schema])
+  >>> e.fields, e.evaluate(e1), e.function(schema.binrepr.unpack(e1))
+  (['age', 'name'], True, True)
+
+  >>> import math
+  >>> dept = DBSchema('dept', [('dept', 'int'), ('budget', 'double')])
+  >>> d1 = dept.pack(dept.instantiate(7, 1000.0))
+  >>> CompiledExpression("(id * 2, budget / age, math.floor(budget / 3))", [schema, dept], {'math': math}).evaluate(e1, d1)
+  (2, 40.0, 333)
+
+  >>> CompiledExpression("sum(x for x in [id, age])", [schema]).evaluate(e1)
+  26
+
+  >>> conjuncts = [CompiledExpression(c, [schema]) for c in ["name == 'bob'", "age > 20"]]
+  >>> f = CompiledExpression.conjunction(conjuncts[::-1])
+  >>> f(schema.binrepr.unpack(e1)), f(schema.binrepr.unpack(schema.pack(schema.instantiate(2, 'bob', 30))))
+  (False, True)
+
+  >>> e = CompiledExpression("name.upper()", [schema], rowNames=['row'], raw=False)
+  >>> (tree, env) = e.inline('f')
+  >>> eval(compile(ast.Expression(body=tree), '<test>', 'eval'), env, {'row': (1, 'alice', 25)})
+  'ALICE'
+  """
+
+  # Expressions that introduce their own name bindings.
+  scopedNodes = (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp) \
+                  + ((ast.NamedExpr,) if hasattr(ast, 'NamedExpr') else ())
+
+  def __init__(self, expr, schemas, environment=None, decode=True, **kwargs):
+    self.expr        = expr
+    self.schemas     = schemas
+    self.rowNames    = kwargs.get("rowNames", ['__row' + str(k) for k in range(len(schemas))])
+    self.unpackers   = [schema.binrepr.unpack for schema in schemas]
+    self.environment = dict(environment) if environment is not None else {}
+    self.boundTree   = None
+
+    raw = kwargs.get("raw", True)
+    self.converters  = [dict(schema.unpackers if decode else schema.codeUnpackers) if raw else {} for schema in schemas]
+
+    # Field bindings as (tuple index, field index) pairs.
+    self.bindings = {}
+    for (k, schema) in enumerate(schemas):
+      for (i, f) in enumerate(schema.fields):
+        self.bindings[f] = (k, i)
+
+    tree = copy.deepcopy(expr) if isinstance(expr, ast.Expression) else ast.parse(expr.strip(), mode='eval')
+    self.fields = sorted(set(n.id for n in ast.walk(tree) if isinstance(n, ast.Name) and n.id in self.bindings))
+    if any(isinstance(n, CompiledExpression.scopedNodes) for n in ast.walk(tree)):
+      self.function = self.compileEnvironment(tree)
+    else:
+      self.function = self.compileBindings(tree)
+
+  # Compiles the expression into a lambda with one argument per input tuple,
+  # replacing each field reference by an access to its position.
+  def compileBindings(self, tree):
+    lambdaTree = ast.parse('lambda ' + ', '.join(self.rowNames) + ': None', mode='eval')
+    lambdaTree.body.body = FieldBinder(self).visit(tree.body)
+    ast.fix_missing_locations(lambdaTree)
+    self.boundTree = copy.deepcopy(lambdaTree.body.body)
+    return eval(compile(lambdaTree, '<expression>', 'eval'), self.environment)
+
+  # Compiles the expression for evaluation over a dictionary of all fields.
+  def compileEnvironment(self, tree):
+    code   = compile(tree, '<expression>', 'eval')
+    fields = [(schema.fields, sorted(converters.items())) for (schema, converters) in zip(self.schemas, self.converters)]
+    def evaluate(*rows):
+      env = {}
+      for ((names, converters), row) in zip(fields, rows):
+        env.update(zip(names, DBSchema.convert(row, converters)))
+      return eval(code, self.environment, env)
+    return evaluate
+
+  # Returns the name bound in the global environment to a field's converter, if any.
+  def converterName(self, tupleIndex, fieldIndex):
+    converter = self.converters[tupleIndex].get(fieldIndex, None)
+    if converter:
+      name = '__convert' + self.rowNames[tupleIndex] + '_' + str(fieldIndex)
+      self.environment[name] = converter
+      return name
+
+  # Returns a syntax tree of the expression over the named tuples, and the
+  # global environment it requires. Expressions without field bindings are
+  # inlined as a call to their function, bound to the given name.
+  def inline(self, name):
+    if self.boundTree is not None:
+      return (copy.deepcopy(self.boundTree), self.environment)
+    call = ast.parse(name + '(' + ', '.join(self.rowNames) + ')', mode='eval').body
+    return (call, dict(self.environment, **{name: self.function}))
+
+  # Returns a function evaluating the conjunction of compiled expressions over
+  # the same named tuples, in the given order and with short-circuiting.
+  @classmethod
+  def conjunction(cls, exprs):
+    (trees, environment) = ([], {})
+    for (i, expr) in enumerate(exprs):
+      (tree, env) = expr.inline('__conjunct' + str(i))
+      trees.append(tree)
+      environment.update(env)
+
+    lambdaTree = ast.parse('lambda ' + ', '.join(exprs[0].rowNames) + ': None', mode='eval')
+    lambdaTree.body.body = ast.BoolOp(op=ast.And(), values=trees) if len(trees) > 1 else trees[0]
+    ast.fix_missing_locations(lambdaTree)
+    return eval(compile(lambdaTree, '<expression>', 'eval'), environment)
+
+  # Evaluates the expression over packed tuples, one for each input schema.
+  def evaluate(self, *tuples):
+    return self.function(*[unpack(t) for (unpack, t) in zip(self.unpackers, tuples)])
+
+
+class FieldBinder(ast.NodeTransformer):
+  """
+  Rewrites field references in an expression into positional accesses
+  of the struct values of the tuples of a compiled expression.
+  """
+  def __init__(self, compiled):
+    self.compiled = compiled
+
+  def visit_Name(self, node):
+    binding = self.compiled.bindings.get(node.id, None)
+    if binding is None or not isinstance(node.ctx, ast.Load):
+      return node
+
+    (k, i)    = binding
+    access    = self.compiled.rowNames[k] + '[' + str(i) + ']'
+    converter = self.compiled.converterName(k, i)
+    source    = converter + '(' + access + ')' if converter else access
+    return ast.copy_location(ast.parse(source, mode='eval').body, node)
+
+
+# Returns the source of an expression syntax tree.
+def toSource(tree):
+  s = io.StringIO()
+  unparse.Unparser(tree, s)
+  return s.getvalue().strip()
+
+
+class ConstantFolder(ast.NodeTransformer):
+  """
+  Folds subexpressions over constants into their values, bottom-up, e.g.,
+  date and price bounds written as arithmetic over literals. Subexpressions
+  are evaluated without builtins, and are left as is if evaluation fails or
+  the result would be large (i.e., long repeated strings, large powers and
+  shifts, or integers of more than 'maxBits' bits).
+
+  >>> ConstantFolder.fold("0.05 - 0.01 <= discount <= 0.05 + 0.01 and price * (2 + 3) > -(1)")
+  '((0.04 <= discount <= 0.060000000000000005) and ((price * 5) > (-1)))'
+  >>> ConstantFolder.fold("name == 'ab' * 2 or 1 / 0 > x")
+  "((name == 'abab') or ((1 / 0) > x))"
+
+  >>> ConstantFolder.fold("name == 'x' * 10 ** 9 or id < 2 ** 100000")
+  "((name == ('x' * 1000000000)) or (id < (2 ** 100000)))"
+  >>> ConstantFolder.fold("x < ((9 ** 64) ** 64) ** 64")
+  '(x < ((11790184577738583171520872861412518665678211592275841109096961 ** 64) ** 64))'
+
+  # Expressions without constant subexpressions are returned unchanged.
+  >>> ConstantFolder.fold("price*2 > 40")
+  'price*2 > 40'
+  """
+
+  foldable    = (ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp)
+  valueTypes  = (bool, int, float, str)
+  maxExponent = 64
+  maxLength   = 1024
+  maxBits     = 1024
+
+  def __init__(self):
+    self.folded = 0
+
+  # Returns the expression with constants folded, or the original expression
+  # if there is nothing to fold.
+  @classmethod
+  def fold(cls, expr):
+    folder = cls()
+    try:
+      tree = folder.visit(ast.parse(expr.strip(), mode='eval'))
+      return toSource(tree.body) if folder.folded else expr
+    except (SyntaxError, ValueError, RecursionError):
+      return expr
+
+  def generic_visit(self, node):
+    node = super().generic_visit(node)
+    if not isinstance(node, self.foldable) or not self.isFoldable(node):
+      return node
+
+    try:
+      tree  = ast.fix_missing_locations(ast.Expression(body=node))
+      value = eval(compile(tree, '<fold>', 'eval'), {'__builtins__': {}})
+    except Exception:
+      return node
+
+    if type(value) not in self.valueTypes or (type(value) is int and value.bit_length() > self.maxBits):
+      return node
+
+    self.folded += 1
+    return ast.copy_location(ast.Constant(value=value), node)
+
+  # Checks that all operands are constants, and guards against operations
+  # with large results (e.g., '2 ** 10000' or "'x' * 10 ** 9"), before
+  # they are evaluated.
+  def isFoldable(self, node):
+    operands = [child for child in ast.iter_child_nodes(node) if isinstance(child, ast.expr)]
+    if not all(isinstance(operand, ast.Constant) for operand in operands):
+      return False
+
+    if isinstance(node, ast.BinOp):
+      (lhs, rhs) = (node.left.value, node.right.value)
+      if isinstance(node.op, (ast.Pow, ast.LShift)):
+        return isinstance(rhs, (int, float)) and abs(rhs) <= self.maxExponent
+      if isinstance(node.op, ast.Mult):
+        sequences = [v for v in (lhs, rhs) if isinstance(v, (str, bytes))]
+        counts    = [v for v in (lhs, rhs) if isinstance(v, int)]
+        if sequences and counts:
+          return len(sequences[0]) * counts[0] <= self.maxLength
+    return True
+
+
+class PredicateInference:
+  """
+  Infers predicates implied by equalities between fields, e.g., between the
+  keys of an inner equi-join. Predicates over a single field, composed of
+  comparisons, arithmetic and constants, are restated for every field known
+  to be equal to it. Equalities are given as pairs of field names, and are
+  also taken from the conjuncts of the form 'a == b'.
+
+  >>> PredicateInference.infer(["id < 5", "id == eid", "eid % 2 == 1", "name.startswith('a')"], [('eid', 'did')])
+  ['(eid < 5)', '(did < 5)', '((id % 2) == 1)', '((did % 2) == 1)']
+
+  # Predicates already present are not inferred again.
+  >>> PredicateInference.infer(["id < 5", "eid < 5"], [('id', 'eid')])
+  []
+  """
+
+  operandNodes = (ast.Compare, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Constant, ast.Name)
+
+  # Returns the inferred conjuncts not already among the given conjuncts.
+  @classmethod
+  def infer(cls, conjuncts, equalities):
+    trees = []
+    for conjunct in conjuncts:
+      try:
+        trees.append(ast.parse(conjunct.strip(), mode='eval').body)
+      except SyntaxError:
+        continue
+
+    equalities = list(equalities) + [cls.equality(tree) for tree in trees if cls.equality(tree)]
+    classes    = cls.equivalenceClasses(equalities)
+    present    = set(ast.dump(tree) for tree in trees)
+
+    inferred = []
+    for tree in trees:
+      field = cls.predicateField(tree)
+      for other in classes.get(field, []):
+        if other != field:
+          newTree = FieldRenamer(field, other).visit(copy.deepcopy(tree))
+          if ast.dump(newTree) not in present:
+            present.add(ast.dump(newTree))
+            inferred.append(toSource(newTree))
+    return inferred
+
+  # Returns the pair of fields of an equality conjunct 'a == b', or None.
+  @classmethod
+  def equality(cls, tree):
+    if isinstance(tree, ast.Compare) and len(tree.ops) == 1 and isinstance(tree.ops[0], ast.Eq) \
+        and isinstance(tree.left, ast.Name) and isinstance(tree.comparators[0], ast.Name) \
+        and tree.left.id != tree.comparators[0].id:
+      return (tree.left.id, tree.comparators[0].id)
+    return None
+
+  # Returns a dictionary mapping each field to the list of fields equal to it.
+  @classmethod
+  def equivalenceClasses(cls, equalities):
+    classes = {}
+    for (a, b) in equalities:
+      (classA, classB) = (classes.get(a, [a]), classes.get(b, [b]))
+      if classA is not classB:
+        merged = classA + classB
+        for f in merged:
+          classes[f] = merged
+    return classes
+
+  # Returns the single field referenced by a comparison predicate, or None
+  # if the predicate references several fields or non-arithmetic operations.
+  @classmethod
+  def predicateField(cls, tree):
+    if not isinstance(tree, (ast.Compare, ast.BoolOp)):
+      return None
+
+    nodes = [node for node in ast.walk(tree) if isinstance(node, ast.expr)]
+    names = set(node.id for node in nodes if isinstance(node, ast.Name))
+    if len(names) != 1 or not all(isinstance(node, cls.operandNodes) for node in nodes):
+      return None
+    return names.pop()
+
+
+class FieldRenamer(ast.NodeTransformer):
+  """
+  Replaces references to a field with references to another field.
+  """
+  def __init__(self, field, newField):
+    self.field    = field
+    self.newField = newField
+
+  def visit_Name(self, node):
+    if node.id == self.field:
+      return ast.copy_location(ast.Name(id=self.newField, ctx=node.ctx), node)
+    return node
+
+
+class SubexpressionReplacer(ast.NodeTransformer):
+  """
+  Replaces subexpressions structurally equal to any of the given expressions
+  by a name, e.g., to reuse the values of a projection's output fields.
+  Returns the new expression, the names substituted, the names remaining
+  from the original expression, and the names substituted anywhere other
+  than as a direct operand of a comparison.
+
+  >>> predicate = "age * 2 > 40 and id < n and str(age * 2)"
+  >>> (expr, replaced, names, uncompared) = SubexpressionReplacer.replace(predicate, {'age*2': 'age2', 'id': 'key'})
+  >>> expr, sorted(replaced), sorted(names), uncompared
+  ('((age2 > 40) and (key < n) and str(age2))', ['age2', 'key'], ['n', 'str'], {'age2'})
+  """
+  def __init__(self, replacements):
+    self.replacements = dict((ast.dump(ast.parse(e.strip(), mode='eval').body), name) \
+                               for (e, name) in replacements.items())
+    self.replaced     = set()
+    self.names        = set()
+    self.uncompared   = set()
+    self.operands     = set()
+
+  @classmethod
+  def replace(cls, expr, replacements):
+    replacer = cls(replacements)
+    tree     = replacer.visit(ast.parse(expr.strip(), mode='eval'))
+    return (toSource(tree.body), replacer.replaced, replacer.names, replacer.uncompared)
+
+  def visit(self, node):
+    name = self.replacements.get(ast.dump(node)) if isinstance(node, ast.expr) else None
+    if name is None:
+      return super().visit(node)
+
+    self.replaced.add(name)
+    if id(node) not in self.operands:
+      self.uncompared.add(name)
+    return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+  def visit_Compare(self, node):
+    self.operands.update(id(operand) for operand in [node.left] + node.comparators)
+    return self.generic_visit(node)
+
+  def visit_Name(self, node):
+    self.names.add(node.id)
+    return node
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -36,6 +36,13 @@ class WorkloadGenerator:
   >>> [wg.schemas['orders'].unpack(t).O_ORDERKEY for t in db.storageEngine().tuples('orders')] # doctest:+ELLIPSIS
   [1, 2, 3, ..., 582]
 
+  # Clustered relations are stored in date order.
+  >>> wg.createRelations(db, clustered=True)
+  >>> wg.loadDataset(db, 'test/datasets/tpch-tiny', 1.0)
+  >>> dates = [wg.schemas['lineitem'].unpack(t).L_SHIPDATE for t in db.storageEngine().tuples('lineitem')]
+  >>> dates == sorted(dates)
+  True
+
   >>> db.close()
   >>> shutil.rmtree(db.fileManager().dataDir)
   >>> del db
@@ -178,12 +185,32 @@ class WorkloadGenerator:
 
     return CSVParser("|", fieldParsers)
 
+  # Low-cardinality character fields that may be stored with dictionary encoding.
+  encodedFields = {
+      'lineitem' : ['L_RETURNFLAG', 'L_LINESTATUS', 'L_SHIPINSTRUCT', 'L_SHIPMODE'],
+      'orders'   : ['O_ORDERSTATUS', 'O_ORDERPRIORITY'],
+      'customer' : ['C_MKTSEGMENT']
+    }
+
+  # Date fields by which the large relations may be clustered.
+  clusterKeys = {
+      'lineitem' : 'L_SHIPDATE',
+      'orders'   : 'O_ORDERDATE'
+    }
+
   # Create the TPC-H relations in the given storage engine, removing if already present.
-  def createRelations(self, db):
+  # With 'encoded' set, low-cardinality character fields use dictionary encoding.
+  # With 'clustered' set, relations with a clustering key are kept sorted on it,
+  # and maintain zone maps for range predicates.
+  def createRelations(self, db, encoded=False, clustered=False):
     for i in self.schemas:
       if db.hasRelation(i):
         db.removeRelation(i)
-      db.createRelation(i, self.schemas[i].schema())
+      encodedFields = WorkloadGenerator.encodedFields.get(i, []) if encoded else []
+      storageArgs   = {}
+      if clustered and i in WorkloadGenerator.clusterKeys:
+        storageArgs = {'clusterKey': WorkloadGenerator.clusterKeys[i], 'zoneMaps': True}
+      db.createRelation(i, self.schemas[i].schema(), encodedFields=encodedFields, **storageArgs)
 
   # Load the CSV files corresponding to the TPC-H relations into the given storage engine.
   # This method (naively) samples the dataset based on the scale factor.
@@ -194,15 +221,12 @@ class WorkloadGenerator:
         filePath = os.path.join(datadir, i+".csv")
         if os.path.exists(filePath):
           with open(filePath) as f:
-            self.tupleIds[i] = []
-            for line in f:
-              if random.random() <= scaleFactor:
-                tup = self.schemas[i].instantiate(*(self.parsers[i].parse(line)))
-                tupleId = db.insertTuple(i, self.schemas[i].pack(tup))
-                if tupleId is not None:
-                  self.tupleIds[i].append(tupleId)
-                else:
-                  raise ValueError("Failed to insert tuple")
+            schema = db.relationSchema(i)
+            tuples = [schema.pack(schema.instantiate(*(self.parsers[i].parse(line)))) \
+                        for line in f if random.random() <= scaleFactor]
+            self.tupleIds[i] = db.bulkLoad(i, tuples)
+            if any(tupleId is None for tupleId in self.tupleIds[i]):
+              raise ValueError("Failed to insert tuple")
         else:
           raise ValueError("Could not find file: " + filePath)
       else:
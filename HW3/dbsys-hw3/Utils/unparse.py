@@ -325,13 +325,25 @@ class Unparser:
     def _Name(self, t):
         self.write(t.id)
 
+    def _NameConstant(self, t):
+        self.write(repr(t.value))
+
+    # Python 3.8+ represents all literals as constants.
+    def _Constant(self, t):
+        if t.value is Ellipsis:
+            self.write("...")
+        elif isinstance(t.value, (int, float, complex)) and not isinstance(t.value, bool):
+            self._Num(t)
+        else:
+            self.write(repr(t.value))
+
     def _Repr(self, t):
         self.write("`")
         self.dispatch(t.value)
         self.write("`")
 
     def _Num(self, t):
-        repr_n = repr(t.n)
+        repr_n = repr(t.value if isinstance(t, ast.Constant) else t.n)
         # Parenthesize negative numbers, to avoid turning (-1)**2 into -1**2.
         if repr_n.startswith("-"):
             self.write("(")
@@ -486,18 +498,22 @@ class Unparser:
             if comma: self.write(", ")
             else: comma = True
             self.dispatch(e)
-        if t.starargs:
+        if getattr(t, "starargs", None):
             if comma: self.write(", ")
             else: comma = True
             self.write("*")
             self.dispatch(t.starargs)
-        if t.kwargs:
+        if getattr(t, "kwargs", None):
             if comma: self.write(", ")
             else: comma = True
             self.write("**")
             self.dispatch(t.kwargs)
         self.write(")")
 
+    def _Starred(self, t):
+        self.write("*")
+        self.dispatch(t.value)
+
     def _Subscript(self, t):
         self.dispatch(t.value)
         self.write("[")